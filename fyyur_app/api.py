@@ -0,0 +1,104 @@
+"""Helpers for the JSON read API (/api/v1).
+
+List responses are produced by a generator and written row by row, so a
+page of any size goes out with flat memory: rows are fetched from the
+database in chunks (``yield_per``) and each is encoded and sent before the
+next is read. The cursor to the next page follows the rows in the body,
+since it is only known once the last one has been seen.
+
+orjson is used for encoding when installed, the stdlib json otherwise.
+"""
+
+from datetime import date, datetime
+
+from flask import Response, request, stream_with_context
+
+from pagination import encode_cursor, seek
+
+try:
+  import orjson
+except ImportError:  # pragma: no cover - optional speedup
+  orjson = None
+  import json
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+FETCH_CHUNK = 500
+
+
+def _default(value):
+  if isinstance(value, (datetime, date)):
+    return value.isoformat()
+  raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+  def dumps(obj):
+    return orjson.dumps(obj, default=_default)
+else:
+  def dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), default=_default).encode()
+
+
+def json_response(obj, status=200):
+  return Response(dumps(obj), status=status, mimetype='application/json')
+
+
+def error_response(status, message):
+  return json_response({'error': {'status': status, 'message': message}}, status)
+
+
+def requested_fields(allowed, default=None):
+  """Return the field names asked for with ``?fields=a,b``.
+
+  Raises ``ValueError`` naming any field that is not in ``allowed``.
+  """
+  raw = request.args.get('fields')
+  if not raw:
+    return list(default or allowed)
+  fields = [name.strip() for name in raw.split(',') if name.strip()]
+  unknown = [name for name in fields if name not in allowed]
+  if unknown:
+    raise ValueError(f"unknown field(s): {', '.join(unknown)}")
+  return fields
+
+
+def requested_limit():
+  limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+  return max(1, min(limit, MAX_LIMIT))
+
+
+def item(row, fields, converters=None):
+  """The ``fields`` of ``row`` as a dict, passed through ``converters[name]``
+  where one is given."""
+  converters = converters or {}
+  return {name: converters[name](getattr(row, name)) if name in converters
+          else getattr(row, name) for name in fields}
+
+
+def stream_list(query, columns, fields, after=None, limit=DEFAULT_LIMIT, converters=None):
+  """Stream one page of ``query`` rows as ``{"data": [...], "next_cursor": ...}``.
+
+  ``columns`` is the unique sort key used for the cursor (its values must
+  be selected by ``query`` under the same names); ``fields`` are the row
+  attributes written for each item, see :func:`item`. Raises
+  ``ValueError`` for a bad cursor before anything is sent.
+  """
+  rows = seek(query, columns, after).limit(limit + 1).yield_per(FETCH_CHUNK)
+  names = [column.key for column in columns]
+
+  def generate():
+    yield b'{"data":['
+    last = None
+    for count, row in enumerate(rows):
+      if count == limit:
+        cursor = encode_cursor([getattr(last, name) for name in names])
+        yield b'],"next_cursor":' + dumps(cursor) + b'}'
+        return
+      if count:
+        yield b','
+      yield dumps(item(row, fields, converters))
+      last = row
+    yield b'],"next_cursor":null}'
+
+  return Response(stream_with_context(generate()), mimetype='application/json')
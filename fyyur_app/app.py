@@ -3,220 +3,591 @@
 #----------------------------------------------------------------------------#
 
 import json
+import os
+import signal
+from datetime import timedelta
+from functools import lru_cache
+from itertools import groupby
+from weakref import WeakSet
 import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Blueprint, Flask, current_app, render_template, stream_template, request, Response, flash, redirect, send_from_directory, url_for, abort
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import FlaskForm
+from wtforms.fields.core import UnboundField
 from forms import *
 from flask_migrate import Migrate
+from assets import Assets
+from cache import PageCache, conditional
+from facets import Facet, criteria, facet_counts, selection
+from formatting import format_datetime, to_datetime
+from instrumentation import Instrumentation
+from jobs import JobQueue, Worker
+import importer
+import api
+import geo
+import media
+import config
+from models import *
+from pagination import keyset_page
+from replicas import BIND_PREFIX, ReplicaRouter, replica_uris
+from search import PAGE_SIZE, search_by_name
+from typeahead import Typeahead
 import sys
+import click
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app, session_options={'expire_on_commit': False})
-migrate = Migrate(app, db)
-# TODO: connect to a local postgresql database
-
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///fyyur'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-#----------------------------------------------------------------------------#
-# Models.
-#----------------------------------------------------------------------------#
-
-class Venue(db.Model):
-    __tablename__ = 'Venue'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    address = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
-    facebook_link = db.Column(db.String(120))
-    website = db.Column(db.String(120))
-    seeking_talent = db.Column(db.Boolean, default=False)
-    seeking_description = db.Column(db.String(500))
-    genres = db.Column(db.String(120))
-    show = db.relationship("Show", backref="venue", lazy=True)
-    
-    def __repr__(self):
-      return f'{self.name}'
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
-
-class Artist(db.Model):
-    __tablename__ = 'Artist'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
-    facebook_link = db.Column(db.String(120))
-    website = db.Column(db.String(120))
-    seeking_venue = db.Column(db.Boolean, default=False)
-    seeking_description = db.Column(db.String(500))
-    show = db.relationship("Show", backref="artist", lazy=True)
-
-    def __repr__(self):
-      return f'Artist {self.name}'
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
-
-class Show(db.Model):
-  __tablename__ = 'Shows'
-  id = db.Column(db.Integer, primary_key=True)
-  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-  starting_time = db.Column(db.String(120), nullable=False)
-#----------------------------------------------------------------------------#
-# Filters.
-#----------------------------------------------------------------------------#
+# SQLSTATE of an exclusion constraint violation (Postgres)
+EXCLUSION_VIOLATION = '23P01'
+# Default and largest radius (km) of /venues/nearby.
+DEFAULT_NEARBY_KM = 10
+MAX_NEARBY_KM = 500
+# Longest window /venues/<id>/availability answers for.
+AVAILABILITY_SPAN = timedelta(days=92)
+
+moment = Moment()
+migrate = Migrate()
+page_cache = PageCache()
+replicas = ReplicaRouter(db)
+instrumentation = Instrumentation()
+jobs = JobQueue(db, Job)
+assets = Assets()
+typeahead = Typeahead(db)
+bp = Blueprint('main', __name__, cli_group=None)
+
+_apps = WeakSet()
+
+def create_app(config_name=None, **overrides):
+  """Build the Fyyur application.
+
+  ``config_name`` is a profile from ``config.profiles`` ('development',
+  'production', 'testing'; default ``FYYUR_CONFIG``) or a config object;
+  keyword overrides are applied on top, e.g.
+  ``create_app('testing', SQLALCHEMY_DATABASE_URI='sqlite:///t.db')``.
+  """
+  app = Flask(__name__)
+  profile = config_name or config.DEFAULT_PROFILE
+  app.config.from_object(config.profiles[profile] if isinstance(profile, str) else profile)
+  app.config.update(overrides)
+  app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                        engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config))
+  app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **{
+      f'{BIND_PREFIX}{number}': dict(engine_options(uri, app.config), url=uri)
+      for number, uri in enumerate(replica_uris(app.config))})
+
+  moment.init_app(app)
+  db.init_app(app)
+  replicas.init_app(app)
+  # good for one process only; replicas.init_app insists on a shared key
+  app.config['SECRET_KEY'] = app.config['SECRET_KEY'] or os.urandom(32)
+  migrate.init_app(app, db)
+  page_cache.init_app(app)
+  instrumentation.init_app(app)
+  jobs.init_app(app)
+  assets.init_app(app)
+  typeahead.init_app(app)
+  app.register_blueprint(bp)
+  app.jinja_env.filters['datetime'] = format_datetime
+  app.jinja_env.globals['picture'] = media.picture
+
+  if not app.debug and not app.testing:
+    file_handler = FileHandler('error.log')
+    file_handler.setFormatter(
+        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+    )
+    app.logger.setLevel(logging.INFO)
+    file_handler.setLevel(logging.INFO)
+    app.logger.addHandler(file_handler)
+    app.logger.info('errors')
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+  _apps.add(app)
+  return app
+
+def engine_options(uri, settings):
+  # engine options for the database at uri from the DB_* settings
+  url = make_url(uri)
+  options = {'echo': settings.get('DB_ECHO', False)}
+  if url.get_backend_name() == 'sqlite':
+    return options
+  options.update(
+      pool_size=settings['DB_POOL_SIZE'],
+      max_overflow=settings['DB_MAX_OVERFLOW'],
+      pool_timeout=settings['DB_POOL_TIMEOUT'],
+      pool_recycle=settings['DB_POOL_RECYCLE'],
+      pool_pre_ping=settings['DB_POOL_PRE_PING'])
+  if settings.get('DB_STATEMENT_TIMEOUT') and url.get_backend_name() == 'postgresql':
+    options['connect_args'] = {'options': f"-c statement_timeout={settings['DB_STATEMENT_TIMEOUT']}"}
+  return options
+
+def _dispose_pools_after_fork():
+  # A forked worker (gunicorn, uwsgi pre-fork) inherits the parent's pooled
+  # sockets. Drop them from the child's pools without closing them, so the
+  # parent's connections stay intact and the child opens its own.
+  for app in list(_apps):
+    with app.app_context():
+      for engine in db.engines.values():
+        engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):
+  os.register_at_fork(after_in_child=_dispose_pools_after_fork)
+
+# Cached pages are tagged with the rows they render; a committed write to one
+# of these models drops every page carrying one of the tags below.
+page_cache.tag_rule(Venue, lambda venue: {f'venue:{venue.id}', 'venues', 'shows'})
+page_cache.tag_rule(Artist, lambda artist: {f'artist:{artist.id}', 'artists', 'shows'})
+page_cache.tag_rule(Show, lambda show: {
+    f'venue:{show.venue_id}', f'artist:{show.artist_id}', 'venues', 'shows'})
+
+# names offered by /autocomplete
+typeahead.register('venue', Venue)
+typeahead.register('artist', Artist)
+
+#  Jobs
+#  ----------------------------------------------------------------
 
-app.jinja_env.filters['datetime'] = format_datetime
+@jobs.task('refresh_show_stats')
+def refresh_show_stats_job(connection, venue_ids=(), artist_ids=()):
+  refresh_show_stats(connection, venue_ids=venue_ids, artist_ids=artist_ids)
+  # a Core write no ORM hook sees; the listings render the recounted rows
+  jobs.after_commit(connection, lambda: page_cache.invalidate('venues', 'artists'))
+
+@event.listens_for(db.session, 'after_flush')
+def _refresh_stats_for_flushed_shows(session, flush_context):
+  # recount the rollup rows of written shows once their transaction commits
+  shows = [obj for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+           if isinstance(obj, Show)]
+  if shows:
+    jobs.enqueue(session.connection(), 'refresh_show_stats',
+                 venue_ids=sorted({show.venue_id for show in shows}),
+                 artist_ids=sorted({show.artist_id for show in shows}))
+
+@jobs.task('image_derivatives')
+def image_derivatives_job(connection, name):
+  # CPU-bound: resized in the process pool, the worker thread only waits
+  config = current_app.config
+  media.derivative_pool(config['IMAGE_PROCESSES']).submit(
+      media.render_derivatives, config['MEDIA_ROOT'], name).result()
+
+@bp.cli.command('worker')
+@click.option('--threads', type=int, help='Jobs run at once (default: JOBS_WORKER_THREADS).')
+@click.option('--once', is_flag=True, help='Exit once no job is due instead of polling.')
+def worker_command(threads, once):
+  """Run queued background jobs."""
+  config = current_app.config
+  worker = Worker(current_app._get_current_object(), jobs,
+                  threads or config['JOBS_WORKER_THREADS'], config['JOBS_POLL_INTERVAL'])
+  click.echo(f'Worker {worker.id} running {worker.threads} threads.')
+  # finish the running jobs before exiting
+  signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+  try:
+    worker.run(once=once)
+  except KeyboardInterrupt:
+    worker.stop()
+  click.echo(f'{worker.succeeded} jobs done, {worker.failed} failed.')
+
+@bp.cli.command('assets')
+def assets_command():
+  """Fingerprint, bundle and precompress the static files."""
+  manifest = assets.build(current_app._get_current_object())
+  click.echo(f"{len(manifest)} assets written to {current_app.config['ASSETS_ROOT']}.")
+
+@bp.cli.command('refresh-stats')
+@click.option('--full', is_flag=True, help='Rebuild every rollup row instead of only aged ones.')
+def refresh_stats_command(full):
+  """Refresh the venue/artist show-statistics rollup."""
+  with db.engine.begin() as connection:
+    if full:
+      refresh_show_stats(connection)
+    else:
+      refresh_aged_show_stats(connection)
+  click.echo('Show statistics refreshed.')
+
+@bp.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(importer.FORMS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=importer.BATCH_SIZE, show_default=True,
+              help='Rows written per transaction.')
+@click.option('--rejects', type=click.Path(dir_okay=False),
+              help='Where to write rejected rows (default: PATH.rejects.jsonl).')
+def import_command(kind, path, batch_size, rejects):
+  """Bulk-load venues, artists or shows from a CSV or JSONL file."""
+  def refresh_stats(connection, kind, records):
+    if kind == 'shows':
+      refresh_show_stats(connection,
+                         venue_ids={record['venue_id'] for record in records},
+                         artist_ids={record['artist_id'] for record in records})
+
+  rejects = rejects or f'{path}.rejects.jsonl'
+  stats = importer.import_file(
+      db.engine,
+      {'venues': Venue.__table__, 'artists': Artist.__table__, 'shows': Show.__table__,
+       'genres': Genre.__table__, 'venue_genres': venue_genres, 'artist_genres': artist_genres},
+      kind, path, batch_size=batch_size, rejects=rejects,
+      progress=lambda stats: click.echo(f'{kind}: {stats}'),
+      after_batch=refresh_stats)
+  click.echo(f'Done. {stats}.')
+  if stats.rejected:
+    click.echo(f'Rejected rows written to {rejects}.')
+
+#  Validators
+#  ----------------------------------------------------------------
+#  Each returns the state a page is rendered from, read in one small
+#  aggregate query: versions and last-update times of the rows involved,
+#  row counts (so deletes show up) and the number of upcoming shows (so the
+#  upcoming/past split moving with the clock does too).
+
+def _table_state(model):
+  return (db.session.query(db.func.count(model.id)).scalar_subquery(),
+          db.session.query(db.func.max(model.updated_at)).scalar_subquery())
+
+def _upcoming_count():
+  return db.func.sum(db.case((Show.starting_time > datetime.now(), 1), else_=0))
+
+def _rollup_state(stats):
+  # the show-statistics rollup changes when a queued job has run
+  return (db.session.query(db.func.count()).select_from(stats).scalar_subquery(),
+          db.session.query(db.func.max(stats.refreshed_at)).scalar_subquery())
+
+def venues_state():
+  return tuple(db.session.query(
+      *_table_state(Venue),
+      *_table_state(Show),
+      *_rollup_state(VenueShowStats),
+      db.session.query(db.func.count(Show.id)).filter(
+          Show.starting_time > datetime.now()).scalar_subquery()).one())
+
+def artists_state():
+  return tuple(db.session.query(*_table_state(Artist)).one())
+
+def shows_state():
+  return tuple(db.session.query(
+      *_table_state(Show), *_table_state(Venue), *_table_state(Artist)).one())
+
+def venue_state(venue_id):
+  row = db.session.query(
+      Venue.version, db.func.count(Show.id), db.func.max(Show.updated_at),
+      db.func.max(Artist.updated_at), _upcoming_count()
+  ).outerjoin(Show, Show.venue_id == Venue.id).outerjoin(Artist, Show.artist_id == Artist.id
+  ).filter(Venue.id == venue_id).group_by(Venue.id).first()
+  return tuple(row) if row else None
+
+def artist_state(artist_id):
+  row = db.session.query(
+      Artist.version, db.func.count(Show.id), db.func.max(Show.updated_at),
+      db.func.max(Venue.updated_at), _upcoming_count()
+  ).outerjoin(Show, Show.artist_id == Artist.id).outerjoin(Venue, Show.venue_id == Venue.id
+  ).filter(Artist.id == artist_id).group_by(Artist.id).first()
+  return tuple(row) if row else None
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+def query_datetime(name):
+  # ?name= as a naive local datetime, like the stored show times
+  value = request.args.get(name)
+  if not value:
+    return None
+  value = to_datetime(value)
+  if value.tzinfo is not None:
+    value = value.astimezone().replace(tzinfo=None)
+  return value
+
+def requested_ids():
+  # ids of a bulk request: a JSON body {"ids": [...]}, or ids= form/query
+  # values, repeated or comma-separated
+  if request.is_json:
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if not isinstance(ids, list):
+      raise ValueError('expected a JSON body {"ids": [...]}')
+  else:
+    ids = [part for value in request.values.getlist('ids') for part in value.split(',') if part.strip()]
+  try:
+    return [int(value) for value in ids]
+  except (TypeError, ValueError):
+    raise ValueError('ids must be integers')
+
+def delete_response(model, ids, single=False):
+  # Delete the venues or artists in ids with their shows in one transaction
+  # (with SOFT_DELETE, only hide them) and list what went as JSON.
+  kind, other = ('venue', 'artist') if model is Venue else ('artist', 'venue')
+  soft = current_app.config['SOFT_DELETE']
+  try:
+    deleted, others = delete_entities(db.session, model, ids, soft=soft)
+    if others:
+      jobs.enqueue(db.session.connection(), 'refresh_show_stats', **{f'{other}_ids': others})
+    # set-based statements are invisible to the page cache's ORM hooks
+    page_cache.invalidate_on_commit(
+        db.session, 'venues', 'artists', 'shows',
+        *(f'{kind}:{entity_id}' for entity_id in deleted),
+        *(f'{other}:{entity_id}' for entity_id in others))
+    typeahead.refresh_on_commit(db.session, model, deleted)
+    db.session.commit()
+  except SQLAlchemyError:
+    db.session.rollback()
+    print(sys.exc_info())
+    return api.error_response(500, f'An error occurred. The {kind}s could not be deleted.')
+  finally:
+    db.session.close()
+  if single and not deleted:
+    return api.error_response(404, f'{kind} {ids[0]} not found')
+  return api.json_response({'data': {
+      'deleted': deleted,
+      'not_found': sorted(set(ids).difference(deleted)),
+      'soft': soft,
+  }})
+
+def render_listing(template, **context):
+  # with STREAM_TEMPLATES the page is sent as Jinja renders it, so the
+  # layout head goes out before the list body is built.
+  if current_app.config.get('STREAM_TEMPLATES'):
+    return Response(stream_template(template, **context))
+  return render_template(template, **context)
+
+@bp.route('/')
 def index():
   return render_template('pages/home.html')
 
 
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+@bp.route('/autocomplete')
+def autocomplete():
+  # venue and artist names starting with q (or with a word starting with
+  # it), answered from the in-memory index without touching the database
+  term = request.args.get('q', '')
+  kind = request.args.get('type') or None
+  if kind is not None and kind not in typeahead.models:
+    return api.error_response(400, f"type must be one of {', '.join(typeahead.models)}")
+  limit = min(max(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), 1),
+              MAX_AUTOCOMPLETE_LIMIT)
+  complete, results = typeahead.search(term, limit, kind)
+  if not complete and term.strip():
+    # index still building, or over its memory budget
+    results = []
+    for name, model in typeahead.models.items():
+      if kind in (None, name):
+        _, rows = search_by_name(db.session, model, term, per_page=limit)
+        results.extend((name, row.id, row.name) for row in rows)
+    results = results[:limit]
+  return api.json_response({'data': [
+      {'type': name, 'id': entity_id, 'name': entity_name}
+      for name, entity_id, entity_name in results]})
+
+#  Facets
+#  ----------------------------------------------------------------
+
+def listing_facets(model, seeking, seeking_label):
+  link, key = genre_link(model)
+  return [
+      Facet('state', 'State', model.state),
+      Facet('city', 'City', model.city),
+      Facet('genre', 'Genre', Genre.name,
+            joins=[(link, key == model.id), (Genre, Genre.id == link.c.genre_id)],
+            criterion=lambda names: has_genres(model, names)),
+      Facet(seeking.key, seeking_label, db.case((seeking.is_(True), 'yes'), else_='no'),
+            labels={'yes': 'Yes', 'no': 'No'}),
+  ]
+
+VENUE_FACETS = listing_facets(Venue, Venue.seeking_talent, 'Seeking talent')
+ARTIST_FACETS = listing_facets(Artist, Artist.seeking_venue, 'Seeking venues')
+
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@bp.route('/venues')
+@replicas.reads
+@conditional(venues_state)
+@page_cache.cached
 def venues():
   # num_shows should be aggregated based on number of upcoming shows per venue.
+  # Venues come back already ordered for grouping by city/state; upcoming
+  # counts come from the show-statistics rollup.
+  chosen = selection(VENUE_FACETS, request.args)
+  rows = db.session.query(Venue.city, Venue.state, Venue.id, Venue.name).filter(
+      *criteria(VENUE_FACETS, chosen)).order_by(Venue.city, Venue.state, Venue.id).all()
+  num_upcoming_shows = upcoming_show_counts(VenueShowStats)
+  facets = facet_counts(db.session, Venue, VENUE_FACETS, chosen)
+  page_cache.tag('venues')
+
   data = []
-  cities = [value[0] for value in db.session.query(Venue.city).distinct()]
-  for city in cities:
-    venues = Venue.query.filter(Venue.city == city).all()
-    state = venues[0].state
-    vens = []
-    for venue in venues:
-      idi = venue.id
-      name = venue.name
-      num_upcoming_shows = 0
-      shows = Show.query.filter(Show.venue_id == venue.id).all()
-      for show in shows:
-        if show.starting_time > datetime.now():
-          num_upcoming_shows += 1
-      vens.append({
-          'id': idi,
-          'name': name,
-          'num_upcoming_shows': num_upcoming_shows
-         })
+  for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state)):
     data.append({
         'city': city,
         'state': state,
-        'venues': vens
-         })
+        'venues': [{
+            'id': venue.id,
+            'name': venue.name,
+            'num_upcoming_shows': num_upcoming_shows.get(venue.id, 0)
+        } for venue in venues]
+    })
 
-  return render_template('pages/venues.html', areas=data);
+  return render_template('pages/venues.html', areas=data, facets=facets, selection=chosen);
 
-@app.route('/venues/search', methods=['POST'])
+@bp.route('/venues/search', methods=['POST'])
+@replicas.reads
 def search_venues():
   # implement search on artists with partial string search. that is case-insensitive.
   # ex: seach for Hop should return "The Musical Hop".
   # ex:search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
   search_term = request.form.get('search_term', '')
-  search_results = db.session.query(Venue).filter(Venue.name.ilike(f'%{search_term}%')).all()
+  page = request.values.get('page', 1, type=int)
+  chosen = selection(VENUE_FACETS, request.values)
+  count, search_results = search_by_name(db.session, Venue, search_term, page=page,
+                                         where=criteria(VENUE_FACETS, chosen))
+  num_upcoming_shows = upcoming_show_counts(VenueShowStats, [venue.id for venue in search_results])
   data = []
   for search_result in search_results:
     data.append({
         "id": search_result.id,
         "name": search_result.name,
-        "num_upcoming_shows": len(db.session.query(Show).filter(Show.venue_id == search_result.id).filter(Show.starting_time > datetime.now()).all()),
+        "num_upcoming_shows": num_upcoming_shows.get(search_result.id, 0),
     })
 
   response = {
-      "count": len(search_results),
+      "count": count,
       "data": data
   }
 
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_venues.html', results=response, search_term=search_term,
+                         page=page, per_page=PAGE_SIZE, selection=chosen)
 
-@app.route('/venues/<int:venue_id>')
+@bp.route('/venues/<int:venue_id>')
+@replicas.reads
+@conditional(venue_state)
+@page_cache.cached
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  data = []
-  for venue in Venue.query.all():
-    shows = db.session.query(Show).filter(Show.venue_id == venue.id).all()
-    upcoming_shows_count = 0
-    upcoming_shows = []
-    past_shows = []
-    past_shows_count = 0
-    for show in shows:
-
-      if show.starting_time > datetime.now():
-                  upcoming_shows_count += 1
-                  upcoming_shows.append({
-        
-                      "artist_id": show.artist_id,
-                      "artist_name": show.artist.name,
-                      "artist_image_link": show.artist.image_link,
-                      "start_time": show.starting_time.isoformat()})
-      else:
-        past_shows_count += 1
-        past_shows.append({
-
-          "artist_id": show.artist_id,
-          "artist_name": show.artist.name,
-          "artist_image_link": show.artist.image_link,
-          "start_time": show.starting_time.isoformat()})
+  venue = Venue.query.get_or_404(venue_id)
+  # one query for all of this venue's shows with their artist columns; the
+  # database flags each row as upcoming or past.
+  shows = db.session.query(
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'),
+      Show.starting_time,
+      (Show.starting_time > datetime.now()).label('is_upcoming')
+  ).join(Artist, Show.artist_id == Artist.id
+  ).filter(Show.venue_id == venue_id).order_by(Show.starting_time).all()
+  page_cache.tag(f'venue:{venue_id}', *{f'artist:{show.artist_id}' for show in shows})
+
+  upcoming_shows = []
+  past_shows = []
+  for show in shows:
+    (upcoming_shows if show.is_upcoming else past_shows).append({
+        "artist_id": show.artist_id,
+        "artist_name": show.artist_name,
+        "artist_image_link": show.artist_image_link,
+        "start_time": show.starting_time})
+
+  data = {
+      "id": venue.id,
+      "name": venue.name,
+      "genres": list(venue.genres),
+      "address": venue.address,
+      "city": venue.city,
+      "state": venue.state,
+      "phone": venue.phone,
+      "website": venue.website,
+      "facebook_link": venue.facebook_link,
+      "seeking_talent": venue.seeking_talent,
+      "seeking_description": venue.seeking_description,
+      "image_link": venue.image_link,
+      "past_shows": past_shows,
+      "upcoming_shows": upcoming_shows,
+      "past_shows_count": len(past_shows),
+      "upcoming_shows_count": len(upcoming_shows)}
 
-    data.append({
-        "id": venue.id,
-        "name": venue.name,
-        "genres": venue.genres,
-        "address": venue.address,
-        "city": venue.city,
-        "state": venue.state,
-        "phone": venue.phone,
-        "website": venue.website,
-        "facebook_link": venue.facebook_link,
-        "seeking_talent": venue.seeking_talent,
-        "seeking_description": venue.seeking_description,
-        "image_link": venue.image_link,
-        "past_shows": past_shows,
-        "upcoming_shows": upcoming_shows,
-        "past_shows_count": past_shows_count,
-        "upcoming_shows_count": upcoming_shows_count})
-  
-  data = list(filter(lambda d: d['id'] == venue_id, data))[0]
   return render_template('pages/show_venue.html', venue=data)
 
+@bp.route('/venues/<int:venue_id>/availability')
+@replicas.reads
+def venue_availability(venue_id):
+  # Free slots of a venue between ?from= and ?to= (ISO datetimes; default
+  # the next week), optionally only those of at least ?min_minutes=.
+  try:
+    start = query_datetime('from') or datetime.now()
+    end = query_datetime('to') or start + timedelta(days=7)
+  except (ValueError, OverflowError) as e:
+    return api.error_response(400, f'bad from/to: {e}')
+  min_minutes = request.args.get('min_minutes', 0, type=int)
+  if end <= start or end - start > AVAILABILITY_SPAN:
+    return api.error_response(
+        400, f'to must be after from and at most {AVAILABILITY_SPAN.days} days later')
+  if db.session.get(Venue, venue_id) is None:
+    return api.error_response(404, f'venue {venue_id} not found')
+  slots = venue_free_slots(venue_id, start, end, min_minutes)
+  return api.json_response({'data': {
+      'venue_id': venue_id,
+      'from': start,
+      'to': end,
+      'free': [{'start': slot_start, 'end': slot_end} for slot_start, slot_end in slots],
+  }})
+
+@bp.route('/venues/nearby')
+@replicas.reads
+def venues_nearby():
+  # Venues within ?radius= km (default DEFAULT_NEARBY_KM) of ?lat=&lon=,
+  # nearest first: the geohash cells covering the circle narrow the rows
+  # read, exact distances rank them (see geo.py).
+  try:
+    latitude = float(request.args['lat'])
+    longitude = float(request.args['lon'])
+    radius = float(request.args.get('radius', DEFAULT_NEARBY_KM))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+      raise ValueError('lat must be within -90..90 and lon within -180..180')
+    if not 0 < radius <= MAX_NEARBY_KM:
+      raise ValueError(f'radius must be above 0 and at most {MAX_NEARBY_KM} km')
+  except KeyError as e:
+    return api.error_response(400, f'{e.args[0]} is required')
+  except ValueError as e:
+    return api.error_response(400, f'bad lat/lon/radius: {e}')
+  limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), api.MAX_LIMIT)
+
+  query = db.session.query(
+      Venue.id, Venue.name, Venue.city, Venue.state, Venue.address,
+      Venue.latitude, Venue.longitude).filter(Venue.geohash.isnot(None))
+  prefixes = geo.covering_prefixes(latitude, longitude, radius)
+  if prefixes is not None:
+    query = query.filter(db.or_(*(
+        db.and_(Venue.geohash >= low, Venue.geohash < high) if high else Venue.geohash >= low
+        for low, high in geo.prefix_ranges(prefixes))))
+  candidates = query.all()
+  distances = geo.haversine(latitude, longitude, [row.latitude for row in candidates],
+                            [row.longitude for row in candidates])
+  nearest = sorted((distance, row.id, row) for distance, row in zip(distances, candidates)
+                   if distance <= radius)[:limit]
+  return api.json_response({'data': [
+      {'id': row.id, 'name': row.name, 'city': row.city, 'state': row.state,
+       'address': row.address, 'latitude': row.latitude, 'longitude': row.longitude,
+       'distance_km': round(distance, 3)}
+      for distance, _, row in nearest]})
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@bp.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@bp.route('/venues/create', methods=['POST'])
 def create_venue_submission():
+  form = VenueForm()
+  invalid = coordinate_errors(form)
+  if invalid:
+    flash(f'Venue {request.form["name"]} could not be listed: {"; ".join(invalid)}.')
+    return render_template('forms/new_venue.html', form=form), 400
   error = False
   try:
     name = request.form['name']
@@ -225,7 +596,10 @@ def create_venue_submission():
     address = request.form['address']
     phone = request.form['phone']
     genres = request.form.getlist('genres')
-    venue = Venue(name=name, city=city, state=state, address=address, phone=phone, genres=genres)
+    latitude = request.form.get('latitude', type=float)
+    longitude = request.form.get('longitude', type=float)
+    venue = Venue(name=name, city=city, state=state, address=address, phone=phone, genres=genres,
+                  latitude=latitude, longitude=longitude)
     db.session.add(venue)
     db.session.commit()
   except:
@@ -243,186 +617,314 @@ def create_venue_submission():
 
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@bp.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
-  # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
-  venue_to_delete = Venue.query.get(venue_id)
-  db.session.delete(venue_to_delete)
-  db.session.commit()
+  # deletes the venue and its shows
+  return delete_response(Venue, [venue_id], single=True)
 
-  return None
+@bp.route('/venues/delete', methods=['POST'])
+def delete_venues():
+  # bulk delete: {"ids": [...]} or ids=1,2,3
+  try:
+    ids = requested_ids()
+  except ValueError as e:
+    return api.error_response(400, str(e))
+  return delete_response(Venue, ids)
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@bp.route('/artists')
+@replicas.reads
+@conditional(artists_state)
+@page_cache.cached
 def artists():
-  data = Artist.query.all()
-
-  return render_template('pages/artists.html', artists=data)
-
-@app.route('/artists/search', methods=['POST'])
+  chosen = selection(ARTIST_FACETS, request.args)
+  query = db.session.query(Artist.id, Artist.name).filter(*criteria(ARTIST_FACETS, chosen))
+  try:
+    page = keyset_page(
+        query, [Artist.name, Artist.id],
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=current_app.config['LIST_PAGE_SIZE'])
+  except ValueError:
+    abort(400)
+  facets = facet_counts(db.session, Artist, ARTIST_FACETS, chosen)
+  page_cache.tag('artists')
+
+  return render_listing('pages/artists.html', artists=page.items, page=page, facets=facets,
+                        selection=chosen)
+
+@bp.route('/artists/search', methods=['POST'])
+@replicas.reads
 def search_artists():
   # implement search on artists with partial string search. That is case-insensitive.
   # Ex1:seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # Ex2:search for "band" should return "The Wild Sax Band".
   search_term = request.form.get('search_term', '')
-  search_results = db.session.query(Artist).filter(
-      Artist.name.ilike(f'%{search_term}%')).all()
+  page = request.values.get('page', 1, type=int)
+  chosen = selection(ARTIST_FACETS, request.values)
+  count, search_results = search_by_name(db.session, Artist, search_term, page=page,
+                                         where=criteria(ARTIST_FACETS, chosen))
+  num_upcoming_shows = upcoming_show_counts(ArtistShowStats, [artist.id for artist in search_results])
   data = []
   for search_result in search_results:
     data.append({
         "id": search_result.id,
         "name": search_result.name,
-        "num_upcoming_shows": len(db.session.query(Show).filter(Show.artist_id == search_result.id).filter(Show.starting_time > datetime.now()).all()),
+        "num_upcoming_shows": num_upcoming_shows.get(search_result.id, 0),
     })
 
   response = {
-      "count": len(search_results),
+      "count": count,
       "data": data
   }
 
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_artists.html', results=response, search_term=search_term,
+                         page=page, per_page=PAGE_SIZE, selection=chosen)
 
-@app.route('/artists/<int:artist_id>')
+@bp.route('/artists/<int:artist_id>')
+@replicas.reads
+@conditional(artist_state)
+@page_cache.cached
 def show_artist(artist_id):
-  # shows the venue page with the given venue_id
-  data = []
-  for artist in Artist.query.all():
-    shows = db.session.query(Show).filter(Show.artist_id == artist.id).all()
-    upcoming_shows_count = 0
-    upcoming_shows = []
-    past_shows = []
-    past_shows_count = 0
-    for show in shows:
-      if show.starting_time > datetime.now():
-          upcoming_shows_count += 1
-          upcoming_shows.append({
-
-              "venue_id": show.venue_id,
-              "venue_name": show.venue.name,
-              "venue_image_link": show.venue.image_link,
-              "start_time": show.starting_time.isoformat()})
-      else:
-        past_shows_count += 1
-        past_shows.append({
-
-            "venue_id": show.venue_id,
-            "venue_name": show.venue.name,
-            "venue_image_link": show.venue.image_link,
-            "start_time": show.starting_time.isoformat()})
+  # shows the artist page with the given artist_id
+  artist = Artist.query.get_or_404(artist_id)
+  # one query for all of this artist's shows with their venue columns; the
+  # database flags each row as upcoming or past.
+  shows = db.session.query(
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Venue.image_link.label('venue_image_link'),
+      Show.starting_time,
+      (Show.starting_time > datetime.now()).label('is_upcoming')
+  ).join(Venue, Show.venue_id == Venue.id
+  ).filter(Show.artist_id == artist_id).order_by(Show.starting_time).all()
+  page_cache.tag(f'artist:{artist_id}', *{f'venue:{show.venue_id}' for show in shows})
+
+  upcoming_shows = []
+  past_shows = []
+  for show in shows:
+    (upcoming_shows if show.is_upcoming else past_shows).append({
+        "venue_id": show.venue_id,
+        "venue_name": show.venue_name,
+        "venue_image_link": show.venue_image_link,
+        "start_time": show.starting_time})
+
+  data = {
+      "id": artist.id,
+      "name": artist.name,
+      "genres": list(artist.genres),
+      "city": artist.city,
+      "state": artist.state,
+      "phone": artist.phone,
+      "website": artist.website,
+      "facebook_link": artist.facebook_link,
+      "seeking_venue": artist.seeking_venue,
+      "seeking_description": artist.seeking_description,
+      "image_link": artist.image_link,
+      "past_shows": past_shows,
+      "upcoming_shows": upcoming_shows,
+      "past_shows_count": len(past_shows),
+      "upcoming_shows_count": len(upcoming_shows)}
 
-    data.append({
-        "id": artist.id,
-        "name": artist.name,
-        "genres": artist.genres,
-        "city": artist.city,
-        "state": artist.state,
-        "phone": artist.phone,
-        "website": artist.website,
-        "facebook_link": artist.facebook_link,
-        "seeking_venue": artist.seeking_venue,
-        "seeking_description": artist.seeking_description,
-        "image_link": artist.image_link,
-        "past_shows": past_shows,
-        "upcoming_shows": upcoming_shows,
-        "past_shows_count": past_shows_count,
-        "upcoming_shows_count": upcoming_shows_count})
-
-  data = list(filter(lambda d: d['id'] == artist_id, data))[0]
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
-def edit_artist(artist_id):
-  form = ArtistForm()
-  artist_to_edit = Artist.query.get(artist_id)
-  form.name.data = artist_to_edit.name
-  form.city.data = artist_to_edit.city
-  form.state.data = artist_to_edit.state
-  form.phone.data = artist_to_edit.phone
-  form.genres.data = artist_to_edit.genres
-  form.image_link.data = artist_to_edit.image_link
-  
-  return render_template('forms/edit_artist.html', form=form, artist=artist_to_edit)
-
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
-def edit_artist_submission(artist_id):
-  # artist record with ID <artist_id> using the new attributes
+#  The edit forms post back the version they were filled from. Submitted
+#  fields are written in one UPDATE guarded by that version, so an edit
+#  made meanwhile is reported instead of silently overwritten.
+
+@lru_cache(maxsize=None)
+def editable_fields(model, form_class):
+  # form fields stored in a column of model, in form order
+  return tuple(name for name, field in vars(form_class).items()
+               if isinstance(field, UnboundField) and name in model.__table__.c)
+
+def edit_row(model, form_class, entity_id):
+  # the edit form's values of one row, genres included, in one query
+  columns = [getattr(model, name) for name in editable_fields(model, form_class)]
+  return db.session.query(
+      model.id, model.version, *columns, genre_names(model).label('genres')
+  ).filter(model.id == entity_id).first()
+
+def edit_form(form_class, row):
+  data = {name: getattr(row, name) for name in row._fields}
+  data['genres'] = API_CONVERTERS['genres'](row.genres)
+  return form_class(data=data)
+
+def submitted_values(model, form_class):
+  # the submitted edit fields as column values
+  values = {}
+  for name in editable_fields(model, form_class):
+    if name in request.form:
+      value = request.form[name]
+      if isinstance(model.__table__.c[name].type, db.Boolean):
+        value = value.strip().lower() in ('y', 'yes', 'true', 'on', '1')
+      elif isinstance(model.__table__.c[name].type, db.Float):
+        value = float(value) if value.strip() else None
+      values[name] = value
+  return values
+
+def coordinate_errors(form):
+  # VenueForm's latitude/longitude checks on their own; these routes do
+  # not validate the rest of the form
+  fields = (form.latitude, form.longitude)
+  if all([field.validate(form) for field in fields]):
+    form.coordinates_paired()
+  return [f'{field.name}: {field.errors[0].rstrip(".").lower()}'
+          for field in fields if field.errors]
+
+def edit_submission(model, form_class, entity_id, template, view):
+  kind = model.__tablename__
+  form = form_class()
+  invalid = coordinate_errors(form) if 'latitude' in model.__table__.c else []
+  if invalid:
+    current = edit_row(model, form_class, entity_id)
+    if current is None:
+      abort(404)
+    flash(f'{kind} could not be changed: {"; ".join(invalid)}.')
+    return render_template(template, form=form, **{kind.lower(): current}), 400
   error = False
-  artist_to_edit = Artist.query.get(artist_id)
   try:
-    artist_to_edit.name = request.form['name']
-    artist_to_edit.city = request.form['city']
-    artist_to_edit.state = request.form['state']
-    artist_to_edit.phone = request.form['phone']
-    artist_to_edit.genres = request.form.getlist('genres')
+    genres = request.form.getlist('genres') if 'genres' in request.form else None
+    updated = update_entity(db.session, model, entity_id, submitted_values(model, form_class),
+                            version=request.form.get('version', type=int), genres=genres)
+    if updated:
+      # a Core UPDATE is invisible to the page cache's ORM hooks
+      page_cache.invalidate_on_commit(
+          db.session, f'{kind.lower()}:{entity_id}', f'{kind.lower()}s', 'shows')
+      typeahead.refresh_on_commit(db.session, model, [entity_id])
     db.session.commit()
   except:
-    error = True
+    updated = error = True
     db.session.rollback()
     print(sys.exc_info())
   finally:
     db.session.close()
-  
-  # on unsuccessful db insert, flash an error instead.
+
+  if not updated:
+    current = edit_row(model, form_class, entity_id)
+    if current is None:
+      abort(404)
+    # the submitted values again, against the row's current version
+    flash(f'{kind} {current.name} was changed by someone else while you were editing. '
+          'Review the form and submit it again to overwrite those changes.')
+    return render_template(template, form=form_class(), **{kind.lower(): current}), 409
+  # on unsuccessful db update, flash an error instead.
   if error:
-    flash('An error occurred. Artist could not be changed.')
-  # on successful db insert, flash success
-  if not error:
-    flash('Artist was successfully updated!')
-  return redirect(url_for('show_artist', artist_id=artist_id))
+    flash(f'An error occurred. {kind} could not be changed.')
+  # on successful db update, flash success
+  else:
+    flash(f'{kind} was successfully updated!')
+  return redirect(url_for(view, **{f'{kind.lower()}_id': entity_id}))
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
-def edit_venue(venue_id):
-  form = VenueForm()
-  venue_to_edit = Venue.query.get(venue_id)
-  form.name.data = venue_to_edit.name
-  form.city.data = venue_to_edit.city
-  form.state.data = venue_to_edit.state
-  form.phone.data = venue_to_edit.phone
-  form.genres.data = venue_to_edit.genres
-  form.image_link.data = venue_to_edit.image_link
+@bp.route('/artists/<int:artist_id>/edit', methods=['GET'])
+def edit_artist(artist_id):
+  artist = edit_row(Artist, ArtistForm, artist_id)
+  if artist is None:
+    abort(404)
+  return render_template('forms/edit_artist.html', form=edit_form(ArtistForm, artist), artist=artist)
 
-  return render_template('forms/edit_venue.html', form=form, venue=venue_to_edit)
+@bp.route('/artists/<int:artist_id>/edit', methods=['POST'])
+def edit_artist_submission(artist_id):
+  # artist record with ID <artist_id> using the new attributes
+  return edit_submission(Artist, ArtistForm, artist_id, 'forms/edit_artist.html', '.show_artist')
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@bp.route('/venues/<int:venue_id>/edit', methods=['GET'])
+def edit_venue(venue_id):
+  venue = edit_row(Venue, VenueForm, venue_id)
+  if venue is None:
+    abort(404)
+  return render_template('forms/edit_venue.html', form=edit_form(VenueForm, venue), venue=venue)
+
+@bp.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   # venue record with ID <venue_id> using the new attributes
-  error = False
-  venue_to_edit = Venue.query.get(venue_id)
-  try:
-    venue_to_edit.name = request.form['name']
-    venue_to_edit.city = request.form['city']
-    venue_to_edit.state = request.form['state']
-    venue_to_edit.phone = request.form['phone']
-    venue_to_edit.genres = request.form.getlist('genres')
+  return edit_submission(Venue, VenueForm, venue_id, 'forms/edit_venue.html', '.show_venue')
 
+#  Images
+#  ----------------------------------------------------------------
+#  Uploads are stored under their content hash (see media.py) and the
+#  row's image_link pointed at them; the thumbnails and WebP copies are
+#  rendered by a background job.
+
+def image_upload(model, entity_id, view):
+  kind = model.__tablename__
+  config = current_app.config
+  upload = request.files.get('image')
+  # nothing is stored for a row that does not exist
+  if db.session.query(model.id).filter(model.id == entity_id).first() is None:
+    abort(404)
+  error = None
+  found = True
+  created = False
+  try:
+    if upload is None or not upload.filename:
+      raise media.UploadError('no file was chosen')
+    name, created = media.store(upload.stream, config['MEDIA_ROOT'], config['IMAGE_MAX_BYTES'])
+    found = update_entity(db.session, model, entity_id, {'image_link': media.url(name)})
+    if found:
+      page_cache.invalidate_on_commit(
+          db.session, f'{kind.lower()}:{entity_id}', f'{kind.lower()}s', 'shows')
+      jobs.enqueue(db.session.connection(), 'image_derivatives', name=name)
     db.session.commit()
+  except media.UploadError as e:
+    error = str(e)
   except:
-    error = True
+    error = 'an error occurred'
     db.session.rollback()
     print(sys.exc_info())
   finally:
     db.session.close()
+  # a file this upload added but no row ended up pointing at (the row went
+  # meanwhile, or the commit failed); one already there may be another's
+  if created and (error or not found):
+    media.discard(config['MEDIA_ROOT'], name)
 
-  # on unsuccessful db insert, flash an error instead.
+  if not found:
+    abort(404)
   if error:
-    flash('An error occurred. venue could not be changed.')
-  # on successful db insert, flash success 
-  if not error:
-    flash('venue was successfully updated!')
-  return redirect(url_for('show_venue', venue_id=venue_id))
+    flash(f'Image could not be uploaded: {error}.')
+  else:
+    flash(f'{kind} image was successfully uploaded!')
+  return redirect(url_for(view, **{f'{kind.lower()}_id': entity_id}))
+
+@bp.route('/venues/<int:venue_id>/image', methods=['POST'])
+def upload_venue_image(venue_id):
+  return image_upload(Venue, venue_id, '.show_venue')
+
+@bp.route('/artists/<int:artist_id>/image', methods=['POST'])
+def upload_artist_image(artist_id):
+  return image_upload(Artist, artist_id, '.show_artist')
+
+@bp.route('/media/<filename>')
+def media_file(filename):
+  # a file's name is the hash of its content: cacheable for good
+  root = current_app.config['MEDIA_ROOT']
+  if media.parse(filename) is None:
+    abort(404)
+  if not os.path.isfile(os.path.join(root, filename)):
+    # a derivative not rendered yet: the original meanwhile, not cached
+    original = media.original_name(root, filename)
+    if original is None:
+      abort(404)
+    response = redirect(media.url(original))
+    response.cache_control.no_cache = True
+    return response
+  response = send_from_directory(root, filename, max_age=current_app.config['MEDIA_MAX_AGE'])
+  response.cache_control.public = True
+  response.cache_control.immutable = True
+  return response
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@bp.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@bp.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
   error = False
@@ -451,44 +953,98 @@ def create_artist_submission():
 
   return render_template('pages/home.html')
 
+@bp.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+  # deletes the artist and their shows
+  return delete_response(Artist, [artist_id], single=True)
+
+@bp.route('/artists/delete', methods=['POST'])
+def delete_artists():
+  # bulk delete: {"ids": [...]} or ids=1,2,3
+  try:
+    ids = requested_ids()
+  except ValueError as e:
+    return api.error_response(400, str(e))
+  return delete_response(Artist, ids)
+
 
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@bp.route('/shows')
+@replicas.reads
+@conditional(shows_state)
+@page_cache.cached
 def shows():
   # displays list of shows at /shows
-  shs = Show.query.all()
-  data =[]
-  for show in shs:
-    data.append({
-      "venue_id":  show.venue.id,
-      "venue_name": show.venue.name,
+  query = db.session.query(
+      Show.id,
+      Show.starting_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+  ).join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id)
+  try:
+    page = keyset_page(
+        query, [Show.starting_time, Show.id],
+        after=request.args.get('after'), before=request.args.get('before'),
+        per_page=current_app.config['LIST_PAGE_SIZE'])
+  except ValueError:
+    abort(400)
+  page_cache.tag('shows')
+
+  data = ({
+      "venue_id": show.venue_id,
+      "venue_name": show.venue_name,
       "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": show.starting_time.isoformat()
-    })
+      "artist_name": show.artist_name,
+      "artist_image_link": show.artist_image_link,
+      "start_time": show.starting_time
+  } for show in page.items)
 
-  return render_template('pages/shows.html', shows=data)
+  return render_listing('pages/shows.html', shows=data, page=page)
 
-@app.route('/shows/create')
+@bp.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@bp.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   error = False
+  conflict = None
   try:
-    artist_id = request.form['artist_id']
-    venue_id = request.form['venue_id']
-    starting_time = request.form['start_time']
-    new_show = Show(artist_id=artist_id, venue_id=venue_id, starting_time=starting_time)
-    db.session.add(new_show)
-    db.session.commit()
+    artist_id = int(request.form['artist_id'])
+    venue_id = int(request.form['venue_id'])
+    starting_time = dateutil.parser.parse(request.form['start_time'])
+    duration = request.form.get('duration', DEFAULT_SHOW_MINUTES, type=int)
+    if not 1 <= duration <= MAX_SHOW_MINUTES:
+      raise ValueError(f'duration must be 1 to {MAX_SHOW_MINUTES} minutes')
+    ending_time = starting_time + timedelta(minutes=duration)
+    # deleted (or soft-deleted) venues and artists take no bookings
+    if db.session.get(Venue, venue_id) is None or db.session.get(Artist, artist_id) is None:
+      raise LookupError(f'no venue {venue_id} or no artist {artist_id}')
+    venue_booking, artist_booking = booking_conflicts(venue_id, artist_id, starting_time, ending_time)
+    if venue_booking is not None:
+      conflict = ('venue', venue_booking)
+    elif artist_booking is not None:
+      conflict = ('artist', artist_booking)
+    else:
+      new_show = Show(artist_id=artist_id, venue_id=venue_id,
+                      starting_time=starting_time, ending_time=ending_time)
+      db.session.add(new_show)
+      db.session.commit()
+  except IntegrityError as e:
+    error = True
+    db.session.rollback()
+    # the Postgres exclusion constraints catch a booking made concurrently
+    if getattr(e.orig, 'pgcode', None) == EXCLUSION_VIOLATION:
+      conflict = ('venue or artist', None)
+    print(sys.exc_info())
   except:
     error = True
     db.session.rollback()
@@ -496,45 +1052,136 @@ def create_show_submission():
   finally:
     db.session.close()
 
+  if conflict is not None:
+    kind, show = conflict
+    if show is None:
+      flash(f'Show could not be listed: the {kind} is already booked at that time.')
+    else:
+      flash(f'Show could not be listed: the {kind} is already booked from '
+            f'{show.starting_time:%Y-%m-%d %H:%M} to {show.ending_time:%Y-%m-%d %H:%M}.')
   # on unsuccessful db insert, flash an error instead.
-  if error:
+  elif error:
     flash('An error occurred. Show  could not be listed.')
   # on successful db insert, flash success
-  if not error:
+  else:
       flash('Show was successfully listed!')
 
   return render_template('pages/home.html')
 
-@app.errorhandler(404)
+#  JSON API
+#  ----------------------------------------------------------------
+
+API_FIELDS = {
+    'venues': dict({name: getattr(Venue, name) for name in (
+        'id', 'name', 'city', 'state', 'address', 'phone', 'image_link',
+        'facebook_link', 'website', 'seeking_talent', 'seeking_description',
+        'latitude', 'longitude')},
+        genres=genre_names(Venue)),
+    'artists': dict({name: getattr(Artist, name) for name in (
+        'id', 'name', 'city', 'state', 'phone', 'image_link',
+        'facebook_link', 'website', 'seeking_venue', 'seeking_description')},
+        genres=genre_names(Artist)),
+    'shows': {
+        'id': Show.id,
+        'venue_id': Show.venue_id,
+        'venue_name': Venue.name,
+        'venue_image_link': Venue.image_link,
+        'artist_id': Show.artist_id,
+        'artist_name': Artist.name,
+        'artist_image_link': Artist.image_link,
+        'start_time': Show.starting_time,
+        'end_time': Show.ending_time},
+}
+
+# genres come back from the database joined into one string
+API_CONVERTERS = {
+    'genres': lambda value: sorted(value.split(GENRE_SEPARATOR)) if value else [],
+}
+
+def api_query(kind):
+  # only the requested columns are selected, plus the cursor key
+  fields = api.requested_fields(API_FIELDS[kind])
+  columns = [API_FIELDS[kind][name].label(name) for name in fields]
+  if kind == 'shows':
+    query = db.session.query(*columns, Show.starting_time, Show.id).select_from(Show).join(
+        Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id)
+  else:
+    model = Venue if kind == 'venues' else Artist
+    query = db.session.query(*columns, model.id).select_from(model)
+    genres = request.args.getlist('genre')
+    if genres:
+      query = query.filter(has_genres(model, genres))
+  return query, fields
+
+def api_list(kind, cursor_columns):
+  try:
+    query, fields = api_query(kind)
+    return api.stream_list(query, cursor_columns, fields,
+                           after=request.args.get('after'), limit=api.requested_limit(),
+                           converters=API_CONVERTERS)
+  except ValueError as e:
+    return api.error_response(400, str(e))
+
+def api_detail(kind, model, entity_id):
+  try:
+    query, fields = api_query(kind)
+  except ValueError as e:
+    return api.error_response(400, str(e))
+  row = query.filter(model.id == entity_id).first()
+  if row is None:
+    return api.error_response(404, f'{kind[:-1]} {entity_id} not found')
+  return api.json_response({'data': api.item(row, fields, API_CONVERTERS)})
+
+@bp.route('/api/v1/venues')
+@replicas.reads
+def api_venues():
+  return api_list('venues', [Venue.id])
+
+@bp.route('/api/v1/venues/<int:venue_id>')
+@replicas.reads
+def api_venue(venue_id):
+  return api_detail('venues', Venue, venue_id)
+
+@bp.route('/api/v1/artists')
+@replicas.reads
+def api_artists():
+  return api_list('artists', [Artist.id])
+
+@bp.route('/api/v1/artists/<int:artist_id>')
+@replicas.reads
+def api_artist(artist_id):
+  return api_detail('artists', Artist, artist_id)
+
+@bp.route('/api/v1/shows')
+@replicas.reads
+def api_shows():
+  return api_list('shows', [Show.starting_time, Show.id])
+
+@bp.route('/api/v1/shows/<int:show_id>')
+@replicas.reads
+def api_show(show_id):
+  return api_detail('shows', Show, show_id)
+
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
@@ -0,0 +1,250 @@
+"""Fingerprinted, bundled and precompressed static assets.
+
+``flask assets`` copies every file under ``static/`` to ``ASSETS_ROOT``
+as ``<name>.<hash>.<ext>``, named after its content, and concatenates the
+``BUNDLES`` (CSS minified) the same way. Text files get ``.gz`` and, when
+the brotli package is installed, ``.br`` siblings compressed once at build
+time. ``manifest.json`` maps each logical name (``css/app.css``) to its
+fingerprinted file.
+
+Templates resolve names through the manifest with ``asset_url(name)``, or
+``asset_urls(bundle)`` for a bundle, which gives its source files one by
+one while no build exists (or with ``ASSETS_BUNDLED`` off, as in
+development). Fingerprinted files are served at ``ASSETS_URL_PATH`` with
+far-future ``immutable`` caching, in the precompressed encoding the client
+accepts.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+
+from flask import current_app, request, send_from_directory, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+try:
+  import brotli
+except ImportError:  # pragma: no cover - optional, .gz only
+  brotli = None
+
+try:
+  import rjsmin
+except ImportError:  # pragma: no cover - optional, bundles are only joined
+  rjsmin = None
+
+MANIFEST = 'manifest.json'
+# bundle name -> source files under static/, in order
+BUNDLES = {
+    'css/app.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css',
+    ],
+    'js/head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js',
+    ],
+    'js/app.js': [
+        'js/script.js',
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js',
+        'js/typeahead.js',
+    ],
+}
+COMPRESSED = {'.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml',
+              '.eot', '.ttf', '.otf', '.ico'}
+HASH_LENGTH = 10
+
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\')|(?:\s|/\*.*?\*/)+', re.S)
+_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_SOURCE_MAP = re.compile(r'^\s*//[#@] sourceMappingURL=.*$', re.M)
+# no space is needed on either side of these
+_CSS_TIGHT = set('{};,>')
+
+
+def minify_css(text):
+  """Drop comments and the whitespace CSS does not need; strings are kept."""
+  def replace(match):
+    if match.group(1):
+      return match.group(1)
+    before = text[match.start() - 1] if match.start() else '{'
+    after = text[match.end()] if match.end() < len(text) else '}'
+    # keep the space in 'a :hover' or 'and (max-width...)'
+    if before in _CSS_TIGHT or before == ':' or after in _CSS_TIGHT:
+      return ''
+    return ' '
+  return _CSS_TOKENS.sub(replace, text).strip()
+
+
+def minify_js(text):
+  text = _SOURCE_MAP.sub('', text)
+  return rjsmin.jsmin(text) if rjsmin is not None else text.strip()
+
+
+def rewrite_css_urls(text, source, manifest, url_path, static_url_path):
+  # relative url()s of a file moved into a bundle, made absolute: the
+  # fingerprinted copy where there is one, the plain static file otherwise
+  def replace(match):
+    quote, target = match.groups()
+    if re.match(r'^(?:[a-z]+:|/|#)', target, re.I):
+      return match.group(0)
+    path, suffix = re.match(r'^([^?#]*)(.*)$', target).groups()
+    name = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+    if name in manifest:
+      url = f'{url_path}/{manifest[name]}{suffix}'
+    else:
+      url = f'{static_url_path}/{name}{suffix}'
+    return f'url({quote}{url}{quote})'
+  return _CSS_URL.sub(replace, text)
+
+
+def fingerprint(name, data):
+  stem, ext = posixpath.splitext(name)
+  return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def _write(path, data):
+  # write next to the target and rename, so a half-written file is never served
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.asset-')
+  with os.fdopen(fd, 'wb') as out:
+    out.write(data)
+  os.replace(temp, path)
+
+
+def emit(output, name, data):
+  """Write ``data`` as the fingerprinted file of ``name`` (and its
+  compressed siblings) unless already built; return its name."""
+  hashed = fingerprint(name, data)
+  path = os.path.join(output, *hashed.split('/'))
+  if not os.path.exists(path):
+    if posixpath.splitext(name)[1] in COMPRESSED:
+      variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+      if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+      for suffix, compressed in variants:
+        if len(compressed) < len(data):
+          _write(path + suffix, compressed)
+    # the file itself last: its presence marks the build of it complete
+    _write(path, data)
+  return hashed
+
+
+def build(static_folder, output, url_path, static_url_path, bundles=BUNDLES):
+  """Fingerprint the files under ``static_folder`` and the ``bundles``
+  into ``output`` and write the manifest; returns the manifest.
+
+  Files of earlier builds are left in place, so pages rendered before a
+  deploy keep working until their caches expire.
+  """
+  manifest = {}
+  output = os.path.abspath(output)
+  for directory, subdirectories, files in os.walk(static_folder):
+    subdirectories[:] = sorted(d for d in subdirectories
+                               if os.path.abspath(os.path.join(directory, d)) != output)
+    for filename in sorted(files):
+      if filename.startswith('.'):
+        continue
+      path = os.path.join(directory, filename)
+      name = os.path.relpath(path, static_folder).replace(os.sep, '/')
+      with open(path, 'rb') as source:
+        manifest[name] = emit(output, name, source.read())
+
+  for bundle, sources in bundles.items():
+    parts = []
+    for source in sources:
+      with open(os.path.join(static_folder, *source.split('/')), encoding='utf-8') as f:
+        text = f.read()
+      if bundle.endswith('.css'):
+        text = minify_css(rewrite_css_urls(text, source, manifest, url_path, static_url_path))
+      else:
+        text = minify_js(text)
+      parts.append(text)
+    # ';' ends a script that left its last statement open
+    joined = '\n'.join(parts) if bundle.endswith('.css') else ';\n'.join(parts)
+    manifest[bundle] = emit(output, bundle, joined.encode('utf-8'))
+
+  _write(os.path.join(output, MANIFEST),
+         json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+  return manifest
+
+
+class Assets(object):
+
+  def __init__(self, bundles=BUNDLES, app=None):
+    self.bundles = bundles
+    self._manifests = {}
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('ASSETS_ROOT', os.path.join(app.static_folder, 'build'))
+    app.config.setdefault('ASSETS_URL_PATH', '/assets')
+    app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+    app.config.setdefault('ASSETS_BUNDLED', True)
+    app.extensions['assets'] = self
+    app.add_url_rule(f"{app.config['ASSETS_URL_PATH']}/<path:filename>", 'assets', self.view)
+    app.jinja_env.globals.update(asset_url=self.url, asset_urls=self.urls)
+
+  def build(self, app):
+    manifest = build(app.static_folder, app.config['ASSETS_ROOT'],
+                     app.config['ASSETS_URL_PATH'], app.static_url_path, self.bundles)
+    self._manifests[app] = manifest
+    return manifest
+
+  def manifest(self):
+    """The manifest of the current app; empty without a build, or with
+    ``ASSETS_BUNDLED`` off."""
+    app = current_app._get_current_object()
+    if not app.config['ASSETS_BUNDLED']:
+      return {}
+    if app not in self._manifests:
+      try:
+        with open(os.path.join(app.config['ASSETS_ROOT'], MANIFEST), 'rb') as f:
+          self._manifests[app] = json.load(f)
+      except FileNotFoundError:
+        self._manifests[app] = {}
+    return self._manifests[app]
+
+  def url(self, name):
+    """URL of static file ``name``, fingerprinted when built."""
+    hashed = self.manifest().get(name)
+    if hashed is None:
+      return url_for('static', filename=name)
+    return url_for('assets', filename=hashed)
+
+  def urls(self, name):
+    """URLs to load for ``name``: the built bundle, or its sources."""
+    if name in self.manifest() or name not in self.bundles:
+      return [self.url(name)]
+    return [url_for('static', filename=source) for source in self.bundles[name]]
+
+  def view(self, filename):
+    config = current_app.config
+    if filename == MANIFEST:
+      raise NotFound()
+    root = config['ASSETS_ROOT']
+    served, encoding = filename, None
+    accepted = request.accept_encodings
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+      path = safe_join(root, filename + suffix)
+      if accepted[candidate] and path is not None and os.path.isfile(path):
+        served, encoding = filename + suffix, candidate
+        break
+    response = send_from_directory(
+        root, served, max_age=config['ASSETS_MAX_AGE'],
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if encoding:
+      response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,70 @@
+"""Micro-benchmark for the ``datetime`` template filter.
+
+Compares the per-tile cost of the original filter (dateutil parse of an
+ISO string + babel.dates.format_datetime) with formatting.format_datetime
+on native datetimes, cold (every value distinct) and warm (values repeat,
+as they do across tiles and page views).
+
+    python benchmarks/bench_format_datetime.py [--tiles 5000] [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import babel.dates
+import dateutil.parser
+
+import formatting
+
+
+def legacy_format_datetime(value, format='medium'):
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format)
+
+
+def per_tile_us(fn, values, repeat):
+  best = min(timeit.repeat(lambda: [fn(value, 'full') for value in values],
+                           number=1, repeat=repeat))
+  return best / len(values) * 1e6
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--tiles', type=int, default=5000)
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  start = datetime(2026, 1, 1, 20, 0)
+  times = [start + timedelta(minutes=37 * i) for i in range(args.tiles)]
+  strings = [time.isoformat() for time in times]
+
+  for time, string in zip(times[:100], strings[:100]):
+    assert formatting.format_datetime(time, 'full') == legacy_format_datetime(string, 'full')
+
+  legacy = per_tile_us(legacy_format_datetime, strings, args.repeat)
+
+  def cold(value, format):
+    formatting._format.cache_clear()
+    return formatting.format_datetime(value, format)
+
+  uncached = per_tile_us(cold, times, args.repeat)
+  formatting._format.cache_clear()
+  warm = per_tile_us(formatting.format_datetime, times[:formatting.CACHE_SIZE], args.repeat)
+
+  print(f'{args.tiles} tiles, best of {args.repeat}')
+  print(f'  legacy (parse ISO string + babel)  {legacy:8.2f} us/tile')
+  print(f'  native datetime, compiled pattern  {uncached:8.2f} us/tile  ({legacy / uncached:5.1f}x)')
+  print(f'  native datetime, memoized          {warm:8.2f} us/tile  ({legacy / warm:5.1f}x)')
+
+
+if __name__ == '__main__':
+  main()
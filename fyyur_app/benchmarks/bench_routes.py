@@ -0,0 +1,436 @@
+"""Route latency benchmark on a seeded catalog.
+
+Seeds a database (SQLite by default, or any URL such as a local Postgres)
+with a configurable number of venues, artists and shows, then drives every
+route of the app through the Flask test client and reports, per route:
+latency percentiles, SQL statements per request and peak Python memory
+(tracemalloc, measured on a separate request so it does not skew timing).
+
+Results can be saved as a baseline and later runs compared against it;
+the run fails (exit status 1) when a route's median latency or peak memory
+grew past the threshold, or it ran more statements than in the baseline.
+``benchmarks/baseline_routes.json`` holds one taken with the default
+volumes on SQLite; latencies depend on the machine, so re-save it where
+the comparisons run (statement counts carry over as they are).
+
+    python benchmarks/bench_routes.py --venues 10000 --artists 50000 --shows 1000000
+    python benchmarks/bench_routes.py --save-baseline
+    python benchmarks/bench_routes.py --compare [--threshold 0.25]
+
+The database is migrated with the app's migrations and seeded only when
+empty; a database already holding the requested volumes is reused. The
+page cache is off unless --page-cache is given, so each request does its
+full work. Delete and image upload requests each use up a throwaway row
+inserted for them; static assets and uploaded images go to temporary
+directories.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask_migrate import upgrade
+from sqlalchemy import bindparam, event, func, insert, select
+from sqlalchemy.engine import Engine, make_url
+
+import app as fyyur
+import geo
+import media
+from models import (DEFAULT_SHOW_MINUTES, Artist, Genre, Job, Show, Venue, artist_genres, db,
+                    refresh_show_stats, venue_genres)
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline_routes.json')
+SEED_BATCH = 10000
+MEMORY_SLACK_KIB = 64
+
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Seattle', 'WA'),
+          ('Chicago', 'IL'), ('Nashville', 'TN'), ('Denver', 'CO'), ('Portland', 'OR')]
+# venues are scattered over about 30 x 30 km around their city's centre
+CENTERS = {'San Francisco': (37.7749, -122.4194), 'New York': (40.7128, -74.0060),
+           'Austin': (30.2672, -97.7431), 'Seattle': (47.6062, -122.3321),
+           'Chicago': (41.8781, -87.6298), 'Nashville': (36.1627, -86.7816),
+           'Denver': (39.7392, -104.9903), 'Portland': (45.5152, -122.6784)}
+SPREAD_DEGREES = 0.15
+NEARBY_KM = 5
+WORDS = ['Blue', 'Night', 'Velvet', 'Echo', 'Musical', 'Hop', 'Park', 'Square', 'Live',
+         'Hall', 'Wild', 'Sax', 'Band', 'Petals', 'Coffee', 'Lounge', 'Garden', 'Stage']
+
+
+def name(rng, kind, number):
+  return f"{' '.join(rng.sample(WORDS, 2))} {kind} {number}"
+
+
+def location(rng, city):
+  latitude, longitude = CENTERS[city]
+  latitude += rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)
+  longitude += rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)
+  return {'latitude': latitude, 'longitude': longitude,
+          'geohash': geo.geohash_of(latitude, longitude)}
+
+
+def locate(rng):
+  # venues of a database seeded before they had coordinates
+  table = Venue.__table__
+  with db.engine.begin() as connection:
+    rows = connection.execute(select(Venue.id, Venue.city).where(Venue.geohash.is_(None))).all()
+    if rows:
+      connection.execute(
+          table.update().where(table.c.id == bindparam('venue_id')).values(
+              latitude=bindparam('new_latitude'), longitude=bindparam('new_longitude'),
+              geohash=bindparam('new_geohash')),
+          [{'venue_id': venue_id, **{f'new_{key}': value
+                                     for key, value in location(rng, city).items()}}
+           for venue_id, city in rows])
+      print(f'  located {len(rows)} Venue rows', file=sys.stderr)
+
+
+def seed(volumes, rng):
+  """Fill an empty catalog with ``volumes`` rows."""
+  now = datetime.now()
+  # Shows are laid out in time slots of min(venues, artists) shows each;
+  # within a slot every venue and every artist appears at most once, so no
+  # booking overlaps another. Slots spread over two years back and one ahead.
+  per_slot = min(volumes['venues'], volumes['artists'])
+  slots = -(-volumes['shows'] // per_slot)
+  spacing = max(timedelta(days=3 * 365) / slots, timedelta(hours=3))
+  first_slot = now - timedelta(days=2 * 365)
+  venue_ids = list(range(1, volumes['venues'] + 1))
+  artist_ids = list(range(1, volumes['artists'] + 1))
+  rng.shuffle(venue_ids)
+  rng.shuffle(artist_ids)
+
+  def show(i):
+    start = first_slot + spacing * (i // per_slot) + timedelta(minutes=rng.randint(0, 30))
+    return dict(
+        venue_id=venue_ids[i % len(venue_ids)], artist_id=artist_ids[i % len(artist_ids)],
+        starting_time=start, ending_time=start + timedelta(minutes=DEFAULT_SHOW_MINUTES),
+        version=1, updated_at=now)
+
+  with db.engine.begin() as connection:
+    # the Genre table is filled by its migration
+    genre_ids = connection.execute(select(Genre.id).order_by(Genre.id)).scalars().all()
+    for table, count, make in (
+        (Venue.__table__, volumes['venues'], lambda i: dict(
+            name=name(rng, 'Venue', i), city=CITIES[i % len(CITIES)][0],
+            state=CITIES[i % len(CITIES)][1], address=f'{i} Main Street',
+            phone='555-555-5555', **location(rng, CITIES[i % len(CITIES)][0]),
+            image_link=f'https://example.com/venues/{i}.jpg', version=1, updated_at=now)),
+        (venue_genres, 2 * volumes['venues'], lambda i: dict(
+            venue_id=i // 2 + 1, genre_id=genre_ids[(i // 2 * 7 + i % 2 * 5) % len(genre_ids)])),
+        (Artist.__table__, volumes['artists'], lambda i: dict(
+            name=name(rng, 'Artist', i), city=CITIES[i % len(CITIES)][0],
+            state=CITIES[i % len(CITIES)][1], phone='555-555-5555',
+            image_link=f'https://example.com/artists/{i}.jpg', version=1, updated_at=now)),
+        (artist_genres, volumes['artists'], lambda i: dict(
+            artist_id=i + 1, genre_id=genre_ids[i * 3 % len(genre_ids)])),
+        (Show.__table__, volumes['shows'], show)):
+      for start in range(0, count, SEED_BATCH):
+        connection.execute(insert(table), [make(i) for i in range(start, min(start + SEED_BATCH, count))])
+      print(f'  seeded {count} {table.name} rows', file=sys.stderr)
+    refresh_show_stats(connection)
+
+
+def prepare(volumes, rng):
+  upgrade(directory=os.path.join(ROOT, 'migrations'))
+  counts = {kind: db.session.scalar(select(func.count()).select_from(model))
+            for kind, model in (('venues', Venue), ('artists', Artist), ('shows', Show))}
+  db.session.rollback()
+  if counts == volumes:
+    print('  reusing seeded database', file=sys.stderr)
+    locate(rng)
+  elif any(counts.values()):
+    sys.exit(f'database holds {counts}, not the requested {volumes}; use an empty one')
+  else:
+    seed(volumes, rng)
+  ids = {
+      'venue_ids': [row[0] for row in db.session.execute(select(Venue.id))],
+      'artist_ids': [row[0] for row in db.session.execute(select(Artist.id))],
+      'genres': db.session.execute(select(Genre.name)).scalars().all(),
+      'last_show_id': db.session.scalar(select(func.max(Show.id))) or 0,
+  }
+  db.session.rollback()
+  return ids
+
+
+def restore(ids):
+  # drop what the write routes created, so the database can be reused
+  with db.engine.begin() as connection:
+    last_venue = max(ids['venue_ids'], default=0)
+    last_artist = max(ids['artist_ids'], default=0)
+    # SQLite does not enforce the links' ON DELETE CASCADE
+    connection.execute(venue_genres.delete().where(venue_genres.c.venue_id > last_venue))
+    connection.execute(artist_genres.delete().where(artist_genres.c.artist_id > last_artist))
+    for model, last in ((Show, ids['last_show_id']), (Venue, last_venue), (Artist, last_artist)):
+      connection.execute(model.__table__.delete().where(model.id > last))
+    # the rollup is rebuilt below; the recounts the writes queued are moot
+    connection.execute(Job.__table__.delete())
+    refresh_show_stats(connection)
+
+
+def sample_png(width=800, height=600):
+  # an RGB gradient, encoded without Pillow
+  def chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+  rows = b''.join(
+      b'\x00' + bytes(value for x in range(width)
+                      for value in (x * 255 // width, y * 255 // height, 128))
+      for y in range(height))
+  return (b'\x89PNG\r\n\x1a\n'
+          + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+          + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def prepare_media(root, image):
+  # one stored upload and its derivatives (when Pillow is there to render
+  # them; otherwise the derivative URL measures the redirect to the original)
+  name, _ = media.store(io.BytesIO(image), root, len(image))
+  media.render_derivatives(root, name)
+  return {'image_name': name, 'thumb_name': media.derivative_name(name, 'thumb', 'webp')}
+
+
+def throwaway(model, ids, rng):
+  """Insert a venue or artist with one show for a delete or image upload
+  request to use up; ``restore`` drops whatever is left."""
+  kind = model.__tablename__
+  other = 'artist_id' if model is Venue else 'venue_id'
+  now = datetime.now()
+  with db.engine.begin() as connection:
+    entity_id = connection.execute(insert(model).values(
+        name=name(rng, kind, 'spare'), city='Austin', state='TX', phone='555-555-5555',
+        version=1, updated_at=now)).inserted_primary_key[0]
+    # past the seeded shows, three hours apart: no booking overlaps another
+    start = now + timedelta(days=2 * 365, hours=3 * entity_id)
+    connection.execute(insert(Show).values(**{
+        f'{kind.lower()}_id': entity_id, other: rng.choice(ids[f'{other}s']),
+        'starting_time': start, 'ending_time': start + timedelta(minutes=DEFAULT_SHOW_MINUTES),
+        'version': 1, 'updated_at': now}))
+  return entity_id
+
+
+def routes(ids, rng):
+  """(label, method, url, form data) factories covering every route."""
+  venue = lambda: rng.choice(ids['venue_ids'])
+  genre = lambda: rng.choice(ids['genres'])
+  state = lambda: rng.choice(CITIES)[1]
+  near = lambda: location(rng, rng.choice(CITIES)[0])
+  artist = lambda: rng.choice(ids['artist_ids'])
+  start_time = lambda: (datetime.now() + timedelta(days=rng.randint(1, 365))).isoformat(' ')
+  spares = lambda model, count: ','.join(str(throwaway(model, ids, rng)) for _ in range(count))
+  return [
+      ('GET /', lambda: ('GET', '/', None)),
+      ('GET /venues', lambda: ('GET', '/venues', None)),
+      ('GET /venues?<facets>', lambda: ('GET', f'/venues?state={state()}&genre={genre()}', None)),
+      ('GET /venues/<id>', lambda: ('GET', f'/venues/{venue()}', None)),
+      ('POST /venues/search', lambda: ('POST', '/venues/search',
+                                       {'search_term': rng.choice(WORDS)})),
+      ('GET /venues/<id>/availability', lambda: ('GET', f'/venues/{venue()}/availability', None)),
+      ('GET /venues/nearby', lambda: ('GET', '/venues/nearby?lat={latitude}&lon={longitude}'
+                                      f'&radius={NEARBY_KM}'.format(**near()), None)),
+      ('GET /venues/create', lambda: ('GET', '/venues/create', None)),
+      ('POST /venues/create', lambda: ('POST', '/venues/create', {
+          'name': name(rng, 'Venue', 'new'), 'city': 'Austin', 'state': 'TX',
+          'address': '1 Main Street', 'phone': '555-555-5555', 'genres': 'Jazz'})),
+      ('GET /venues/<id>/edit', lambda: ('GET', f'/venues/{venue()}/edit', None)),
+      ('POST /venues/<id>/edit', lambda: ('POST', f'/venues/{venue()}/edit', {
+          'name': name(rng, 'Venue', 'edited'), 'city': 'Austin', 'state': 'TX',
+          'phone': '555-555-5555', 'genres': 'Jazz'})),
+      ('DELETE /venues/<id>', lambda: ('DELETE', f'/venues/{throwaway(Venue, ids, rng)}', None)),
+      ('POST /venues/delete', lambda: ('POST', '/venues/delete', {'ids': spares(Venue, 10)})),
+      ('POST /venues/<id>/image', lambda: ('POST', f'/venues/{throwaway(Venue, ids, rng)}/image',
+                                           {'image': (io.BytesIO(ids['image']), 'venue.png')})),
+      ('GET /media/<original>', lambda: ('GET', f"/media/{ids['image_name']}", None)),
+      ('GET /media/<thumb>', lambda: ('GET', f"/media/{ids['thumb_name']}", None)),
+      ('GET /artists', lambda: ('GET', '/artists', None)),
+      ('GET /artists?<facets>', lambda: ('GET', f'/artists?state={state()}&genre={genre()}', None)),
+      ('GET /artists/<id>', lambda: ('GET', f'/artists/{artist()}', None)),
+      ('POST /artists/search', lambda: ('POST', '/artists/search',
+                                        {'search_term': rng.choice(WORDS)})),
+      ('GET /artists/create', lambda: ('GET', '/artists/create', None)),
+      ('POST /artists/create', lambda: ('POST', '/artists/create', {
+          'name': name(rng, 'Artist', 'new'), 'city': 'Austin', 'state': 'TX',
+          'phone': '555-555-5555', 'genres': 'Jazz'})),
+      ('GET /artists/<id>/edit', lambda: ('GET', f'/artists/{artist()}/edit', None)),
+      ('POST /artists/<id>/edit', lambda: ('POST', f'/artists/{artist()}/edit', {
+          'name': name(rng, 'Artist', 'edited'), 'city': 'Austin', 'state': 'TX',
+          'phone': '555-555-5555', 'genres': 'Jazz'})),
+      ('DELETE /artists/<id>', lambda: ('DELETE', f'/artists/{throwaway(Artist, ids, rng)}', None)),
+      ('POST /artists/delete', lambda: ('POST', '/artists/delete', {'ids': spares(Artist, 10)})),
+      ('GET /shows', lambda: ('GET', '/shows', None)),
+      ('GET /shows/create', lambda: ('GET', '/shows/create', None)),
+      ('POST /shows/create', lambda: ('POST', '/shows/create', {
+          'artist_id': str(artist()), 'venue_id': str(venue()), 'start_time': start_time(),
+          'duration': '90'})),
+      ('GET /autocomplete', lambda: ('GET', f'/autocomplete?q={rng.choice(WORDS)[:3]}', None)),
+      ('GET /api/v1/venues', lambda: ('GET', '/api/v1/venues', None)),
+      ('GET /api/v1/venues/<id>', lambda: ('GET', f'/api/v1/venues/{venue()}', None)),
+      ('GET /api/v1/artists', lambda: ('GET', '/api/v1/artists', None)),
+      ('GET /api/v1/artists/<id>', lambda: ('GET', f'/api/v1/artists/{artist()}', None)),
+      ('GET /api/v1/shows', lambda: ('GET', '/api/v1/shows', None)),
+      ('GET /api/v1/shows/<id>', lambda: ('GET', '/api/v1/shows/1', None)),
+      ('GET /assets/<bundle>', lambda: ('GET', f"/assets/{ids['bundle']}", None)),
+      ('GET /metrics', lambda: ('GET', '/metrics', None)),
+  ]
+
+
+class StatementCounter(object):
+
+  def __init__(self):
+    self.count = 0
+    event.listen(Engine, 'before_cursor_execute', self._count)
+
+  def _count(self, *args):
+    self.count += 1
+
+
+def call(client, method, url, data):
+  # write routes print failed commits to stdout; keep them out of the table
+  with contextlib.redirect_stdout(io.StringIO()):
+    response = client.open(url, method=method, data=data)
+  response.get_data()  # drain streamed bodies inside the measurement
+  response.close()
+  if response.status_code >= 500:
+    raise RuntimeError(f'{method} {url} answered {response.status_code}')
+  return response
+
+
+def percentile(values, fraction):
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(client, make, requests, warmup, counter):
+  for _ in range(warmup):
+    call(client, *make())
+  latencies = []
+  statements = []
+  for _ in range(requests):
+    request = make()
+    before = counter.count
+    started = time.perf_counter()
+    call(client, *request)
+    latencies.append((time.perf_counter() - started) * 1000)
+    statements.append(counter.count - before)
+
+  request = make()
+  tracemalloc.start()
+  call(client, *request)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return {
+      'p50_ms': round(statistics.median(latencies), 3),
+      'p95_ms': round(percentile(latencies, .95), 3),
+      'p99_ms': round(percentile(latencies, .99), 3),
+      'max_ms': round(max(latencies), 3),
+      'statements': round(statistics.mean(statements), 2),
+      'peak_kib': round(peak / 1024, 1),
+  }
+
+
+def regressions(results, baseline, threshold, slack_ms):
+  # Latency is judged on the median, which a stray GC pause or scheduler
+  # hiccup does not move, and must also grow by more than slack_ms so that
+  # sub-millisecond routes do not fail on noise.
+  problems = []
+  for route, now in results.items():
+    before = baseline['routes'].get(route)
+    if before is None:
+      continue
+    if now['p50_ms'] > max(before['p50_ms'] * (1 + threshold), before['p50_ms'] + slack_ms):
+      problems.append(f"{route}: p50 {before['p50_ms']:.2f} -> {now['p50_ms']:.2f} ms")
+    if now['statements'] > before['statements']:
+      problems.append(f"{route}: statements {before['statements']} -> {now['statements']}")
+    if now['peak_kib'] > before['peak_kib'] * (1 + threshold) + MEMORY_SLACK_KIB:
+      problems.append(f"{route}: peak memory {before['peak_kib']} -> {now['peak_kib']} KiB")
+  return problems
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--database', help='database URL (default: a SQLite file in the temp dir)')
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=5000)
+  parser.add_argument('--shows', type=int, default=100000)
+  parser.add_argument('--requests', type=int, default=30, help='timed requests per route')
+  parser.add_argument('--warmup', type=int, default=3)
+  parser.add_argument('--page-cache', action='store_true', help='leave the page cache on')
+  parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+  parser.add_argument('--save-baseline', action='store_true')
+  parser.add_argument('--compare', action='store_true',
+                      help='exit 1 on regressions against the baseline')
+  parser.add_argument('--threshold', type=float, default=0.25,
+                      help='allowed relative latency/memory growth (default 0.25)')
+  parser.add_argument('--slack-ms', type=float, default=1.0,
+                      help='latency growth always tolerated (default 1.0)')
+  args = parser.parse_args()
+
+  volumes = {'venues': args.venues, 'artists': args.artists, 'shows': args.shows}
+  database = args.database or 'sqlite:///' + os.path.join(
+      tempfile.gettempdir(), 'fyyur_bench_{venues}_{artists}_{shows}.db'.format(**volumes))
+  app = fyyur.create_app(
+      'testing', SQLALCHEMY_DATABASE_URI=database, PAGE_CACHE_ENABLED=args.page_cache,
+      SERVER_TIMING=False, METRICS_ENABLED=True, JOBS_EAGER=False,
+      ASSETS_ROOT=tempfile.mkdtemp(prefix='fyyur_bench_assets_'),
+      MEDIA_ROOT=tempfile.mkdtemp(prefix='fyyur_bench_media_'))
+  rng = random.Random(0)
+
+  with app.app_context():
+    print(f'preparing {database}', file=sys.stderr)
+    ids = prepare(volumes, rng)
+    ids['bundle'] = fyyur.assets.build(app)['css/app.css']
+    ids['image'] = sample_png()
+    ids.update(prepare_media(app.config['MEDIA_ROOT'], ids['image']))
+    # the autocomplete index is built in the background; not while timing
+    index = fyyur.typeahead.state(app)
+    while not index.ready:
+      time.sleep(0.05)
+    counter = StatementCounter()
+    client = app.test_client()
+    results = {}
+    print(f"{'route':<28}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'stmts':>8}{'peak KiB':>10}")
+    try:
+      for label, make in routes(ids, rng):
+        result = results[label] = measure(client, make, args.requests, args.warmup, counter)
+        print(f"{label:<28}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+              f"{result['p99_ms']:>9.2f}{result['max_ms']:>9.2f}"
+              f"{result['statements']:>8}{result['peak_kib']:>10}")
+    finally:
+      db.session.remove()
+      restore(ids)
+
+  report = {'volumes': volumes, 'backend': make_url(database).get_backend_name(),
+            'routes': results}
+  if args.save_baseline:
+    with open(args.baseline, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+    print(f'baseline written to {args.baseline}')
+  if args.compare:
+    if not os.path.exists(args.baseline):
+      sys.exit(f'no baseline at {args.baseline}; run with --save-baseline first')
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if baseline['volumes'] != volumes:
+      print(f"warning: baseline was taken with {baseline['volumes']}", file=sys.stderr)
+    problems = regressions(results, baseline, args.threshold, args.slack_ms)
+    for problem in problems:
+      print(f'REGRESSION {problem}')
+    if problems:
+      sys.exit(1)
+    print(f'no regressions beyond {args.threshold:.0%} against {args.baseline}')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,240 @@
+"""Rendered-page cache.
+
+Read routes decorated with ``page_cache.cached`` store their finished
+response in a backend, keyed by path and query string. Every entry carries
+tags naming the rows it was built from (``venue:3``, ``artists``...).
+When a session commits, the Venue/Artist/Show rows it inserted, updated or
+deleted are mapped to tags through the rules registered with
+``tag_rule`` and exactly those entries are dropped. The TTL only bounds
+how long time-dependent output (a show turning from upcoming to past)
+can lag.
+
+``LRUBackend`` is the in-process default. A shared cache plugs in by
+implementing ``CacheBackend``.
+
+``conditional`` answers conditional GETs: a cheap validator query yields
+the page's ETag, and a matching If-None-Match gets a 304 before the view
+runs at all.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_PENDING_TAGS = 'page_cache.pending_tags'
+
+
+class CacheBackend(object):
+  """Storage interface used by :class:`PageCache`.
+
+  ``generation`` must change whenever tags are invalidated; an entry
+  rendered while it moved is not stored, so a page built from data read
+  before a commit cannot outlive that commit's invalidation.
+  """
+
+  generation = 0
+
+  def get(self, key):
+    raise NotImplementedError
+
+  def set(self, key, value, tags, generation):
+    raise NotImplementedError
+
+  def invalidate_tags(self, tags):
+    raise NotImplementedError
+
+  def clear(self):
+    raise NotImplementedError
+
+  def stats(self):
+    return {}
+
+
+class LRUBackend(CacheBackend):
+  """Size-bounded LRU with per-entry TTL, safe to share between threads."""
+
+  def __init__(self, max_entries=1024, ttl=300):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.generation = 0
+    self._entries = OrderedDict()  # key -> (expires_at, tags, value)
+    self._tags = {}  # tag -> set of keys
+    self._lock = threading.Lock()
+    self._stats = dict(hits=0, misses=0, evictions=0, expirations=0, invalidations=0)
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self._stats['misses'] += 1
+        return None
+      if entry[0] < time.monotonic():
+        self._remove(key)
+        self._stats['expirations'] += 1
+        self._stats['misses'] += 1
+        return None
+      self._entries.move_to_end(key)
+      self._stats['hits'] += 1
+      return entry[2]
+
+  def set(self, key, value, tags, generation):
+    with self._lock:
+      if generation != self.generation:
+        return False
+      if key in self._entries:
+        self._remove(key)
+      self._entries[key] = (time.monotonic() + self.ttl, frozenset(tags), value)
+      for tag in tags:
+        self._tags.setdefault(tag, set()).add(key)
+      while len(self._entries) > self.max_entries:
+        self._remove(next(iter(self._entries)))
+        self._stats['evictions'] += 1
+      return True
+
+  def invalidate_tags(self, tags):
+    with self._lock:
+      self.generation += 1
+      for tag in tags:
+        for key in self._tags.pop(tag, ()):
+          if key in self._entries:
+            self._remove(key)
+            self._stats['invalidations'] += 1
+
+  def clear(self):
+    with self._lock:
+      self.generation += 1
+      self._entries.clear()
+      self._tags.clear()
+
+  def stats(self):
+    with self._lock:
+      return dict(self._stats, entries=len(self._entries))
+
+  def _remove(self, key):
+    _, tags, _ = self._entries.pop(key)
+    for tag in tags:
+      keys = self._tags.get(tag)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del self._tags[tag]
+
+
+class PageCache(object):
+
+  def __init__(self, app=None, backend=None):
+    self.backend = backend
+    self.enabled = False
+    self._rules = {}
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('PAGE_CACHE_ENABLED', True)
+    app.config.setdefault('PAGE_CACHE_MAX_ENTRIES', 1024)
+    app.config.setdefault('PAGE_CACHE_TTL', 300)
+    self.enabled = app.config['PAGE_CACHE_ENABLED']
+    if self.backend is None:
+      self.backend = LRUBackend(app.config['PAGE_CACHE_MAX_ENTRIES'],
+                                app.config['PAGE_CACHE_TTL'])
+    if not event.contains(Session, 'after_flush', self._collect):
+      event.listen(Session, 'after_flush', self._collect)
+      event.listen(Session, 'after_commit', self._invalidate_pending)
+      event.listen(Session, 'after_soft_rollback', self._discard_pending)
+
+  def tag_rule(self, model, rule):
+    """Register ``rule(obj)`` returning the tags a write to ``obj`` dirties."""
+    self._rules[model] = rule
+
+  def tag(self, *tags):
+    """Attach tags to the response the current view is building."""
+    if 'page_cache_tags' in g:
+      g.page_cache_tags.update(tags)
+
+  def invalidate(self, *tags):
+    """Drop the entries carrying any of ``tags`` now, for writes committed
+    outside a session (Core transactions of background jobs)."""
+    if self.backend is not None:
+      self.backend.invalidate_tags(tags)
+
+  def invalidate_on_commit(self, session, *tags):
+    """Queue tags for writes the ORM cannot see, such as bulk UPDATE/DELETE."""
+    session.info.setdefault(_PENDING_TAGS, set()).update(tags)
+
+  def stats(self):
+    return self.backend.stats()
+
+  def cached(self, view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      # pages that are about to show a flash message are one-off renders
+      if not self.enabled or request.method != 'GET' or session.get('_flashes'):
+        return view(*args, **kwargs)
+      key = request.full_path
+      hit = self.backend.get(key)
+      if hit is not None:
+        body, status, headers = hit
+        response = current_app.response_class(body, status, headers)
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+      generation = self.backend.generation
+      g.page_cache_tags = set()
+      response = make_response(view(*args, **kwargs))
+      if response.status_code == 200 and not response.is_streamed:
+        self.backend.set(
+            key,
+            (response.get_data(), response.status_code, list(response.headers.items())),
+            g.page_cache_tags, generation)
+      response.headers['X-Cache'] = 'MISS'
+      return response
+    return wrapper
+
+  def _collect(self, db_session, flush_context):
+    pending = db_session.info.setdefault(_PENDING_TAGS, set())
+    for obj in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted):
+      rule = self._rules.get(type(obj))
+      if rule is not None:
+        pending.update(rule(obj))
+
+  def _invalidate_pending(self, db_session):
+    tags = db_session.info.pop(_PENDING_TAGS, None)
+    if tags and self.backend is not None:
+      self.backend.invalidate_tags(tags)
+
+  def _discard_pending(self, db_session, previous_transaction):
+    db_session.info.pop(_PENDING_TAGS, None)
+
+
+
+def conditional(validator):
+  """Decorate a GET view with ETag / If-None-Match handling.
+
+  ``validator`` takes the view's arguments and returns a small hashable
+  state (row versions, counts, timestamps) that changes whenever the page
+  would, or ``None`` to leave the request to the view (e.g. unknown id).
+  """
+  def decorator(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      if request.method != 'GET' or session.get('_flashes'):
+        return view(*args, **kwargs)
+      state = validator(*args, **kwargs)
+      if state is None:
+        return view(*args, **kwargs)
+      etag = hashlib.sha1(repr((request.full_path, state)).encode()).hexdigest()
+      if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+      else:
+        response = make_response(view(*args, **kwargs))
+      response.set_etag(etag, weak=True)
+      response.cache_control.no_cache = True
+      return response
+    return wrapper
+  return decorator
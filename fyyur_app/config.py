@@ -1,14 +1,142 @@
 import os
-SECRET_KEY = os.urandom(32)
+
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-# Enable debug mode.
-DEBUG = True
 
-# Connect to the database
-# app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///fyyur'
-# app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def env(name, default=None, cast=str):
+  value = os.environ.get(name)
+  if value is None or value == '':
+    return default
+  if cast is bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+  return cast(value)
+
+
+class Config(object):
+  # Signs the session cookie, which also carries the replica read-your-writes
+  # marker. Unset, each process makes up its own key, which create_app
+  # refuses when read replicas are configured.
+  SECRET_KEY = env('SECRET_KEY')
+
+  # Connect to the database
+  SQLALCHEMY_DATABASE_URI = env('DATABASE_URL', 'postgresql:///fyyur')
+  SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+  # Connection pool and engine tuning, turned into SQLALCHEMY_ENGINE_OPTIONS
+  # by create_app. Pool sizing is skipped for SQLite, which has no server to
+  # pool connections to.
+  DB_POOL_SIZE = env('DB_POOL_SIZE', 10, int)
+  DB_MAX_OVERFLOW = env('DB_MAX_OVERFLOW', 20, int)
+  DB_POOL_TIMEOUT = env('DB_POOL_TIMEOUT', 30, int)
+  # seconds before a pooled connection is replaced; keep below server/proxy idle timeouts
+  DB_POOL_RECYCLE = env('DB_POOL_RECYCLE', 1800, int)
+  DB_POOL_PRE_PING = env('DB_POOL_PRE_PING', True, bool)
+  # per-statement timeout in milliseconds (Postgres only, 0 disables)
+  DB_STATEMENT_TIMEOUT = env('DB_STATEMENT_TIMEOUT', 0, int)
+  DB_ECHO = env('DB_ECHO', False, bool)
+
+  # Read replicas (comma-separated URLs). Read-only views query them in
+  # turn; writes, and a client's reads for REPLICA_READ_YOUR_WRITES seconds
+  # after its own writes, stay on the primary. See replicas.py.
+  REPLICA_URIS = env('DATABASE_REPLICA_URLS', '')
+  REPLICA_READ_YOUR_WRITES = env('REPLICA_READ_YOUR_WRITES', 5, float)
+  REPLICA_HEALTH_CHECK_INTERVAL = env('REPLICA_HEALTH_CHECK_INTERVAL', 10, float)
+  # seconds a Postgres standby may lag before reads stop going to it
+  REPLICA_MAX_LAG = env('REPLICA_MAX_LAG', 30, float)
+
+  # Per-request instrumentation: Server-Timing header, Prometheus metrics
+  # at /metrics, and a warning when one statement shape runs more than
+  # N_PLUS_ONE_THRESHOLD times in a request.
+  METRICS_ENABLED = env('METRICS_ENABLED', True, bool)
+  SERVER_TIMING = env('SERVER_TIMING', True, bool)
+  N_PLUS_ONE_THRESHOLD = env('N_PLUS_ONE_THRESHOLD', 10, int)
+
+  # Rows per page on the /artists and /shows listings.
+  LIST_PAGE_SIZE = env('LIST_PAGE_SIZE', 50, int)
+
+  # Stream listing pages to the client while the template renders.
+  STREAM_TEMPLATES = env('STREAM_TEMPLATES', False, bool)
+
+  # Venue/artist deletes stamp deleted_at instead of removing the rows and
+  # their shows; every ORM read skips stamped rows.
+  SOFT_DELETE = env('SOFT_DELETE', False, bool)
+
+  # Background jobs (jobs.py), run by `flask worker`: threads per worker,
+  # seconds between polls when idle, attempts per job, first retry delay
+  # (doubling per attempt up to JOBS_RETRY_MAX_DELAY), and seconds after
+  # which a job held by a silent worker is claimed again.
+  JOBS_WORKER_THREADS = env('JOBS_WORKER_THREADS', 4, int)
+  JOBS_POLL_INTERVAL = env('JOBS_POLL_INTERVAL', 1.0, float)
+  JOBS_MAX_ATTEMPTS = env('JOBS_MAX_ATTEMPTS', 5, int)
+  JOBS_RETRY_DELAY = env('JOBS_RETRY_DELAY', 5, float)
+  JOBS_RETRY_MAX_DELAY = env('JOBS_RETRY_MAX_DELAY', 3600, float)
+  JOBS_LOCK_TIMEOUT = env('JOBS_LOCK_TIMEOUT', 600, float)
+  # run jobs inside enqueue, in the request's own transaction
+  JOBS_EAGER = env('JOBS_EAGER', False, bool)
+  # run a worker thread in each web process as well
+  JOBS_EMBEDDED_WORKER = env('JOBS_EMBEDDED_WORKER', False, bool)
+
+  # Uploaded images (media.py): originals and their resized derivatives are
+  # stored under MEDIA_ROOT and served at /media/ with far-future caching.
+  # Derivatives are rendered by a background job in a pool of
+  # IMAGE_PROCESSES processes (0: one per CPU).
+  MEDIA_ROOT = env('MEDIA_ROOT', os.path.join(basedir, 'media'))
+  MEDIA_MAX_AGE = env('MEDIA_MAX_AGE', 365 * 24 * 3600, int)
+  IMAGE_MAX_BYTES = env('IMAGE_MAX_BYTES', 10 * 1024 * 1024, int)
+  IMAGE_PROCESSES = env('IMAGE_PROCESSES', 0, int)
+
+  # Static assets built by `flask assets` (assets.py): fingerprinted copies
+  # of static/ and the CSS/JS bundles, served at ASSETS_URL_PATH with
+  # far-future caching. Without ASSETS_BUNDLED templates load the sources.
+  ASSETS_ROOT = env('ASSETS_ROOT', os.path.join(basedir, 'static', 'build'))
+  ASSETS_URL_PATH = env('ASSETS_URL_PATH', '/assets')
+  ASSETS_MAX_AGE = env('ASSETS_MAX_AGE', 365 * 24 * 3600, int)
+  ASSETS_BUNDLED = env('ASSETS_BUNDLED', True, bool)
+
+  # Name completion (/autocomplete) from an in-memory prefix index per web
+  # process (typeahead.py): its estimated size limit, and seconds between
+  # catch-ups on writes made by other processes.
+  TYPEAHEAD_ENABLED = env('TYPEAHEAD_ENABLED', True, bool)
+  TYPEAHEAD_MAX_BYTES = env('TYPEAHEAD_MAX_BYTES', 64 * 1024 * 1024, int)
+  TYPEAHEAD_SYNC_INTERVAL = env('TYPEAHEAD_SYNC_INTERVAL', 30, float)
+
+  # Rendered-page cache for the read-only listing and detail pages. Entries
+  # are dropped when a commit touches the rows they show; the TTL (seconds)
+  # bounds how stale upcoming/past show splits can get.
+  PAGE_CACHE_ENABLED = env('PAGE_CACHE_ENABLED', True, bool)
+  PAGE_CACHE_MAX_ENTRIES = env('PAGE_CACHE_MAX_ENTRIES', 1024, int)
+  PAGE_CACHE_TTL = env('PAGE_CACHE_TTL', 300, int)
+
+
+class DevelopmentConfig(Config):
+  # Enable debug mode.
+  DEBUG = True
+  JOBS_EMBEDDED_WORKER = env('JOBS_EMBEDDED_WORKER', True, bool)
+  # CSS/JS edits show up without rebuilding
+  ASSETS_BUNDLED = env('ASSETS_BUNDLED', False, bool)
+
+
+class ProductionConfig(Config):
+  DEBUG = False
+
+
+class TestingConfig(Config):
+  TESTING = True
+  # in-memory SQLite unless a test database is given; never the real one
+  SQLALCHEMY_DATABASE_URI = env('TEST_DATABASE_URL', 'sqlite://')
+  REPLICA_URIS = env('TEST_DATABASE_REPLICA_URLS', '')
+  SECRET_KEY = env('SECRET_KEY', 'testing')
+  WTF_CSRF_ENABLED = False
+  PAGE_CACHE_ENABLED = False
+  JOBS_EAGER = True
+
+
+profiles = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql:///fyyur'
+# Profile used when create_app() is called without one.
+DEFAULT_PROFILE = env('FYYUR_CONFIG', 'development')
@@ -13,6 +13,11 @@ def test():
         abort("Aborted at user request.")
 
 
+def benchmark():
+    # fails when a route regressed against benchmarks/baseline_routes.json
+    local("python benchmarks/bench_routes.py --compare")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -0,0 +1,106 @@
+"""Faceted browsing for the venue and artist listings.
+
+A listing is narrowed by facets (state, city, genre, seeking). The
+selection travels in the query string, one repeatable argument per facet:
+``?state=NY&genre=Jazz&genre=Soul``. Values of one facet are alternatives;
+different facets must all hold.
+
+Each option is shown with the number of rows choosing it would leave,
+i.e. the count under the selection of every *other* facet, so picking one
+state still shows how many rows the other states hold. The counts of all
+facets come from one statement: a UNION ALL of one GROUP BY per facet.
+
+Links are built from the selection in one order (facets as declared,
+values sorted), so a combination has a single URL and a single
+page-cache entry; the page cache drops it when a write commits.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import func, literal, select, union_all
+
+# options listed per facet, most frequent first; selected ones always are
+OPTIONS_SHOWN = 20
+
+Option = namedtuple('Option', 'value label count selected args')
+
+
+class Facet(object):
+  """A facet on ``value``, a string expression of the listed rows.
+
+  ``joins`` are ``(target, onclause)`` pairs reaching ``value`` from the
+  listed model. ``criterion(values)`` keeps the rows matching any of
+  ``values``; by default ``value IN values``, which needs no join.
+  ``labels`` maps stored values to the text shown for them.
+  """
+
+  def __init__(self, name, label, value, joins=(), criterion=None, labels=None):
+    self.name = name
+    self.label = label
+    self.value = value
+    self.joins = joins
+    self._criterion = criterion
+    self.labels = labels or {}
+
+  def criterion(self, values):
+    if self._criterion is not None:
+      return self._criterion(values)
+    return self.value.in_(values)
+
+  def counts(self, model, where):
+    query = select(literal(self.name).label('facet'), self.value.label('value'),
+                   func.count().label('count')).select_from(model)
+    for target, onclause in self.joins:
+      query = query.join(target, onclause)
+    return query.where(*where).group_by(self.value)
+
+
+def selection(facets, args):
+  """The values chosen in ``args`` as ``{facet name: sorted values}``, in
+  facet order; unknown arguments and empty values are ignored."""
+  chosen = {}
+  for facet in facets:
+    values = sorted({value for value in args.getlist(facet.name) if value})
+    if values:
+      chosen[facet.name] = values
+  return chosen
+
+
+def criteria(facets, chosen, skip=None):
+  """Criteria applying ``chosen``, leaving out the facet named ``skip``."""
+  return [facet.criterion(chosen[facet.name]) for facet in facets
+          if facet.name in chosen and facet.name != skip]
+
+
+def toggled(facets, chosen, name, value):
+  # chosen with value added to / removed from facet name, in link order
+  values = set(chosen.get(name, ()))
+  values ^= {value}
+  result = dict(chosen, **{name: sorted(values)})
+  return {facet.name: result[facet.name] for facet in facets if result.get(facet.name)}
+
+
+def facet_counts(session, model, facets, chosen, shown=OPTIONS_SHOWN):
+  """Return ``[(facet, options)]`` for ``model`` rows under ``chosen``.
+
+  Options are ``Option`` tuples, most frequent first; ``args`` is the
+  selection after toggling that option, ready for ``url_for``.
+  """
+  statement = union_all(*[facet.counts(model, criteria(facets, chosen, skip=facet.name))
+                          for facet in facets])
+  counts = {facet.name: {} for facet in facets}
+  for row in session.execute(statement):
+    if row.value is not None:
+      counts[row.facet][row.value] = row.count
+
+  result = []
+  for facet in facets:
+    found = counts[facet.name]
+    selected = set(chosen.get(facet.name, ()))
+    ranked = sorted(found, key=lambda value: (-found[value], value))
+    values = ranked[:shown] + sorted(selected.difference(ranked[:shown]))
+    result.append((facet, [
+        Option(value, facet.labels.get(value, value), found.get(value, 0), value in selected,
+               toggled(facets, chosen, facet.name, value))
+        for value in values]))
+  return result
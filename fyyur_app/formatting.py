@@ -0,0 +1,54 @@
+"""Datetime formatting for templates.
+
+``format_datetime`` is the ``datetime`` Jinja filter. Show tiles repeat it
+thousands of times per page, so:
+
+* datetimes are formatted as they are; only strings get parsed, with
+  ``datetime.fromisoformat`` before falling back to dateutil;
+* the 'full'/'medium' babel patterns are parsed once and the compiled
+  pattern is reused per locale;
+* results are memoized in a bounded LRU, since the same start times recur
+  across tiles and pages.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+
+import dateutil.parser
+from babel import Locale
+from babel.dates import LC_TIME, parse_pattern
+
+PATTERNS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=None)
+def _compiled(pattern):
+  return parse_pattern(pattern)
+
+
+@lru_cache(maxsize=None)
+def _locale(identifier):
+  return Locale.parse(identifier)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _format(value, pattern, locale):
+  return _compiled(pattern).apply(value, _locale(locale))
+
+
+def to_datetime(value):
+  if isinstance(value, datetime):
+    return value
+  try:
+    return datetime.fromisoformat(value)
+  except ValueError:
+    return dateutil.parser.parse(value)
+
+
+def format_datetime(value, format='medium', locale=None):
+  return _format(to_datetime(value), PATTERNS.get(format, format), locale or LC_TIME)
@@ -1,14 +1,22 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, IntegerField, HiddenField, FloatField
+from wtforms.validators import DataRequired, AnyOf, URL, NumberRange, Optional
+from models import DEFAULT_SHOW_MINUTES, MAX_SHOW_MINUTES
 
 
 class ShowForm(FlaskForm):
-    artist_id = StringField(
+    # picked by name: typeahead.js fills in the id of the chosen name
+    artist_name = StringField(
+        'artist_name'
+    )
+    artist_id = HiddenField(
         'artist_id'
     )
-    venue_id = StringField(
+    venue_name = StringField(
+        'venue_name'
+    )
+    venue_id = HiddenField(
         'venue_id'
     )
     start_time = DateTimeField(
@@ -16,6 +24,12 @@ class ShowForm(FlaskForm):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration = IntegerField(
+        # minutes
+        'duration',
+        validators=[DataRequired(), NumberRange(min=1, max=MAX_SHOW_MINUTES)],
+        default=DEFAULT_SHOW_MINUTES
+    )
 
 
 class VenueForm(FlaskForm):
@@ -115,6 +129,12 @@ class VenueForm(FlaskForm):
             ('Other', 'Other'),
         ]
     )
+    latitude = FloatField(
+        'latitude', validators=[Optional(), NumberRange(min=-90, max=90)]
+    )
+    longitude = FloatField(
+        'longitude', validators=[Optional(), NumberRange(min=-180, max=180)]
+    )
     facebook_link = StringField(
         'facebook_link'#, validators=[URL()]
     )
@@ -128,6 +148,26 @@ class VenueForm(FlaskForm):
         'seeking_description'
     )
 
+    def validate(self, extra_validators=None):
+        valid = super().validate(extra_validators)
+        return self.coordinates_paired() and valid
+
+    def coordinates_paired(self):
+        # latitude and longitude come both or not at all: a venue with only
+        # one of them gets no geohash, so /venues/nearby would never find it.
+        # Adds the error to the missing field.
+        given, missing = self.latitude, self.longitude
+        if given.data is None:
+            given, missing = missing, given
+        if given.data is None or missing.data is not None:
+            return True
+        if missing.raw_data and str(missing.raw_data[0]).strip():
+            # given but not a number: its own error says so
+            return True
+        missing.errors = list(missing.errors) + [
+            f'Required with the {given.name}, or leave both empty.']
+        return False
+
 
 class ArtistForm(FlaskForm):
     name = StringField(
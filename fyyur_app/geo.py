@@ -0,0 +1,140 @@
+"""Geohashes and great-circle distances for the nearby-venue search.
+
+A venue with coordinates stores their ``PRECISION``-character geohash in
+an indexed column. Every point of a geohash cell shares the cell's prefix,
+so the venues within a radius are found by picking the smallest cells at
+least as large as the radius (``covering_prefixes``: the cell of the
+centre and its eight neighbours), turning each prefix into a range of the
+column (``prefix_ranges``) and ranking the candidates by exact haversine
+distance. Plain B-tree range scans, so any database will do.
+
+numpy, when installed, computes the distances for all candidates at once.
+"""
+
+import math
+
+try:
+  import numpy
+except ImportError:  # pragma: no cover - optional speedup
+  numpy = None
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 12
+# mean Earth radius (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode(latitude, longitude, precision=PRECISION):
+  """The geohash of a point, ``precision`` characters long."""
+  if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+    raise ValueError(f'no such coordinates: {latitude}, {longitude}')
+  lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+  chars = []
+  bits = 0
+  value = 0
+  even = True
+  while len(chars) < precision:
+    # bits alternate between longitude and latitude, longitude first
+    interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+    middle = (interval[0] + interval[1]) / 2
+    value <<= 1
+    if coordinate >= middle:
+      value |= 1
+      interval[0] = middle
+    else:
+      interval[1] = middle
+    even = not even
+    bits += 1
+    if bits == 5:
+      chars.append(BASE32[value])
+      bits = value = 0
+  return ''.join(chars)
+
+
+def geohash_of(latitude, longitude):
+  """The stored geohash of a venue's coordinates; None without both."""
+  if latitude is None or longitude is None:
+    return None
+  return encode(latitude, longitude)
+
+
+def cell_size(precision):
+  """(latitude, longitude) degrees spanned by a cell of ``precision``."""
+  bits = 5 * precision
+  return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def covering_prefixes(latitude, longitude, radius_km):
+  """Sorted geohash prefixes whose cells cover every point within
+  ``radius_km`` of the centre; None when no cell is large enough (the
+  circle reaches a pole or spans most of a hemisphere)."""
+  lat_radius = radius_km / KM_PER_DEGREE
+  if abs(latitude) + lat_radius >= 90:
+    return None
+  # a longitude degree is shortest on the circle's poleward edge
+  lon_radius = radius_km / (KM_PER_DEGREE * math.cos(math.radians(abs(latitude) + lat_radius)))
+  for precision in range(PRECISION, 0, -1):
+    cell_lat, cell_lon = cell_size(precision)
+    if cell_lat >= lat_radius and cell_lon >= lon_radius:
+      break
+  else:
+    return None
+  cells = set()
+  for dlat in (-1, 0, 1):
+    cell_latitude = latitude + dlat * cell_lat
+    if not -90 <= cell_latitude <= 90:
+      continue
+    for dlon in (-1, 0, 1):
+      cell_longitude = (longitude + dlon * cell_lon + 180) % 360 - 180
+      cells.add(encode(cell_latitude, cell_longitude, precision))
+  return sorted(cells)
+
+
+def _successor(prefix):
+  # the first prefix of the same length sorting after every extension of
+  # prefix; None past the last one
+  chars = list(prefix)
+  while chars:
+    position = BASE32.index(chars[-1])
+    if position + 1 < len(BASE32):
+      chars[-1] = BASE32[position + 1]
+      return ''.join(chars)
+    chars.pop()
+  return None
+
+
+def prefix_ranges(prefixes):
+  """``[low, high)`` ranges of the geohashes starting with any of
+  ``prefixes``, adjacent ranges merged; high is None for 'no bound'.
+  Ranges, unlike LIKE 'prefix%', can use the index under any collation
+  that orders digits before lower-case letters."""
+  ranges = []
+  for prefix in sorted(prefixes):
+    high = _successor(prefix)
+    if ranges and ranges[-1][1] == prefix:
+      ranges[-1] = (ranges[-1][0], high)
+    else:
+      ranges.append((prefix, high))
+  return ranges
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+  """Great-circle distances in km from one point to each of the points
+  given as parallel sequences."""
+  if numpy is not None:
+    lat1 = math.radians(latitude)
+    lats = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    dlat = lats - lat1
+    dlon = numpy.radians(numpy.asarray(longitudes, dtype=float) - longitude)
+    a = numpy.sin(dlat / 2) ** 2 + math.cos(lat1) * numpy.cos(lats) * numpy.sin(dlon / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))).tolist()
+  lat1 = math.radians(latitude)
+  cos_lat1 = math.cos(lat1)
+  distances = []
+  for lat, lon in zip(latitudes, longitudes):
+    lat2 = math.radians(lat)
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + cos_lat1 * math.cos(lat2) * math.sin(math.radians(lon - longitude) / 2) ** 2)
+    distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+  return distances
@@ -0,0 +1,332 @@
+"""Bulk catalog import behind ``flask import``.
+
+Rows are streamed from CSV or JSONL, validated one by one with the same
+VenueForm/ArtistForm/ShowForm the create pages use (state and genre
+choices included) and written in batches, each in its own transaction:
+
+* Postgres: the batch is COPYed into a temporary staging table and merged
+  with one INSERT ... SELECT ... ON CONFLICT (id) DO UPDATE;
+* SQLite: one executemany INSERT ... ON CONFLICT (id) DO UPDATE;
+* anything else: DELETE of the batch's ids, then executemany INSERT.
+
+Every row must carry its ``id`` so re-running an import, or resuming one
+that stopped half-way, updates rows instead of duplicating them. Rows that
+fail validation, shows whose artist/venue does not exist and shows that
+would double-book a venue or artist (against the database or an earlier
+row of the same batch) go to the reject file with their errors and are
+skipped.
+"""
+
+import csv
+import io
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text
+from werkzeug.datastructures import MultiDict
+
+import geo
+from forms import ArtistForm, ShowForm, VenueForm
+from models import MAX_SHOW_MINUTES
+
+FORMS = {
+    'venues': VenueForm,
+    'artists': ArtistForm,
+    'shows': ShowForm,
+}
+
+# form field -> column, for fields stored under another name
+RENAMED = {'start_time': 'starting_time'}
+BOOLEAN_FIELDS = {'seeking_talent', 'seeking_venue'}
+# form fields that are not stored (the show form's name pickers)
+FORM_ONLY_FIELDS = {'artist_name', 'venue_name'}
+TRUE_VALUES = {'1', 'y', 'yes', 't', 'true', 'on'}
+
+BATCH_SIZE = 5000
+
+# kind -> its genre link table (key in ``tables``) and that table's entity column
+GENRE_LINKS = {
+    'venues': ('venue_genres', 'venue_id'),
+    'artists': ('artist_genres', 'artist_id'),
+}
+
+
+class ImportStats(object):
+  def __init__(self):
+    self.read = 0
+    self.imported = 0
+    self.rejected = 0
+    self.started = time.monotonic()
+
+  @property
+  def rate(self):
+    return self.read / max(time.monotonic() - self.started, 1e-9)
+
+  def __str__(self):
+    return (f'{self.read} rows read, {self.imported} imported, '
+            f'{self.rejected} rejected ({self.rate:.0f} rows/s)')
+
+
+def read_rows(path):
+  """Yield one dict per record of a .csv or .jsonl/.ndjson file."""
+  extension = os.path.splitext(path)[1].lower()
+  with open(path, newline='', encoding='utf-8') as f:
+    if extension == '.csv':
+      for row in csv.DictReader(f):
+        yield row
+    elif extension in ('.jsonl', '.ndjson'):
+      for line in f:
+        if line.strip():
+          yield json.loads(line)
+    else:
+      raise ValueError(f'unsupported import file {path!r}; use .csv or .jsonl')
+
+
+def validate(kind, row):
+  """Return ``(record, errors)`` for one input row."""
+  formdata = MultiDict()
+  for key, value in row.items():
+    # an empty CSV cell counts as missing, so form defaults apply
+    if value is None or value == '':
+      continue
+    if key == 'genres' and isinstance(value, str):
+      value = [genre.strip() for genre in value.split(',') if genre.strip()]
+    if isinstance(value, list):
+      formdata.setlist(key, [str(item) for item in value])
+    else:
+      formdata[key] = str(value)
+
+  errors = {}
+  try:
+    record_id = int(row.get('id'))
+  except (TypeError, ValueError):
+    errors['id'] = ['An integer id is required.']
+
+  form = FORMS[kind](formdata=formdata, meta={'csrf': False})
+  if not form.validate():
+    errors.update(form.errors)
+  if errors:
+    return None, errors
+
+  record = {'id': record_id}
+  for name, field in form._fields.items():
+    if name in FORM_ONLY_FIELDS:
+      continue
+    value = field.data
+    if name in BOOLEAN_FIELDS:
+      value = str(value or '').strip().lower() in TRUE_VALUES
+    elif name in ('artist_id', 'venue_id'):
+      try:
+        value = int(value)
+      except (TypeError, ValueError):
+        return None, {name: ['An integer id is required.']}
+    elif value == '':
+      value = None
+    record[RENAMED.get(name, name)] = value
+  if 'latitude' in record:
+    record['geohash'] = geo.geohash_of(record['latitude'], record['longitude'])
+  if 'duration' in record:
+    record['ending_time'] = record['starting_time'] + timedelta(minutes=record.pop('duration'))
+  return record, None
+
+
+def import_file(engine, tables, kind, path, batch_size=BATCH_SIZE, rejects=None,
+                progress=None, after_batch=None):
+  """Import ``path`` into ``tables[kind]`` and return :class:`ImportStats`.
+
+  ``tables`` maps 'venues'/'artists'/'shows', 'genres' and
+  'venue_genres'/'artist_genres' to their Table objects.
+  ``progress(stats)`` is called after every batch and ``after_batch(
+  connection, kind, records)`` inside each batch's transaction.
+  """
+  stats = ImportStats()
+  reject_file = open(rejects, 'w', encoding='utf-8') if rejects else None
+  try:
+    batch = []
+    for row in read_rows(path):
+      stats.read += 1
+      record, errors = validate(kind, row)
+      if errors:
+        _reject(stats, reject_file, row, errors)
+        continue
+      batch.append((row, record))
+      if len(batch) >= batch_size:
+        _write_batch(engine, tables, kind, batch, stats, reject_file, after_batch)
+        batch = []
+        if progress:
+          progress(stats)
+    if batch:
+      _write_batch(engine, tables, kind, batch, stats, reject_file, after_batch)
+      if progress:
+        progress(stats)
+    with engine.begin() as connection:
+      _advance_sequence(connection, tables[kind])
+  finally:
+    if reject_file:
+      reject_file.close()
+  return stats
+
+
+def _reject(stats, reject_file, row, errors):
+  stats.rejected += 1
+  if reject_file:
+    reject_file.write(json.dumps(dict(row, _errors=errors), default=str) + '\n')
+
+
+def _write_batch(engine, tables, kind, batch, stats, reject_file, after_batch):
+  with engine.begin() as connection:
+    if kind == 'shows':
+      batch = _drop_orphan_shows(connection, tables, batch, stats, reject_file)
+      batch = _drop_double_bookings(connection, tables['shows'], batch, stats, reject_file)
+    # last occurrence of an id within the batch wins, as it would across batches
+    records = list({record['id']: dict(record) for _, record in batch}.values())
+    if not records:
+      return
+    # genres go to the link tables, not the entity's own row
+    genres = {record['id']: record.pop('genres') for record in records if 'genres' in record}
+    table = tables[kind]
+    dialect = connection.dialect.name
+    if dialect == 'postgresql' and connection.dialect.driver == 'psycopg2':
+      _copy_upsert(connection, table, records)
+    elif dialect in ('postgresql', 'sqlite'):
+      _executemany_upsert(connection, table, records)
+    else:
+      connection.execute(table.delete().where(table.c.id.in_([r['id'] for r in records])))
+      connection.execute(table.insert(), _with_defaults(records))
+    if genres:
+      _replace_genres(connection, tables, kind, genres)
+    if after_batch:
+      after_batch(connection, kind, records)
+    stats.imported += len(batch)
+
+
+def _drop_orphan_shows(connection, tables, batch, stats, reject_file):
+  known = {}
+  for key, parent in (('artist_id', tables['artists']), ('venue_id', tables['venues'])):
+    wanted = {record[key] for _, record in batch}
+    known[key] = {row[0] for row in connection.execute(
+        select(parent.c.id).where(parent.c.id.in_(wanted)))}
+  kept = []
+  for row, record in batch:
+    missing = {key: ['No such id.'] for key in known if record[key] not in known[key]}
+    if missing:
+      _reject(stats, reject_file, row, missing)
+    else:
+      kept.append((row, record))
+  return kept
+
+
+def _drop_double_bookings(connection, shows, batch, stats, reject_file):
+  # Shows already booked for the batch's venues/artists around the batch's
+  # time span, minus those the batch itself replaces, are read in one query
+  # per column; each row is then checked against them and the rows kept
+  # before it.
+  if not batch:
+    return batch
+  ids = {record['id'] for _, record in batch}
+  first = min(record['starting_time'] for _, record in batch)
+  last = max(record['ending_time'] for _, record in batch)
+  booked = {}
+  for key in ('venue_id', 'artist_id'):
+    column = shows.c[key]
+    booked[key] = defaultdict(list)
+    for row in connection.execute(
+        select(column, shows.c.starting_time, shows.c.ending_time).where(
+            column.in_({record[key] for _, record in batch}),
+            shows.c.id.notin_(ids),
+            shows.c.starting_time < last,
+            shows.c.starting_time > first - timedelta(minutes=MAX_SHOW_MINUTES),
+            shows.c.ending_time > first)):
+      booked[key][row[0]].append((None, row[1], row[2]))
+  kept = []
+  for row, record in batch:
+    start, end = record['starting_time'], record['ending_time']
+    clashes = {key: ['Overlaps another booking.'] for key in booked
+               if any(other_start < end and other_end > start and other_end > other_start
+                      for other_id, other_start, other_end in booked[key][record[key]]
+                      if other_id != record['id'])}
+    if clashes:
+      _reject(stats, reject_file, row, clashes)
+      continue
+    for key in booked:
+      booked[key][record[key]].append((record['id'], start, end))
+    kept.append((row, record))
+  return kept
+
+
+def _replace_genres(connection, tables, kind, genres):
+  # the batch's genre lists replace the links its rows had; genres not seen
+  # before are added to the Genre table
+  genre = tables['genres']
+  link_name, key = GENRE_LINKS[kind]
+  link = tables[link_name]
+  names = {name for entity_names in genres.values() for name in entity_names}
+  ids = dict(connection.execute(
+      select(genre.c.name, genre.c.id).where(genre.c.name.in_(names))).all())
+  missing = sorted(names - ids.keys())
+  if missing:
+    connection.execute(genre.insert(), [{'name': name} for name in missing])
+    ids.update(connection.execute(
+        select(genre.c.name, genre.c.id).where(genre.c.name.in_(missing))).all())
+  connection.execute(link.delete().where(link.c[key].in_(list(genres))))
+  links = [{key: entity_id, 'genre_id': ids[name]}
+           for entity_id, entity_names in genres.items() for name in dict.fromkeys(entity_names)]
+  if links:
+    connection.execute(link.insert(), links)
+
+
+def _with_defaults(records):
+  now = datetime.utcnow()
+  for record in records:
+    record.setdefault('version', 1)
+    record.setdefault('updated_at', now)
+  return records
+
+
+def _executemany_upsert(connection, table, records):
+  if connection.dialect.name == 'postgresql':
+    from sqlalchemy.dialects.postgresql import insert
+  else:
+    from sqlalchemy.dialects.sqlite import insert
+  records = _with_defaults(records)
+  statement = insert(table)
+  updates = {name: statement.excluded[name] for name in records[0]
+             if name not in ('id', 'version')}
+  updates['version'] = table.c.version + 1
+  connection.execute(statement.on_conflict_do_update(
+      index_elements=[table.c.id], set_=updates), records)
+
+
+def _copy_upsert(connection, table, records):
+  records = _with_defaults(records)
+  columns = list(records[0].keys())
+  quoted = ', '.join(f'"{name}"' for name in columns)
+  staging = f'import_{table.name.lower()}'
+  connection.execute(text(
+      f'CREATE TEMPORARY TABLE IF NOT EXISTS {staging} '
+      f'(LIKE "{table.name}" INCLUDING DEFAULTS) ON COMMIT DROP'))
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  for record in records:
+    writer.writerow(['\\N' if record[name] is None else record[name] for name in columns])
+  buffer.seek(0)
+  cursor = connection.connection.cursor()
+  cursor.copy_expert(
+      f"COPY {staging} ({quoted}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+  updates = ', '.join(f'"{name}" = EXCLUDED."{name}"' for name in columns
+                      if name not in ('id', 'version', 'updated_at'))
+  connection.execute(text(
+      f'INSERT INTO "{table.name}" ({quoted}) SELECT {quoted} FROM {staging} '
+      f'ON CONFLICT (id) DO UPDATE SET {updates}, '
+      f'version = "{table.name}".version + 1, updated_at = EXCLUDED.updated_at'))
+
+
+def _advance_sequence(connection, table):
+  # explicit ids bypass the Postgres serial sequence; move it past them
+  if connection.dialect.name == 'postgresql':
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 1))"))
@@ -0,0 +1,276 @@
+"""Per-request performance instrumentation.
+
+For every request this records the number of SQL statements, the time
+spent in the database, the time spent rendering templates and the total
+latency, and
+
+* reports them to the client in a ``Server-Timing`` header (``db``,
+  ``tpl`` and ``app``, the time spent elsewhere in the view);
+* adds them to per-route histograms served in the Prometheus text format
+  at ``/metrics``;
+* logs a warning when one statement shape (the SQL with literals and
+  parameter lists folded) runs more than ``N_PLUS_ONE_THRESHOLD`` times in
+  one request, the signature of a query issued once per row of another.
+
+Statements are timed through engine events, so every bind (primary and
+replicas) is covered. A streamed response is recorded once its body has
+been sent, but its ``Server-Timing`` header goes out before the body's
+queries run: it carries only ``app``, the time to the first byte, and no
+``db`` or ``tpl`` figures that would leave that work out.
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache
+
+from flask import (Response, before_render_template, current_app, g, has_request_context,
+                   request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMS = re.compile(r'%\(\w+\)s|%s|\$\d+|(?<!:):\w+|\?')
+_PARAM_LISTS = re.compile(r'\(\?(?:\s*,\s*\?)+\)')
+_SPACE = re.compile(r'\s+')
+
+_START = 'instrumentation.started'
+
+
+@lru_cache(maxsize=1024)
+def statement_shape(statement):
+  """``statement`` with literals, parameters and IN lists folded to ``?``."""
+  shape = _STRINGS.sub('?', statement)
+  shape = _NUMBERS.sub('?', shape)
+  shape = _PARAMS.sub('?', shape)
+  shape = _PARAM_LISTS.sub('(?)', shape)
+  return _SPACE.sub(' ', shape).strip()
+
+
+class RequestStats(object):
+
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.statements = 0
+    self.db_time = 0.0
+    self.template_time = 0.0
+    self.shapes = Counter()
+    self.reported = set()
+    self._template_started = []
+
+
+class Histogram(object):
+
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.sum = 0
+    self.count = 0
+
+  def observe(self, value):
+    index = bisect_left(self.buckets, value)
+    if index < len(self.counts):
+      self.counts[index] += 1
+    self.sum += value
+    self.count += 1
+
+
+class Metrics(object):
+  """Histograms and counters keyed by metric name and label values."""
+
+  def __init__(self):
+    self._histograms = {}
+    self._counters = Counter()
+    self._help = {}
+    self._lock = threading.Lock()
+
+  def describe(self, name, kind, text):
+    self._help[name] = (kind, text)
+
+  def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      histogram = self._histograms.get(key)
+      if histogram is None:
+        histogram = self._histograms[key] = Histogram(buckets)
+      histogram.observe(value)
+
+  def increment(self, name, labels, amount=1):
+    with self._lock:
+      self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+  def render(self):
+    """The Prometheus text exposition of every metric."""
+    with self._lock:
+      histograms = [(key, h.buckets, list(h.counts), h.sum, h.count)
+                    for key, h in self._histograms.items()]
+      counters = list(self._counters.items())
+    lines = []
+    described = set()
+
+    def header(name):
+      if name not in described and name in self._help:
+        kind, text = self._help[name]
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+      described.add(name)
+
+    for (name, labels), buckets, counts, total, count in sorted(histograms):
+      header(name)
+      cumulative = 0
+      for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}')
+      lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {count}')
+      lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+      lines.append(f'{name}_count{_labels(labels)} {count}')
+    for (name, labels), value in sorted(counters):
+      header(name)
+      lines.append(f'{name}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels, **extra):
+  pairs = list(labels) + list(extra.items())
+  if not pairs:
+    return ''
+  escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+             for _, value in pairs)
+  return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Instrumentation(object):
+
+  def __init__(self, app=None):
+    self.metrics = Metrics()
+    self.metrics.describe('fyyur_request_duration_seconds', 'histogram',
+                          'Request latency, until the response body is sent.')
+    self.metrics.describe('fyyur_db_duration_seconds', 'histogram',
+                          'Time spent executing SQL statements per request.')
+    self.metrics.describe('fyyur_template_duration_seconds', 'histogram',
+                          'Time spent rendering templates per request.')
+    self.metrics.describe('fyyur_db_statements', 'histogram',
+                          'SQL statements executed per request.')
+    self.metrics.describe('fyyur_requests_total', 'counter', 'Requests served.')
+    self.metrics.describe('fyyur_n_plus_one_total', 'counter',
+                          'Statement shapes repeated past N_PLUS_ONE_THRESHOLD in a request.')
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('SERVER_TIMING', True)
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+    app.before_request(self._start)
+    app.after_request(self._finish)
+    if app.config['METRICS_ENABLED']:
+      app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+    before_render_template.connect(self._before_render, app)
+    template_rendered.connect(self._after_render, app)
+    if not event.contains(Engine, 'before_cursor_execute', _before_execute):
+      event.listen(Engine, 'before_cursor_execute', _before_execute)
+      event.listen(Engine, 'after_cursor_execute', _after_execute)
+      event.listen(Engine, 'handle_error', _execute_failed)
+
+  def metrics_view(self):
+    return Response(self.metrics.render(), mimetype='text/plain; version=0.0.4')
+
+  def _start(self):
+    g.request_stats = RequestStats()
+
+  def _finish(self, response):
+    stats = g.get('request_stats')
+    if stats is None:
+      return response
+    config = current_app.config
+    route = request.endpoint or 'unmatched'
+    method = request.method
+    threshold = config['N_PLUS_ONE_THRESHOLD']
+    if config['SERVER_TIMING']:
+      elapsed = time.perf_counter() - stats.started
+      if response.is_streamed:
+        response.headers.add(
+            'Server-Timing', f'app;dur={elapsed * 1000:.1f};desc="before streaming"')
+      else:
+        other = max(elapsed - stats.db_time - stats.template_time, 0)
+        response.headers.add('Server-Timing', ', '.join((
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.statements} statements"',
+            f'tpl;dur={stats.template_time * 1000:.1f}',
+            f'app;dur={other * 1000:.1f}')))
+
+    def record():
+      # after the body went out, so streamed pages are measured in full
+      labels = {'route': route, 'method': method}
+      self.metrics.observe('fyyur_request_duration_seconds', labels,
+                           time.perf_counter() - stats.started)
+      self.metrics.observe('fyyur_db_duration_seconds', labels, stats.db_time)
+      self.metrics.observe('fyyur_template_duration_seconds', labels, stats.template_time)
+      self.metrics.observe('fyyur_db_statements', labels, stats.statements, STATEMENT_BUCKETS)
+      self.metrics.increment('fyyur_requests_total',
+                             dict(labels, status=str(response.status_code)))
+      repeated = [shape for shape, count in stats.shapes.items() if count > threshold]
+      if repeated:
+        self.metrics.increment('fyyur_n_plus_one_total', {'route': route}, len(repeated))
+
+    response.call_on_close(record)
+    return response
+
+  def _before_render(self, app, template, context, **extra):
+    stats = g.get('request_stats')
+    if stats is not None:
+      stats._template_started.append(time.perf_counter())
+
+  def _after_render(self, app, template, context, **extra):
+    stats = g.get('request_stats')
+    if stats is not None and stats._template_started:
+      started = stats._template_started.pop()
+      if not stats._template_started:
+        stats.template_time += time.perf_counter() - started
+
+
+def _current_stats():
+  if not has_request_context():
+    return None
+  return g.get('request_stats')
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+  if _current_stats() is not None:
+    conn.info.setdefault(_START, []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+  stats = _current_stats()
+  if stats is None or not conn.info.get(_START):
+    return
+  stats.db_time += time.perf_counter() - conn.info[_START].pop()
+  stats.statements += 1
+  shape = statement_shape(statement)
+  stats.shapes[shape] += 1
+  threshold = current_app.config['N_PLUS_ONE_THRESHOLD']
+  if stats.shapes[shape] > threshold and shape not in stats.reported:
+    stats.reported.add(shape)
+    current_app.logger.warning(
+        'N+1 query in %s: statement ran more than %d times in one request: %s',
+        request.endpoint or request.path, threshold, shape)
+
+
+def _execute_failed(exception_context):
+  # a statement that raised never reaches after_cursor_execute: take its
+  # start time off the (pooled) connection, or they pile up there
+  conn = exception_context.connection
+  if conn is None or exception_context.statement is None or _current_stats() is None:
+    return
+  started = conn.info.get(_START)
+  if started:
+    started.pop()
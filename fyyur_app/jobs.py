@@ -0,0 +1,238 @@
+"""Durable background jobs.
+
+Work that may run after a request (stats recounts, purges, notifications)
+is queued as a row of the Jobs table through ``JobQueue.enqueue``, on the
+connection of the transaction asking for it: the job exists exactly when
+that transaction commits, and the request returns without doing the work.
+
+``flask worker`` claims due jobs and runs them on a thread pool. A job's
+task runs in a transaction that also deletes the job row, so its database
+effects and its completion commit together. A task that raises is retried
+``JOBS_MAX_ATTEMPTS`` times in all, with exponential backoff from
+``JOBS_RETRY_DELAY`` seconds (plus jitter, capped at
+``JOBS_RETRY_MAX_DELAY``), then left in the table as 'failed'. A job held
+by a worker that died is claimed again after ``JOBS_LOCK_TIMEOUT`` seconds,
+so tasks must be safe to run twice.
+
+Claiming is one ``UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP
+LOCKED)`` on Postgres, so concurrent workers never wait on each other's
+rows. SQLite has no row locks; the same statement takes its database-wide
+write lock, which serializes claims instead.
+
+With ``JOBS_EAGER`` the task runs inside ``enqueue``, in the caller's
+transaction (tests, or deployments without a worker). Either way a task
+can ask for a callback once its effects have committed (``after_commit``).
+``JOBS_EMBEDDED_WORKER`` runs a worker thread inside each web process.
+"""
+
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, event, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+_AFTER_COMMIT = 'jobs.after_commit'
+
+
+class JobQueue(object):
+
+  def __init__(self, db, model, app=None):
+    self.db = db
+    self.model = model
+    self.tasks = {}
+    self._workers = {}
+    self._lock = threading.Lock()
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('JOBS_EAGER', False)
+    app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+    app.config.setdefault('JOBS_RETRY_DELAY', 5)
+    app.config.setdefault('JOBS_RETRY_MAX_DELAY', 3600)
+    app.config.setdefault('JOBS_LOCK_TIMEOUT', 600)
+    app.config.setdefault('JOBS_WORKER_THREADS', 4)
+    app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+    app.config.setdefault('JOBS_EMBEDDED_WORKER', False)
+    app.extensions['jobs'] = self
+    if app.config['JOBS_EMBEDDED_WORKER'] and not app.config['JOBS_EAGER']:
+      # started on the first request, so a pre-fork server starts one per child
+      app.before_request(lambda: self._ensure_embedded_worker(app))
+    if not event.contains(Session, 'after_commit', self._run_callbacks):
+      event.listen(Session, 'after_commit', self._run_callbacks)
+      event.listen(Session, 'after_soft_rollback', self._drop_callbacks)
+
+  def task(self, name):
+    """Register the decorated ``function(connection, **payload)`` as ``name``."""
+    def decorator(function):
+      self.tasks[name] = function
+      return function
+    return decorator
+
+  def enqueue(self, connection, task, delay=0, max_attempts=None, **payload):
+    """Queue ``task`` with ``payload`` (JSON-serializable keyword arguments)
+    on ``connection``, in its current transaction."""
+    if task not in self.tasks:
+      raise KeyError(f'unknown task {task!r}')
+    config = current_app.config
+    if config['JOBS_EAGER']:
+      self.tasks[task](connection, **payload)
+      # the caller's transaction is db.session's; its commit runs them
+      self.db.session.info.setdefault(_AFTER_COMMIT, []).extend(
+          connection.info.pop(_AFTER_COMMIT, ()))
+      return
+    connection.execute(self.model.__table__.insert().values(
+        task=task, payload=payload, status='queued', attempts=0,
+        max_attempts=max_attempts or config['JOBS_MAX_ATTEMPTS'],
+        run_at=datetime.utcnow() + timedelta(seconds=delay), created_at=datetime.utcnow()))
+
+  def claim(self, limit, worker_id):
+    """Mark up to ``limit`` due jobs as running for ``worker_id`` and
+    return them (id, task, payload, attempts, max_attempts)."""
+    jobs = self.model.__table__
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config['JOBS_LOCK_TIMEOUT'])
+    due = select(jobs.c.id).where(or_(
+        and_(jobs.c.status == 'queued', jobs.c.run_at <= now),
+        and_(jobs.c.status == 'running', jobs.c.locked_at < stale),
+    )).order_by(jobs.c.run_at, jobs.c.id).limit(limit).with_for_update(skip_locked=True)
+    with self.db.engine.begin() as connection:
+      return connection.execute(
+          jobs.update().where(jobs.c.id.in_(due))
+          .values(status='running', locked_by=worker_id, locked_at=now,
+                  attempts=jobs.c.attempts + 1)
+          .returning(jobs.c.id, jobs.c.task, jobs.c.payload, jobs.c.attempts,
+                     jobs.c.max_attempts)).all()
+
+  def run(self, job, worker_id):
+    """Run one claimed job; its task and the job's deletion commit together."""
+    jobs = self.model.__table__
+    mine = and_(jobs.c.id == job.id, jobs.c.locked_by == worker_id)
+    try:
+      task = self.tasks[job.task]
+      with self.db.engine.begin() as connection:
+        try:
+          task(connection, **job.payload)
+          connection.execute(jobs.delete().where(mine))
+        finally:
+          # the DBAPI connection, and its info, goes back to the pool
+          callbacks = connection.info.pop(_AFTER_COMMIT, ())
+      for callback in callbacks:
+        callback()
+      return True
+    except Exception:
+      error = traceback.format_exc()
+      logger.warning('job %s (%s) failed, attempt %d of %d:\n%s',
+                     job.id, job.task, job.attempts, job.max_attempts, error)
+    if job.attempts >= job.max_attempts:
+      values = dict(status='failed', locked_by=None, locked_at=None)
+    else:
+      values = dict(status='queued', locked_by=None, locked_at=None,
+                    run_at=datetime.utcnow() + timedelta(seconds=self.backoff(job.attempts)))
+    with self.db.engine.begin() as connection:
+      connection.execute(jobs.update().where(mine).values(last_error=error[-4000:], **values))
+    return False
+
+  def after_commit(self, connection, callback):
+    """Call ``callback()`` once the transaction a task is given
+    ``connection`` for has committed; not at all if it rolls back."""
+    connection.info.setdefault(_AFTER_COMMIT, []).append(callback)
+
+  def _run_callbacks(self, session):
+    for callback in session.info.pop(_AFTER_COMMIT, ()):
+      callback()
+
+  def _drop_callbacks(self, session, previous_transaction):
+    session.info.pop(_AFTER_COMMIT, None)
+
+  def backoff(self, attempts):
+    """Seconds before retrying a job that failed its ``attempts``-th run."""
+    config = current_app.config
+    delay = min(config['JOBS_RETRY_DELAY'] * 2 ** (attempts - 1), config['JOBS_RETRY_MAX_DELAY'])
+    return delay * random.uniform(1, 1.25)
+
+  def _ensure_embedded_worker(self, app):
+    with self._lock:
+      worker = self._workers.get(app)
+      if worker is not None and worker.pid == os.getpid():
+        return
+      worker = self._workers[app] = Worker(app, self, app.config['JOBS_WORKER_THREADS'],
+                                           app.config['JOBS_POLL_INTERVAL'])
+    threading.Thread(target=worker.run, name='jobs-worker', daemon=True).start()
+
+
+class Worker(object):
+  """Polls a ``JobQueue`` and runs due jobs on ``threads`` threads."""
+
+  def __init__(self, app, queue, threads, poll_interval):
+    self.app = app
+    self.queue = queue
+    self.threads = threads
+    self.poll_interval = poll_interval
+    self.pid = os.getpid()
+    self.id = f'{socket.gethostname()}:{self.pid}:{id(self):x}'
+    self.succeeded = 0
+    self.failed = 0
+    self._stopping = threading.Event()
+    self._running = 0
+    self._idle = threading.Condition()
+
+  def run(self, once=False):
+    """Claim and run jobs until ``stop``; with ``once``, until none is due."""
+    with ThreadPoolExecutor(self.threads, thread_name_prefix='jobs') as pool:
+      while not self._stopping.is_set():
+        with self._idle:
+          while self._running >= self.threads and not self._stopping.is_set():
+            self._idle.wait()
+          free = self.threads - self._running
+        try:
+          with self.app.app_context():
+            claimed = self.queue.claim(free, self.id)
+        except SQLAlchemyError as e:
+          logger.warning('claiming jobs failed: %s', e)
+          if once:
+            raise
+          self._stopping.wait(self.poll_interval)
+          continue
+        for job in claimed:
+          with self._idle:
+            self._running += 1
+          pool.submit(self._run, job).add_done_callback(self._finished)
+        if claimed:
+          continue
+        if once:
+          # claim again once a running job is done; stop when none runs
+          with self._idle:
+            if not self._running:
+              break
+            self._idle.wait()
+        else:
+          self._stopping.wait(self.poll_interval)
+
+  def stop(self):
+    self._stopping.set()
+    with self._idle:
+      self._idle.notify_all()
+
+  def _run(self, job):
+    with self.app.app_context():
+      return self.queue.run(job, self.id)
+
+  def _finished(self, future):
+    with self._idle:
+      self._running -= 1
+      if future.exception() is None and future.result():
+        self.succeeded += 1
+      else:
+        self.failed += 1
+      self._idle.notify_all()
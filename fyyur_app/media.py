@@ -0,0 +1,218 @@
+"""Uploaded venue and artist images.
+
+An upload is stored once under ``MEDIA_ROOT`` as ``<hash>.<ext>``, named
+after the SHA-256 of its bytes: the same picture uploaded twice is one
+file, and a name never changes content, so every file is served with
+far-future ``immutable`` cache headers. The type comes from the file's
+leading bytes, not from the client's name or Content-Type.
+
+Each variant in ``VARIANTS`` is a copy fitted within a box, written as
+``<hash>-<variant>.<ext>`` in the original's format and as
+``<hash>-<variant>.webp``. Resizing is CPU-bound, so ``render_derivatives``
+runs in a process pool (``derivative_pool``), off the threads of whatever
+queued it. Until a derivative exists its URL redirects to the original.
+
+Pillow is needed to render derivatives; without it uploads are still
+stored and the originals served everywhere.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from markupsafe import Markup
+
+try:
+  from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional, derivatives are skipped
+  Image = ImageOps = None
+
+URL_PREFIX = '/media/'
+CHUNK_SIZE = 64 * 1024
+# variant name -> (width, height) box the picture is fitted within; sized
+# for the 200px-high show tiles and the detail pages, at twice the CSS pixels
+VARIANTS = {
+    'thumb': (400, 400),
+    'large': (1200, 1000),
+}
+FORMATS = {
+    'jpg': (b'\xff\xd8\xff', 'JPEG'),
+    'png': (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    'gif': (b'GIF8', 'GIF'),
+    'webp': (b'RIFF', 'WEBP'),
+}
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'GIF': {},
+    'WEBP': {'quality': 80, 'method': 4},
+}
+
+_NAME = re.compile(r'^([0-9a-f]{32})(?:-([a-z]+))?\.([a-z]+)$')
+
+
+class UploadError(ValueError):
+  """An upload that is not a supported image, or is too large."""
+
+
+def sniff(head):
+  """The extension of the image type ``head`` (its first bytes) starts, or None."""
+  for ext, (magic, _) in FORMATS.items():
+    if head.startswith(magic) and (ext != 'webp' or head[8:12] == b'WEBP'):
+      return ext
+  return None
+
+
+def store(stream, root, max_bytes):
+  """Write the image read from ``stream`` to ``root`` under its content
+  hash; returns ``(name, created)``, ``created`` False when the same
+  picture was already stored. Raises ``UploadError``."""
+  os.makedirs(root, exist_ok=True)
+  digest = hashlib.sha256()
+  size = 0
+  head = b''
+  fd, temp = tempfile.mkstemp(dir=root, prefix='.upload-')
+  try:
+    with os.fdopen(fd, 'wb') as out:
+      for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        size += len(chunk)
+        if size > max_bytes:
+          raise UploadError(f'images are limited to {max_bytes // 1024} KiB')
+        if len(head) < 16:
+          head += chunk[:16]
+        digest.update(chunk)
+        out.write(chunk)
+    ext = sniff(head)
+    if ext is None:
+      raise UploadError('not a JPEG, PNG, GIF or WebP image')
+    name = f'{digest.hexdigest()[:32]}.{ext}'
+    # an identical upload leaves the existing file (and its derivatives) alone
+    if os.path.exists(os.path.join(root, name)):
+      os.unlink(temp)
+      return name, False
+    os.replace(temp, os.path.join(root, name))
+    return name, True
+  except BaseException:
+    if os.path.exists(temp):
+      os.unlink(temp)
+    raise
+
+
+def discard(root, name):
+  """Remove original ``name`` again, e.g. when the row it was uploaded for
+  is gone; derivatives are only rendered once a row points at it."""
+  try:
+    os.unlink(os.path.join(root, name))
+  except FileNotFoundError:
+    pass
+
+
+def parse(name):
+  """(hash, variant or None, ext) of a media file name, or None."""
+  match = _NAME.match(name)
+  return match.groups() if match else None
+
+
+def derivative_name(name, variant, ext=None):
+  digest, _, original_ext = parse(name)
+  return f'{digest}-{variant}.{ext or original_ext}'
+
+
+def original_name(root, name):
+  """The stored original a (possibly missing) derivative ``name`` comes
+  from, or None."""
+  parts = parse(name)
+  if parts is None:
+    return None
+  for ext in FORMATS:
+    candidate = f'{parts[0]}.{ext}'
+    if os.path.exists(os.path.join(root, candidate)):
+      return candidate
+  return None
+
+
+def render_derivatives(root, name):
+  """Write the missing variants of original ``name``; returns the names
+  written. Runs in a pool process."""
+  if Image is None:
+    return []
+  written = []
+  with Image.open(os.path.join(root, name)) as original:
+    fmt = FORMATS[parse(name)[2]][1]
+    picture = ImageOps.exif_transpose(original)
+    for variant, box in VARIANTS.items():
+      targets = [(derivative_name(name, variant), fmt)]
+      if fmt != 'WEBP':
+        targets.append((derivative_name(name, variant, 'webp'), 'WEBP'))
+      targets = [(target, target_fmt) for target, target_fmt in targets
+                 if not os.path.exists(os.path.join(root, target))]
+      if not targets:
+        continue
+      resized = picture.copy()
+      resized.thumbnail(box, Image.LANCZOS)
+      for target, target_fmt in targets:
+        image = resized
+        if target_fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+          image = image.convert('RGB')
+        elif target_fmt == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+          image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+        _save(image, os.path.join(root, target), target_fmt)
+        written.append(target)
+  return written
+
+
+def _save(image, path, fmt):
+  # write next to the target and rename, so a half-written file is never served
+  fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.render-')
+  try:
+    with os.fdopen(fd, 'wb') as out:
+      image.save(out, fmt, **SAVE_OPTIONS[fmt])
+    os.replace(temp, path)
+  except BaseException:
+    os.unlink(temp)
+    raise
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def derivative_pool(processes=None):
+  """The process pool derivatives are rendered in, started on first use
+  (once per process, so a forked server does not share its parent's)."""
+  global _pool, _pool_pid
+  with _pool_lock:
+    if _pool is None or _pool_pid != os.getpid():
+      _pool = ProcessPoolExecutor(processes or None)
+      _pool_pid = os.getpid()
+    return _pool
+
+
+def url(name):
+  return URL_PREFIX + name
+
+
+def variant_url(link, variant, ext=None):
+  """The URL of ``variant`` of image ``link``; links that are not uploads
+  (or are not set) come back unchanged."""
+  if not link or not link.startswith(URL_PREFIX):
+    return link
+  name = link[len(URL_PREFIX):]
+  if parse(name) is None:
+    return link
+  return url(derivative_name(name, variant, ext))
+
+
+def picture(link, variant, alt=''):
+  """``<img>`` markup for ``variant`` of image ``link``, with a WebP source
+  in front of it for uploaded images."""
+  src = variant_url(link, variant)
+  img = Markup('<img src="{}" alt="{}" />').format(src or '', alt)
+  if src == link:
+    return img
+  return Markup('<picture><source srcset="{}" type="image/webp">{}</picture>').format(
+      variant_url(link, variant, 'webp'), img)
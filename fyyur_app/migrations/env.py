@@ -27,6 +27,15 @@ config.set_main_option(
     str(current_app.extensions['migrate'].db.engine.url).replace('%', '%%'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
+# Search structures created with raw SQL in 5b2e8c41d7a3 (FTS5 tables and
+# their shadow tables on SQLite, trigram GIN indexes on Postgres) have no
+# model counterpart; keep autogenerate from proposing to drop them.
+def include_object(object, name, type_, reflected, compare_to):
+    if reflected and compare_to is None and name and (
+            '_name_fts' in name or name.endswith('_name_trgm')):
+        return False
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -47,7 +56,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -83,6 +93,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
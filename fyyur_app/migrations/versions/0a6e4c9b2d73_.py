@@ -0,0 +1,52 @@
+"""add soft-delete stamps to venues and artists
+
+Revision ID: 0a6e4c9b2d73
+Revises: f3a9d2e6b180
+Create Date: 2026-10-18 23:41:12.207615
+
+"""
+from contextlib import nullcontext
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6e4c9b2d73'
+down_revision = 'f3a9d2e6b180'
+branch_labels = None
+depends_on = None
+
+
+# the listing orders over the rows not soft-deleted; partial, so deleted
+# rows cost the reads nothing
+TABLES = ['Venue', 'Artist']
+LIVE = sa.text('deleted_at IS NULL')
+INDEXES = [
+    ('ix_Venue_live_city_state_id', 'Venue', ['city', 'state', 'id']),
+    ('ix_Artist_live_name_id', 'Artist', ['name', 'id']),
+]
+
+
+def _index_block():
+    if op.get_bind().dialect.name == 'postgresql':
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    with _index_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True,
+                            postgresql_where=LIVE, sqlite_where=LIVE)
+
+
+def downgrade():
+    with _index_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('deleted_at')
@@ -0,0 +1,39 @@
+"""add the background job queue
+
+Revision ID: 1b7f3e8a5c26
+Revises: 0a6e4c9b2d73
+Create Date: 2026-10-19 00:18:47.630214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b7f3e8a5c26'
+down_revision = '0a6e4c9b2d73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('task', sa.String(length=120), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_by', sa.String(length=120), nullable=True),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Jobs_status_run_at', 'Jobs', ['status', 'run_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Jobs_status_run_at', table_name='Jobs')
+    op.drop_table('Jobs')
@@ -0,0 +1,46 @@
+"""add venue coordinates and their geohash
+
+Revision ID: 2c8e5f1a9d47
+Revises: 1b7f3e8a5c26
+Create Date: 2026-10-19 01:52:09.318406
+
+"""
+from contextlib import nullcontext
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c8e5f1a9d47'
+down_revision = '1b7f3e8a5c26'
+branch_labels = None
+depends_on = None
+
+
+LIVE = sa.text('deleted_at IS NULL')
+
+
+def _index_block():
+    if op.get_bind().dialect.name == 'postgresql':
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade():
+    # no venue has coordinates yet, so there is nothing to backfill
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    with _index_block():
+        op.create_index('ix_Venue_live_geohash', 'Venue', ['geohash'], unique=False,
+                        postgresql_concurrently=True, postgresql_where=LIVE, sqlite_where=LIVE)
+
+
+def downgrade():
+    with _index_block():
+        op.drop_index('ix_Venue_live_geohash', table_name='Venue', postgresql_concurrently=True)
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
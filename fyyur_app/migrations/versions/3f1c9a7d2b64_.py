@@ -0,0 +1,49 @@
+"""add indexes for show, venue and artist lookups
+
+Revision ID: 3f1c9a7d2b64
+Revises: 9a9427b7e2d9
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from contextlib import nullcontext
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b64'
+down_revision = '9a9427b7e2d9'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    ('ix_Shows_venue_id_starting_time', 'Shows', ['venue_id', 'starting_time']),
+    ('ix_Shows_artist_id_starting_time', 'Shows', ['artist_id', 'starting_time']),
+    ('ix_Venue_city_state', 'Venue', ['city', 'state']),
+    ('ix_Venue_name', 'Venue', ['name']),
+    ('ix_Artist_name', 'Artist', ['name']),
+]
+
+
+def _index_block():
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction, so on
+    # Postgres the statements are issued from an autocommit block.
+    if op.get_bind().dialect.name == 'postgresql':
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade():
+    with _index_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False,
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with _index_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table,
+                          postgresql_concurrently=True)
@@ -0,0 +1,62 @@
+"""add trigram name search indexes
+
+Revision ID: 5b2e8c41d7a3
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-18 11:03:57.902144
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8c41d7a3'
+down_revision = '3f1c9a7d2b64'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ['Venue', 'Artist']
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        with op.get_context().autocommit_block():
+            for name in TABLES:
+                op.create_index(f'ix_{name}_name_trgm', name, ['name'],
+                                postgresql_using='gin',
+                                postgresql_ops={'name': 'gin_trgm_ops'},
+                                postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        for name in TABLES:
+            fts = f'{name}_name_fts'
+            op.execute(f"""CREATE VIRTUAL TABLE "{fts}" USING fts5(
+                name, content='{name}', content_rowid='id', tokenize='trigram')""")
+            op.execute(f"""INSERT INTO "{fts}"("{fts}") VALUES ('rebuild')""")
+            op.execute(f"""CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{name}" BEGIN
+                INSERT INTO "{fts}"(rowid, name) VALUES (new.id, new.name);
+            END""")
+            op.execute(f"""CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{name}" BEGIN
+                INSERT INTO "{fts}"("{fts}", rowid, name) VALUES ('delete', old.id, old.name);
+            END""")
+            op.execute(f"""CREATE TRIGGER "{fts}_au" AFTER UPDATE OF name ON "{name}" BEGIN
+                INSERT INTO "{fts}"("{fts}", rowid, name) VALUES ('delete', old.id, old.name);
+                INSERT INTO "{fts}"(rowid, name) VALUES (new.id, new.name);
+            END""")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name in reversed(TABLES):
+                op.drop_index(f'ix_{name}_name_trgm', table_name=name,
+                              postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        for name in reversed(TABLES):
+            fts = f'{name}_name_fts'
+            for suffix in ('au', 'ad', 'ai'):
+                op.execute(f'DROP TRIGGER IF EXISTS "{fts}_{suffix}"')
+            op.execute(f'DROP TABLE IF EXISTS "{fts}"')
@@ -0,0 +1,36 @@
+"""add keyset index for the shows listing
+
+Revision ID: 7c4d1e9f0a25
+Revises: 5b2e8c41d7a3
+Create Date: 2026-10-18 12:20:08.441870
+
+"""
+from contextlib import nullcontext
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4d1e9f0a25'
+down_revision = '5b2e8c41d7a3'
+branch_labels = None
+depends_on = None
+
+
+def _index_block():
+    if op.get_bind().dialect.name == 'postgresql':
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade():
+    with _index_block():
+        op.create_index('ix_Shows_starting_time_id', 'Shows', ['starting_time', 'id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with _index_block():
+        op.drop_index('ix_Shows_starting_time_id', table_name='Shows',
+                      postgresql_concurrently=True)
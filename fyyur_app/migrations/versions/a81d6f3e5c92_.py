@@ -0,0 +1,53 @@
+"""add version and updated_at to venues, artists and shows
+
+Revision ID: a81d6f3e5c92
+Revises: 7c4d1e9f0a25
+Create Date: 2026-10-18 13:41:26.015733
+
+"""
+from contextlib import nullcontext
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a81d6f3e5c92'
+down_revision = '7c4d1e9f0a25'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ['Venue', 'Artist', 'Shows']
+
+
+def _index_block():
+    if op.get_bind().dialect.name == 'postgresql':
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade():
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    # SQLite cannot ADD COLUMN with a non-constant default, so existing rows
+    # get a placeholder there and are stamped right after.
+    now = sa.text("'1970-01-01 00:00:00'") if sqlite else sa.func.now()
+    for name in TABLES:
+        op.add_column(name, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        op.add_column(name, sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=now))
+        if sqlite:
+            op.execute(f'UPDATE "{name}" SET updated_at = CURRENT_TIMESTAMP')
+    with _index_block():
+        for name in TABLES:
+            op.create_index(op.f(f'ix_{name}_updated_at'), name, ['updated_at'],
+                            unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with _index_block():
+        for name in reversed(TABLES):
+            op.drop_index(op.f(f'ix_{name}_updated_at'), table_name=name,
+                          postgresql_concurrently=True)
+    for name in reversed(TABLES):
+        op.drop_column(name, 'updated_at')
+        op.drop_column(name, 'version')
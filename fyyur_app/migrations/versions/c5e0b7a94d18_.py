@@ -0,0 +1,58 @@
+"""add show statistics rollup tables
+
+Revision ID: c5e0b7a94d18
+Revises: a81d6f3e5c92
+Create Date: 2026-10-18 14:55:02.771390
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e0b7a94d18'
+down_revision = 'a81d6f3e5c92'
+branch_labels = None
+depends_on = None
+
+
+ROLLUPS = [
+    ('VenueShowStats', 'venue_id', 'Venue'),
+    ('ArtistShowStats', 'artist_id', 'Artist'),
+]
+
+
+def upgrade():
+    for name, key, parent in ROLLUPS:
+        op.create_table(name,
+        sa.Column(key, sa.Integer(), nullable=False),
+        sa.Column('upcoming_shows_count', sa.Integer(), nullable=False),
+        sa.Column('past_shows_count', sa.Integer(), nullable=False),
+        sa.Column('next_show_at', sa.DateTime(), nullable=True),
+        sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint([key], [f'{parent}.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(key)
+        )
+        op.create_index(op.f(f'ix_{name}_next_show_at'), name, ['next_show_at'], unique=False)
+
+    # backfill from the existing shows
+    now = datetime.now()
+    for name, key, parent in ROLLUPS:
+        op.get_bind().execute(sa.text(f'''
+            INSERT INTO "{name}" ({key}, upcoming_shows_count, past_shows_count,
+                                  next_show_at, refreshed_at)
+            SELECT {key},
+                   SUM(CASE WHEN starting_time > :now THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN starting_time > :now THEN 0 ELSE 1 END),
+                   MIN(CASE WHEN starting_time > :now THEN starting_time END),
+                   :now
+            FROM "Shows" GROUP BY {key}''').bindparams(
+                sa.bindparam('now', now, type_=sa.DateTime())))
+
+
+def downgrade():
+    for name, key, parent in reversed(ROLLUPS):
+        op.drop_index(op.f(f'ix_{name}_next_show_at'), table_name=name)
+        op.drop_table(name)
@@ -0,0 +1,70 @@
+"""add show ending times and reject overlapping bookings
+
+Revision ID: d2f7a8c3e619
+Revises: c5e0b7a94d18
+Create Date: 2026-10-18 21:02:37.480112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f7a8c3e619'
+down_revision = 'c5e0b7a94d18'
+branch_labels = None
+depends_on = None
+
+
+DEFAULT_MINUTES = 120
+BOOKINGS = [
+    ('ex_Shows_venue_booking', 'venue_id'),
+    ('ex_Shows_artist_booking', 'artist_id'),
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    op.add_column('Shows', sa.Column('ending_time', sa.DateTime(), nullable=True))
+
+    # Existing shows get the default length, cut short where the venue or
+    # the artist has another show starting earlier, so the double bookings
+    # already on file (which cannot be undone here) no longer overlap.
+    # Shows sharing a start time end where they start and block nothing.
+    if dialect == 'postgresql':
+        default_end = f"starting_time + interval '{DEFAULT_MINUTES} minutes'"
+        least = 'LEAST'
+    else:
+        # keep SQLAlchemy's 'YYYY-MM-DD HH:MM:SS.ffffff' text format
+        default_end = f"datetime(starting_time, '+{DEFAULT_MINUTES} minutes') || substr(starting_time, 20)"
+        least = 'MIN'
+    op.execute(f'''
+        UPDATE "Shows" SET ending_time = {least}(
+            next.default_end,
+            COALESCE(next.next_at_venue, next.default_end),
+            COALESCE(next.next_for_artist, next.default_end))
+        FROM (SELECT id, {default_end} AS default_end,
+                     LEAD(starting_time) OVER (
+                         PARTITION BY venue_id ORDER BY starting_time, id) AS next_at_venue,
+                     LEAD(starting_time) OVER (
+                         PARTITION BY artist_id ORDER BY starting_time, id) AS next_for_artist
+              FROM "Shows") AS next
+        WHERE "Shows".id = next.id''')
+
+    with op.batch_alter_table('Shows') as batch_op:
+        batch_op.alter_column('ending_time', existing_type=sa.DateTime(), nullable=False)
+
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for name, column in BOOKINGS:
+            op.execute(f'''
+                ALTER TABLE "Shows" ADD CONSTRAINT "{name}" EXCLUDE USING gist (
+                    {column} WITH =, tsrange(starting_time, ending_time) WITH &&)''')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, column in reversed(BOOKINGS):
+            op.execute(f'ALTER TABLE "Shows" DROP CONSTRAINT "{name}"')
+    with op.batch_alter_table('Shows') as batch_op:
+        batch_op.drop_column('ending_time')
@@ -0,0 +1,153 @@
+"""move venue and artist genres into Genre and link tables
+
+Revision ID: e8b1c4f2a7d0
+Revises: d2f7a8c3e619
+Create Date: 2026-10-18 22:10:54.903127
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b1c4f2a7d0'
+down_revision = 'd2f7a8c3e619'
+branch_labels = None
+depends_on = None
+
+
+# the genre choices of VenueForm/ArtistForm at the time of this revision
+GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk', 'Hip-Hop',
+    'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae',
+    'Rock n Roll', 'Soul', 'Other',
+]
+LINKS = [
+    ('Venue', 'VenueGenres', 'venue_id'),
+    ('Artist', 'ArtistGenres', 'artist_id'),
+]
+BATCH_SIZE = 1000
+
+_ITEM = re.compile(r'"((?:[^"\\]|\\.)*)"|([^,"]+)')
+
+
+def parse_genres(value):
+    # The old columns hold what psycopg2 made of a Python list: an array
+    # literal such as '{Jazz,"Rock n Roll"}'. Values longer than the column
+    # were cut off; the last, partial name of those is dropped.
+    text = value.strip()
+    complete = True
+    if text.startswith('{'):
+        complete = text.endswith('}')
+        text = text[1:-1] if complete else text[1:]
+    names = [re.sub(r'\\(.)', r'\1', quoted) if quoted else bare
+             for quoted, bare in _ITEM.findall(text)]
+    if not complete and not text.endswith(','):
+        names = names[:-1]
+    return [name.strip() for name in names if name.strip()]
+
+
+def array_literal(names):
+    quoted = []
+    for name in names:
+        if any(c in name for c in ' ,{}"\\'):
+            name = '"{}"'.format(name.replace('\\', '\\\\').replace('"', '\\"'))
+        quoted.append(name)
+    return '{' + ','.join(quoted) + '}'
+
+
+def _tables():
+    meta = sa.MetaData()
+    genre = sa.Table('Genre', meta, sa.Column('id', sa.Integer), sa.Column('name', sa.String))
+    tables = {}
+    for parent, link, key in LINKS:
+        tables[parent] = (
+            sa.Table(parent, meta, sa.Column('id', sa.Integer), sa.Column('genres', sa.String)),
+            sa.Table(link, meta, sa.Column(key, sa.Integer), sa.Column('genre_id', sa.Integer)))
+    return genre, tables
+
+
+def upgrade():
+    op.create_table('Genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    for parent, link, key in LINKS:
+        op.create_table(link,
+        sa.Column(key, sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint([key], [f'{parent}.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(key, 'genre_id')
+        )
+        op.create_index(f'ix_{link}_genre_id_{key}', link, ['genre_id', key], unique=False)
+
+    connection = op.get_bind()
+    genre, tables = _tables()
+    connection.execute(genre.insert(), [{'name': name} for name in GENRES])
+    genre_ids = dict(connection.execute(sa.select(genre.c.name, genre.c.id)).all())
+
+    # backfill the links from the old columns, BATCH_SIZE rows at a time
+    for parent, link, key in LINKS:
+        source, target = tables[parent]
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                sa.select(source.c.id, source.c.genres)
+                .where(source.c.id > last_id, source.c.genres.isnot(None))
+                .order_by(source.c.id).limit(BATCH_SIZE)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            links = []
+            for row in rows:
+                for name in dict.fromkeys(parse_genres(row.genres)):
+                    if name not in genre_ids:
+                        connection.execute(genre.insert(), {'name': name})
+                        genre_ids[name] = connection.execute(
+                            sa.select(genre.c.id).where(genre.c.name == name)).scalar_one()
+                    links.append({key: row.id, 'genre_id': genre_ids[name]})
+            if links:
+                connection.execute(target.insert(), links)
+
+    for parent, link, key in LINKS:
+        op.drop_column(parent, 'genres')
+
+
+def downgrade():
+    connection = op.get_bind()
+    genre, tables = _tables()
+    for parent, link, key in LINKS:
+        op.add_column(parent, sa.Column('genres', sa.String(length=120), nullable=True))
+
+    for parent, link, key in LINKS:
+        source, target = tables[parent]
+        entity = target.c[key]
+        last_id = 0
+        while True:
+            ids = connection.execute(
+                sa.select(entity).distinct().where(entity > last_id)
+                .order_by(entity).limit(BATCH_SIZE)).scalars().all()
+            if not ids:
+                break
+            last_id = ids[-1]
+            names = {}
+            for entity_id, name in connection.execute(
+                    sa.select(entity, genre.c.name)
+                    .join(genre, genre.c.id == target.c.genre_id)
+                    .where(entity.in_(ids)).order_by(entity, genre.c.name)):
+                names.setdefault(entity_id, []).append(name)
+            connection.execute(
+                source.update().where(source.c.id == sa.bindparam('entity_id'))
+                .values(genres=sa.bindparam('value')),
+                [{'entity_id': entity_id, 'value': array_literal(entity_names)[:120]}
+                 for entity_id, entity_names in names.items()])
+
+    for parent, link, key in reversed(LINKS):
+        op.drop_index(f'ix_{link}_genre_id_{key}', table_name=link)
+        op.drop_table(link)
+    op.drop_table('Genre')
@@ -0,0 +1,45 @@
+"""add city/state indexes for the listing facets
+
+Revision ID: f3a9d2e6b180
+Revises: e8b1c4f2a7d0
+Create Date: 2026-10-18 23:04:31.552918
+
+"""
+from contextlib import nullcontext
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d2e6b180'
+down_revision = 'e8b1c4f2a7d0'
+branch_labels = None
+depends_on = None
+
+
+# the state and city facet counts group by one column under a filter on
+# the other; each pair below answers one of them from the index alone
+INDEXES = [
+    ('ix_Venue_state_city', 'Venue', ['state', 'city']),
+    ('ix_Artist_city_state', 'Artist', ['city', 'state']),
+    ('ix_Artist_state_city', 'Artist', ['state', 'city']),
+]
+
+
+def _index_block():
+    if op.get_bind().dialect.name == 'postgresql':
+        return op.get_context().autocommit_block()
+    return nullcontext()
+
+
+def upgrade():
+    with _index_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with _index_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,414 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from datetime import datetime, timedelta
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import with_loader_criteria
+from sqlalchemy.ext.associationproxy import association_proxy
+from geo import geohash_of
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'expire_on_commit': False, 'class_': RoutingSession})
+
+#----------------------------------------------------------------------------#
+# Models.
+#----------------------------------------------------------------------------#
+
+class Venue(db.Model):
+    __tablename__ = 'Venue'
+    __table_args__ = (
+        db.Index('ix_Venue_city_state', 'city', 'state'),
+        db.Index('ix_Venue_state_city', 'state', 'city'),
+        # the /venues listing order, over the rows not soft-deleted
+        db.Index('ix_Venue_live_city_state_id', 'city', 'state', 'id',
+                 postgresql_where=db.text('deleted_at IS NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL')),
+        # /venues/nearby range scans, see geo.py
+        db.Index('ix_Venue_live_geohash', 'geohash',
+                 postgresql_where=db.text('deleted_at IS NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL')),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, index=True)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    address = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+    website = db.Column(db.String(120))
+    seeking_talent = db.Column(db.Boolean, default=False)
+    seeking_description = db.Column(db.String(500))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # of latitude/longitude, kept in step by update_entity and _set_geohash
+    geohash = db.Column(db.String(12))
+    genre_rows = db.relationship('Genre', secondary='VenueGenres', order_by='Genre.name', lazy=True)
+    genres = association_proxy('genre_rows', 'name', creator=lambda name: Genre.named(name))
+    show = db.relationship("Show", backref="venue", lazy=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime)
+    __mapper_args__ = {'version_id_col': version}
+    
+    def __repr__(self):
+      return f'{self.name}'
+    # TODO: implement any missing fields, as a database migration using Flask-Migrate
+
+class Artist(db.Model):
+    __tablename__ = 'Artist'
+    __table_args__ = (
+        db.Index('ix_Artist_city_state', 'city', 'state'),
+        db.Index('ix_Artist_state_city', 'state', 'city'),
+        # the /artists keyset order, over the rows not soft-deleted
+        db.Index('ix_Artist_live_name_id', 'name', 'id',
+                 postgresql_where=db.text('deleted_at IS NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL')),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, index=True)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    genre_rows = db.relationship('Genre', secondary='ArtistGenres', order_by='Genre.name', lazy=True)
+    genres = association_proxy('genre_rows', 'name', creator=lambda name: Genre.named(name))
+    image_link = db.Column(db.String(500))
+    facebook_link = db.Column(db.String(120))
+    website = db.Column(db.String(120))
+    seeking_venue = db.Column(db.Boolean, default=False)
+    seeking_description = db.Column(db.String(500))
+    show = db.relationship("Show", backref="artist", lazy=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime)
+    __mapper_args__ = {'version_id_col': version}
+
+    def __repr__(self):
+      return f'Artist {self.name}'
+    # TODO: implement any missing fields, as a database migration using Flask-Migrate
+
+class Genre(db.Model):
+  __tablename__ = 'Genre'
+  id = db.Column(db.Integer, primary_key=True)
+  name = db.Column(db.String(120), nullable=False, unique=True)
+
+  @classmethod
+  def named(cls, name):
+    # the Genre called name: pending in this session, stored, or new
+    for obj in db.session.new:
+      if isinstance(obj, cls) and obj.name == name:
+        return obj
+    with db.session.no_autoflush:
+      genre = cls.query.filter_by(name=name).one_or_none()
+    return genre or cls(name=name)
+
+# Venue/artist <-> genre links. The (genre_id, ...) indexes answer genre
+# filters; the primary keys answer a venue's or artist's own genres.
+venue_genres = db.Table(
+    'VenueGenres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_VenueGenres_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+artist_genres = db.Table(
+    'ArtistGenres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_ArtistGenres_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
+# Booking length limits, in minutes. Overlap lookups only scan back
+# MAX_SHOW_MINUTES from a slot's start.
+DEFAULT_SHOW_MINUTES = 120
+MAX_SHOW_MINUTES = 24 * 60
+
+class Show(db.Model):
+  # On Postgres, exclusion constraints ex_Shows_venue_booking and
+  # ex_Shows_artist_booking (migration d2f7a8c3e619) reject overlapping
+  # [starting_time, ending_time) ranges per venue and per artist.
+  __tablename__ = 'Shows'
+  __table_args__ = (
+      db.Index('ix_Shows_venue_id_starting_time', 'venue_id', 'starting_time'),
+      db.Index('ix_Shows_artist_id_starting_time', 'artist_id', 'starting_time'),
+      db.Index('ix_Shows_starting_time_id', 'starting_time', 'id'),
+  )
+  id = db.Column(db.Integer, primary_key=True)
+  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+  starting_time = db.Column(db.DateTime, nullable=False)
+  ending_time = db.Column(db.DateTime, nullable=False)
+  version = db.Column(db.Integer, nullable=False, default=1)
+  updated_at = db.Column(db.DateTime, nullable=False, index=True,
+                         default=datetime.utcnow, onupdate=datetime.utcnow)
+  __mapper_args__ = {'version_id_col': version}
+
+  @property
+  def duration(self):
+    return int((self.ending_time - self.starting_time).total_seconds() // 60)
+
+class Job(db.Model):
+  # Post-commit work queued in the transaction that calls for it and run by
+  # `flask worker`; see jobs.py. Jobs that succeed are deleted; those out
+  # of attempts stay behind as 'failed' with their last error.
+  __tablename__ = 'Jobs'
+  __table_args__ = (
+      db.Index('ix_Jobs_status_run_at', 'status', 'run_at'),
+  )
+  id = db.Column(db.Integer, primary_key=True)
+  task = db.Column(db.String(120), nullable=False)
+  payload = db.Column(db.JSON, nullable=False, default=dict)
+  status = db.Column(db.String(20), nullable=False, default='queued')
+  attempts = db.Column(db.Integer, nullable=False, default=0)
+  max_attempts = db.Column(db.Integer, nullable=False)
+  run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+  locked_by = db.Column(db.String(120))
+  locked_at = db.Column(db.DateTime)
+  last_error = db.Column(db.Text)
+  created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class VenueShowStats(db.Model):
+  # Rollup of upcoming/past show counts per venue, maintained by
+  # refresh_show_stats. Once next_show_at has passed, one upcoming show
+  # has become a past one and the row is stale until refreshed.
+  __tablename__ = 'VenueShowStats'
+  key = 'venue_id'  # the column shared with Shows
+  venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+  upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0)
+  past_shows_count = db.Column(db.Integer, nullable=False, default=0)
+  next_show_at = db.Column(db.DateTime, index=True)
+  refreshed_at = db.Column(db.DateTime, nullable=False)
+
+class ArtistShowStats(db.Model):
+  # Same rollup per artist.
+  __tablename__ = 'ArtistShowStats'
+  key = 'artist_id'
+  artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+  upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0)
+  past_shows_count = db.Column(db.Integer, nullable=False, default=0)
+  next_show_at = db.Column(db.DateTime, index=True)
+  refreshed_at = db.Column(db.DateTime, nullable=False)
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def live_upcoming_show_counts(column, ids):
+  # upcoming show counts for many venues or artists in one grouped query;
+  # column is Show.venue_id or Show.artist_id. Ids without shows are absent.
+  if not ids:
+    return {}
+  return dict(db.session.query(column, db.func.count(Show.id)).filter(
+      column.in_(ids), Show.starting_time > datetime.now()).group_by(column).all())
+
+def upcoming_show_counts(stats, ids=None):
+  # upcoming show counts from the VenueShowStats/ArtistShowStats rollup, for
+  # the given ids or every row. Rows a show has aged out of since their last
+  # refresh are recounted live. The counts are eventually consistent: writes
+  # queue the rollup refresh as a job, so they lag (and entities missing from
+  # the rollup are absent) until a worker has run it.
+  id_column = getattr(stats, stats.key)
+  query = db.session.query(id_column, stats.upcoming_shows_count, stats.next_show_at)
+  if ids is not None:
+    if not ids:
+      return {}
+    query = query.filter(id_column.in_(ids))
+  now = datetime.now()
+  counts = {}
+  stale = []
+  for entity_id, upcoming_shows_count, next_show_at in query:
+    if next_show_at is not None and next_show_at <= now:
+      stale.append(entity_id)
+    else:
+      counts[entity_id] = upcoming_shows_count
+  counts.update(live_upcoming_show_counts(getattr(Show, stats.key), stale))
+  return counts
+
+# Separator of the genre names aggregated by genre_names(); never in a name.
+GENRE_SEPARATOR = '\x1f'
+
+def genre_link(model):
+  # the link table of Venue or Artist and its column pointing back at it
+  if model is Venue:
+    return venue_genres, venue_genres.c.venue_id
+  return artist_genres, artist_genres.c.artist_id
+
+def has_genres(model, names):
+  # Criterion keeping Venue/Artist rows with any of the genres in names.
+  # A semi-join: names resolve to ids through the unique index on
+  # Genre.name, then ids to venues/artists through the (genre_id, ...) index.
+  link, key = genre_link(model)
+  return model.id.in_(
+      db.select(key).join(Genre, Genre.id == link.c.genre_id).where(Genre.name.in_(names)))
+
+def genre_names(model):
+  # Correlated subquery: the model row's genre names joined by GENRE_SEPARATOR.
+  link, key = genre_link(model)
+  return db.select(db.func.aggregate_strings(Genre.name, GENRE_SEPARATOR)).select_from(
+      link.join(Genre, Genre.id == link.c.genre_id)).where(key == model.id).scalar_subquery()
+
+def overlapping_shows(column, entity_id, starting_time, ending_time):
+  # Shows of one venue or artist (column is Show.venue_id or
+  # Show.artist_id) overlapping [starting_time, ending_time). Only shows
+  # starting within MAX_SHOW_MINUTES before the range can reach into it, so
+  # this is a range scan on (venue_id|artist_id, starting_time).
+  return Show.query.filter(
+      column == entity_id,
+      Show.starting_time < ending_time,
+      Show.starting_time > starting_time - timedelta(minutes=MAX_SHOW_MINUTES),
+      Show.ending_time > starting_time,
+      Show.ending_time > Show.starting_time
+  ).order_by(Show.starting_time)
+
+def booking_conflicts(venue_id, artist_id, starting_time, ending_time):
+  # The first show double-booking the venue and the artist, or None for each.
+  return (overlapping_shows(Show.venue_id, venue_id, starting_time, ending_time).first(),
+          overlapping_shows(Show.artist_id, artist_id, starting_time, ending_time).first())
+
+def venue_free_slots(venue_id, start, end, min_minutes=0):
+  # Gaps between the venue's shows within [start, end), as (start, end)
+  # pairs, keeping those at least min_minutes long.
+  slots = []
+  cursor = start
+  for show in overlapping_shows(Show.venue_id, venue_id, start, end).with_entities(
+      Show.starting_time, Show.ending_time):
+    if show.starting_time > cursor:
+      slots.append((cursor, show.starting_time))
+    cursor = max(cursor, show.ending_time)
+  if cursor < end:
+    slots.append((cursor, end))
+  shortest = timedelta(minutes=min_minutes)
+  return [(slot_start, slot_end) for slot_start, slot_end in slots
+          if slot_end - slot_start >= shortest]
+
+def refresh_show_stats(connection, venue_ids=None, artist_ids=None):
+  # Recount the rollup rows for the given venue/artist ids (None: all of
+  # them, an empty collection: none) from Shows in one grouped
+  # INSERT ... SELECT each, through the indexes on (venue_id, starting_time)
+  # and (artist_id, starting_time).
+  now = datetime.now()
+  for stats, ids in ((VenueShowStats, venue_ids), (ArtistShowStats, artist_ids)):
+    if ids is not None and not ids:
+      continue
+    table = stats.__table__
+    column = getattr(Show, stats.key)
+    upcoming = Show.starting_time > now
+    select = db.select(
+        column,
+        db.func.sum(db.case((upcoming, 1), else_=0)),
+        db.func.sum(db.case((upcoming, 0), else_=1)),
+        db.func.min(db.case((upcoming, Show.starting_time))),
+        db.literal(now, db.DateTime)
+    ).group_by(column)
+    delete = table.delete()
+    if ids is not None:
+      ids = sorted(ids)
+      select = select.where(column.in_(ids))
+      delete = delete.where(table.c[stats.key].in_(ids))
+    connection.execute(delete)
+    connection.execute(table.insert().from_select(
+        [stats.key, 'upcoming_shows_count', 'past_shows_count',
+         'next_show_at', 'refreshed_at'], select))
+
+def refresh_aged_show_stats(connection):
+  # Recount only the rollup rows whose next upcoming show has started.
+  now = datetime.now()
+  refresh_show_stats(
+      connection,
+      venue_ids=[row[0] for row in connection.execute(
+          db.select(VenueShowStats.venue_id).where(VenueShowStats.next_show_at <= now))],
+      artist_ids=[row[0] for row in connection.execute(
+          db.select(ArtistShowStats.artist_id).where(ArtistShowStats.next_show_at <= now))])
+
+def update_entity(session, model, entity_id, values, version=None, genres=None):
+  # Apply values (column name -> value) to one live Venue or Artist row in
+  # a single UPDATE, guarded by version when given; False, with nothing
+  # changed, if the row is gone or no longer at that version. genres, when
+  # given, replace the row's genre links in the same transaction.
+  criteria = [model.id == entity_id, model.deleted_at.is_(None)]
+  if 'geohash' in model.__table__.c and 'latitude' in values and 'longitude' in values:
+    values = dict(values, geohash=geohash_of(values['latitude'], values['longitude']))
+  if version is not None:
+    criteria.append(model.version == version)
+  updated = session.execute(model.__table__.update().where(*criteria).values(
+      dict(values, version=model.version + 1, updated_at=datetime.utcnow()))).rowcount
+  if not updated:
+    return False
+  if genres is not None:
+    link, key = genre_link(model)
+    names = sorted(set(genres))
+    known = set(session.execute(db.select(Genre.name).where(Genre.name.in_(names))).scalars())
+    missing = [{'name': name} for name in names if name not in known]
+    if missing:
+      session.execute(Genre.__table__.insert(), missing)
+    session.execute(link.delete().where(key == entity_id))
+    session.execute(link.insert().from_select(
+        [key.name, 'genre_id'],
+        db.select(db.literal(entity_id), Genre.id).where(Genre.name.in_(names))))
+  return True
+
+# ids per DELETE/UPDATE statement of a bulk delete
+DELETE_BATCH_SIZE = 500
+
+def delete_entities(session, model, ids, soft=False):
+  # Delete the Venue or Artist rows in ids within the session's transaction,
+  # in set-based statements per DELETE_BATCH_SIZE ids: their shows, genre
+  # links and rollup rows, then the rows themselves. With soft, only stamp
+  # deleted_at (shows and links stay, hidden by _hide_soft_deleted).
+  # Returns (ids deleted, ids on the other side of their shows), the latter
+  # for the caller to recount the rollup of.
+  stats = VenueShowStats if model is Venue else ArtistShowStats
+  column, other_column = ((Show.venue_id, Show.artist_id) if model is Venue
+                          else (Show.artist_id, Show.venue_id))
+  link, key = genre_link(model)
+  ids = sorted(set(ids))
+  deleted, others = [], set()
+  now = datetime.utcnow()
+  for start in range(0, len(ids), DELETE_BATCH_SIZE):
+    batch = ids[start:start + DELETE_BATCH_SIZE]
+    if soft:
+      deleted += session.execute(
+          model.__table__.update().where(model.id.in_(batch), model.deleted_at.is_(None))
+          .values(deleted_at=now, updated_at=now, version=model.version + 1)
+          .returning(model.id)).scalars().all()
+      continue
+    others.update(session.execute(
+        db.select(other_column).where(column.in_(batch)).distinct()).scalars())
+    session.execute(Show.__table__.delete().where(column.in_(batch)))
+    # the ON DELETE CASCADEs below are not enforced by SQLite
+    session.execute(link.delete().where(key.in_(batch)))
+    session.execute(stats.__table__.delete().where(getattr(stats, stats.key).in_(batch)))
+    deleted += session.execute(
+        model.__table__.delete().where(model.id.in_(batch)).returning(model.id)).scalars().all()
+  return deleted, sorted(others)
+
+@event.listens_for(db.session, 'before_flush')
+def _touch_on_genre_change(session, flush_context, instances):
+  # genres live in link tables; a change to them alone would not update the
+  # venue or artist row, leaving its version (and the page validators) stale
+  for obj in session.dirty:
+    if isinstance(obj, (Venue, Artist)) and db.inspect(obj).attrs.genre_rows.history.has_changes():
+      obj.updated_at = datetime.utcnow()
+
+@event.listens_for(Venue, 'before_insert')
+@event.listens_for(Venue, 'before_update')
+def _set_geohash(mapper, connection, venue):
+  venue.geohash = geohash_of(venue.latitude, venue.longitude)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _hide_soft_deleted(execute_state):
+  # Every ORM SELECT skips soft-deleted venues and artists, wherever they
+  # appear in it (so shows joined to them go too). Opt out with
+  # .execution_options(include_deleted=True).
+  if (execute_state.is_select and not execute_state.is_column_load
+      and not execute_state.is_relationship_load
+      and not execute_state.execution_options.get('include_deleted', False)):
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(Venue, Venue.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(Artist, Artist.deleted_at.is_(None), include_aliases=True))
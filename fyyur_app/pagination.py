@@ -0,0 +1,95 @@
+"""Keyset (cursor) pagination.
+
+A page is addressed by the sort key of the row just outside it instead of
+an OFFSET, so every page is an index range scan on the sort columns no
+matter how deep the reader goes. The sort key must be unique; listings use
+the primary key as the last column.
+
+Cursors are opaque url-safe tokens holding the key values as JSON.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 50
+
+
+def encode_cursor(values):
+  payload = json.dumps([
+      value.isoformat() if isinstance(value, datetime) else value
+      for value in values
+  ], separators=(',', ':'))
+  return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, columns):
+  """Decode ``token`` into values typed like ``columns``.
+
+  Raises ``ValueError`` for anything that was not produced by
+  ``encode_cursor`` for the same columns.
+  """
+  try:
+    padded = token + '=' * (-len(token) % 4)
+    values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+  except (TypeError, ValueError) as e:
+    raise ValueError(f'malformed cursor {token!r}') from e
+  if not isinstance(values, list) or len(values) != len(columns):
+    raise ValueError(f'malformed cursor {token!r}')
+  decoded = []
+  for column, value in zip(columns, values):
+    python_type = column.type.python_type
+    if python_type is datetime:
+      if not isinstance(value, str):
+        raise ValueError(f'malformed cursor {token!r}')
+      value = datetime.fromisoformat(value)
+    # bool is an int subclass; True must not pass for the id 1
+    elif not isinstance(value, python_type) or isinstance(value, bool):
+      raise ValueError(f'malformed cursor {token!r}')
+    decoded.append(value)
+  return tuple(decoded)
+
+
+def seek(query, columns, after=None):
+  """Order ``query`` by ``columns`` and start it just past cursor ``after``."""
+  if after is not None:
+    query = query.filter(tuple_(*columns) > decode_cursor(after, columns))
+  return query.order_by(*columns)
+
+
+class Page(object):
+  def __init__(self, items, next_cursor, prev_cursor):
+    self.items = items
+    self.next_cursor = next_cursor
+    self.prev_cursor = prev_cursor
+
+
+def keyset_page(query, columns, after=None, before=None, per_page=PAGE_SIZE):
+  """Return the :class:`Page` of ``query`` ordered by ``columns``.
+
+  ``after``/``before`` are cursors from a previous page's ``next_cursor``
+  / ``prev_cursor``. Every row of ``query`` must expose the sort columns
+  under their own names (``row.starting_time``, ``row.id``...). One extra
+  row is fetched to tell whether another page exists.
+  """
+  key = tuple_(*columns)
+  names = [column.key for column in columns]
+  if before is not None:
+    query = query.filter(key < decode_cursor(before, columns))
+    rows = query.order_by(*[column.desc() for column in columns]).limit(per_page + 1).all()
+    has_prev, has_next = len(rows) > per_page, True
+    rows = rows[:per_page][::-1]
+  else:
+    rows = seek(query, columns, after).limit(per_page + 1).all()
+    has_prev, has_next = after is not None, len(rows) > per_page
+    rows = rows[:per_page]
+
+  def cursor(row):
+    return encode_cursor([getattr(row, name) for name in names])
+
+  return Page(
+      rows,
+      cursor(rows[-1]) if rows and has_next else None,
+      cursor(rows[0]) if rows and has_prev else None)
@@ -0,0 +1,191 @@
+"""Read-replica routing.
+
+Views decorated with ``replicas.reads`` are read-only: for the length of
+the request their queries go to one of the replica binds (``REPLICA_URIS``),
+picked round-robin among those passing their health check. Everything
+else stays on the primary:
+
+* flushes and INSERT/UPDATE/DELETE statements, whatever the view;
+* every request from a client that committed a write in the last
+  ``REPLICA_READ_YOUR_WRITES`` seconds (the time is kept in its session
+  cookie), so it sees its own changes despite replication lag;
+* read-only requests this process serves within that window after one of
+  its own commits, so pages dropped from the page cache by the commit are
+  not cached again from a replica that has not replayed it yet;
+* all reads while no replica is healthy.
+
+A replica is checked when it is due to be picked and its last check is
+more than ``REPLICA_HEALTH_CHECK_INTERVAL`` seconds old: it must answer,
+and a Postgres standby must be at most ``REPLICA_MAX_LAG`` seconds behind.
+A replica whose connection drops mid-request is left out until its next
+check.
+
+``RoutingSession`` is the ``db.session`` class that applies the choice.
+"""
+
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context
+from flask import session as client_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+
+BIND_PREFIX = 'replica_'
+
+_WROTE = 'replicas.wrote'
+_WROTE_AT = '_wrote_at'
+
+logger = logging.getLogger(__name__)
+
+_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+def replica_uris(settings):
+  """``REPLICA_URIS`` as a list; a comma-separated string is accepted."""
+  uris = settings.get('REPLICA_URIS') or []
+  if isinstance(uris, str):
+    uris = uris.split(',')
+  return [uri.strip() for uri in uris if uri.strip()]
+
+
+class RoutingSession(Session):
+  """Session sending the current request's reads to its replica, if any."""
+
+  def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+    if bind is None:
+      if self._flushing or getattr(clause, 'is_dml', False):
+        self.info[_WROTE] = True
+      elif has_app_context() and g.get('replica_engine') is not None:
+        return g.replica_engine
+    return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_write(db_session):
+  if not db_session.info.pop(_WROTE, False) or not has_app_context():
+    return
+  state = current_app.extensions.get('replicas')
+  if state is None or not state.replicas:
+    return
+  state.last_write = time.monotonic()
+  if has_request_context():
+    client_session[_WROTE_AT] = time.time()
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _forget_write(db_session, previous_transaction):
+  db_session.info.pop(_WROTE, None)
+
+
+class Replica(object):
+
+  def __init__(self, key, engine):
+    self.key = key
+    self.engine = engine
+    self.healthy = True
+    self.checked_at = None
+    self._lock = threading.Lock()
+    event.listen(engine, 'handle_error', self._on_error)
+
+  def available(self, interval, max_lag):
+    now = time.monotonic()
+    with self._lock:
+      due = self.checked_at is None or now - self.checked_at >= interval
+      if due:
+        self.checked_at = now
+    # one thread runs the check; the others go by the previous result
+    if due:
+      self.healthy = self._check(max_lag)
+    return self.healthy
+
+  def _check(self, max_lag):
+    try:
+      with self.engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+          lag = connection.execute(_LAG_QUERY).scalar()
+          if lag > max_lag:
+            logger.warning('replica %s is %.1fs behind; not using it', self.key, lag)
+            return False
+        else:
+          connection.execute(text('SELECT 1'))
+    except SQLAlchemyError as e:
+      logger.warning('replica %s failed its health check: %s', self.key, e)
+      return False
+    return True
+
+  def _on_error(self, context):
+    if context.is_disconnect:
+      self.healthy = False
+
+
+class _ReplicaState(object):
+  # the replicas of one app and its round-robin position
+
+  def __init__(self, replicas):
+    self.replicas = replicas
+    self.last_write = None
+    self._next = 0
+    self._lock = threading.Lock()
+
+  def rotation(self):
+    with self._lock:
+      start = self._next
+      self._next = (self._next + 1) % len(self.replicas)
+    return self.replicas[start:] + self.replicas[:start]
+
+
+class ReplicaRouter(object):
+
+  def __init__(self, db, app=None):
+    self.db = db
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    """Set up the replica binds of ``app``; call after ``db.init_app``."""
+    app.config.setdefault('REPLICA_READ_YOUR_WRITES', 5)
+    app.config.setdefault('REPLICA_HEALTH_CHECK_INTERVAL', 10)
+    app.config.setdefault('REPLICA_MAX_LAG', 30)
+    keys = sorted((key for key in app.config.get('SQLALCHEMY_BINDS') or {}
+                   if key.startswith(BIND_PREFIX)), key=lambda key: int(key[len(BIND_PREFIX):]))
+    if keys and not app.config.get('SECRET_KEY'):
+      # the write marker rides in the signed session cookie: under a key of
+      # its own, every other worker would drop it and read from a replica
+      raise RuntimeError('SECRET_KEY must be set, and shared by every process, '
+                         'when read replicas are configured')
+    with app.app_context():
+      replicas = [Replica(key, self.db.engines[key]) for key in keys]
+    app.extensions['replicas'] = _ReplicaState(replicas)
+
+  def reads(self, view):
+    """Decorate a read-only view so its queries may run on a replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+      g.replica_engine = self.pick()
+      return view(*args, **kwargs)
+    return wrapper
+
+  def pick(self):
+    """Return the engine the current request should read from, or ``None``
+    for the primary."""
+    state = current_app.extensions.get('replicas')
+    if state is None or not state.replicas:
+      return None
+    config = current_app.config
+    window = config['REPLICA_READ_YOUR_WRITES']
+    wrote_at = client_session.get(_WROTE_AT)
+    if wrote_at is not None and time.time() - wrote_at < window:
+      return None
+    if state.last_write is not None and time.monotonic() - state.last_write < window:
+      return None
+    for replica in state.rotation():
+      if replica.available(config['REPLICA_HEALTH_CHECK_INTERVAL'], config['REPLICA_MAX_LAG']):
+        return replica.engine
+    return None
@@ -0,0 +1,74 @@
+"""Name search for venues and artists.
+
+Postgres answers substring matches from a pg_trgm GIN index (ILIKE
+'%term%' can use it) and ranks by trigram similarity. SQLite answers them
+from an FTS5 trigram table kept in sync by triggers, ranked by bm25. Both
+are created by migration 5b2e8c41d7a3; databases without them fall back to
+a plain ILIKE scan ranked exact > prefix > substring.
+"""
+
+from sqlalchemy import case, column, func, literal_column, table, text
+
+PAGE_SIZE = 20
+# Trigram indexes cannot answer terms shorter than one trigram.
+MIN_TRIGRAM_LENGTH = 3
+
+_fts_tables = {}
+
+
+def fts_table_name(model):
+  return f'{model.__tablename__}_name_fts'
+
+
+def escape_like(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _has_fts_table(session, model):
+  bind = session.get_bind()
+  key = (str(bind.url), model.__tablename__)
+  if key not in _fts_tables:
+    found = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': fts_table_name(model)}).first()
+    _fts_tables[key] = found is not None
+  return _fts_tables[key]
+
+
+def search_by_name(session, model, term, page=1, per_page=PAGE_SIZE, where=()):
+  """Return ``(total, rows)`` for one page of ``model`` rows whose name
+  contains ``term`` (case-insensitive), best matches first, narrowed by
+  the extra criteria in ``where``.
+
+  Each row has ``id`` and ``name``. The total is computed with a window
+  function in the same statement, so a page costs one round-trip.
+  """
+  term = (term or '').strip()
+  page = max(page or 1, 1)
+  dialect = session.get_bind().dialect.name
+  total = func.count().over().label('total')
+  query = session.query(model.id, model.name, total).filter(*where)
+
+  if not term:
+    query = query.order_by(model.name, model.id)
+  elif (dialect == 'sqlite' and len(term) >= MIN_TRIGRAM_LENGTH
+        and _has_fts_table(session, model)):
+    name = fts_table_name(model)
+    fts = table(name, column('rowid'), column('rank'))
+    phrase = '"{}"'.format(term.replace('"', '""'))
+    query = query.join(fts, fts.c.rowid == model.id).filter(
+        literal_column(f'"{name}"').op('MATCH')(phrase)
+    ).order_by(fts.c.rank, model.name, model.id)
+  else:
+    query = query.filter(model.name.ilike(f'%{escape_like(term)}%', escape='\\'))
+    if dialect == 'postgresql':
+      query = query.order_by(func.similarity(model.name, term).desc(), model.name, model.id)
+    else:
+      rank = case(
+          (func.lower(model.name) == term.lower(), 0),
+          (model.name.ilike(f'{escape_like(term)}%', escape='\\'), 1),
+          else_=2)
+      query = query.order_by(rank, model.name, model.id)
+
+  rows = query.limit(per_page).offset((page - 1) * per_page).all()
+  return (rows[0].total if rows else 0), rows
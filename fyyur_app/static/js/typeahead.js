@@ -0,0 +1,67 @@
+// Name suggestions for inputs marked data-autocomplete="venue" or "artist",
+// from /autocomplete. With data-autocomplete-id, the id of the chosen name
+// is written to the (hidden) input of that id.
+(function () {
+  var count = 0;
+
+  function attach(input) {
+    var kind = input.getAttribute('data-autocomplete');
+    var target = document.getElementById(input.getAttribute('data-autocomplete-id') || '');
+    var list = document.createElement('datalist');
+    var choices = {};
+    var timer = null;
+    var pending = null;
+
+    list.id = 'autocomplete-' + (++count);
+    input.parentNode.appendChild(list);
+    input.setAttribute('list', list.id);
+    input.setAttribute('autocomplete', 'off');
+
+    function choose() {
+      if (target) {
+        target.value = choices.hasOwnProperty(input.value) ? choices[input.value] : '';
+      }
+    }
+
+    function suggest() {
+      var term = input.value;
+      if (!term.trim() || choices.hasOwnProperty(term)) {
+        return;
+      }
+      if (pending) {
+        pending.abort();
+      }
+      var request = pending = new XMLHttpRequest();
+      request.open('GET', '/autocomplete?type=' + encodeURIComponent(kind) +
+                   '&q=' + encodeURIComponent(term));
+      request.onload = function () {
+        if (request.status !== 200) {
+          return;
+        }
+        choices = {};
+        list.innerHTML = '';
+        JSON.parse(request.responseText).data.forEach(function (item) {
+          // names are not unique: pickers show the id too
+          var label = target ? item.name + ' (#' + item.id + ')' : item.name;
+          var option = document.createElement('option');
+          choices[label] = item.id;
+          option.value = label;
+          list.appendChild(option);
+        });
+        choose();
+      };
+      request.send();
+    }
+
+    input.addEventListener('input', function () {
+      choose();
+      clearTimeout(timer);
+      timer = setTimeout(suggest, 100);
+    });
+  }
+
+  var inputs = document.querySelectorAll('[data-autocomplete]');
+  for (var i = 0; i < inputs.length; i++) {
+    attach(inputs[i]);
+  }
+})();
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+  app = create_app('testing', TYPEAHEAD_ENABLED=False)
+  with app.app_context():
+    db.create_all()
+    yield app
+    db.session.remove()
+    db.drop_all()
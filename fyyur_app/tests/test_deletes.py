@@ -0,0 +1,102 @@
+"""Venue/artist deletes, single and bulk, outright and soft."""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from models import Artist, Show, Venue, VenueShowStats, db
+
+
+def add_catalog(venues=3):
+  artist = Artist(name='Touring Band', city='Austin', state='TX', phone='555-0100')
+  db.session.add(artist)
+  venue_rows = []
+  for number in range(venues):
+    venue = Venue(name=f'Venue {number}', city='Austin', state='TX', address='1 Main St',
+                  phone='555-0100', genres=['Jazz'] if number == 0 else [])
+    starting_time = datetime.now() + timedelta(days=number + 1)
+    db.session.add(venue)
+    db.session.add(Show(artist=artist, venue=venue, starting_time=starting_time,
+                        ending_time=starting_time + timedelta(hours=2)))
+    venue_rows.append(venue)
+  db.session.commit()
+  return [venue.id for venue in venue_rows], artist.id
+
+
+def count(table, *where):
+  # straight to the tables, soft-deleted rows included
+  return db.session.execute(select(func.count()).select_from(table).where(*where)).scalar()
+
+
+def test_delete_removes_the_venue_and_its_shows(app):
+  client = app.test_client()
+  (venue, kept, _), artist = add_catalog()
+
+  response = client.delete(f'/venues/{venue}')
+  assert response.status_code == 200
+  assert response.get_json()['data'] == {'deleted': [venue], 'not_found': [], 'soft': False}
+  assert count(Venue.__table__, Venue.__table__.c.id == venue) == 0
+  assert count(Show.__table__, Show.__table__.c.venue_id == venue) == 0
+  assert count(VenueShowStats.__table__, VenueShowStats.__table__.c.venue_id == venue) == 0
+  assert client.get(f'/venues/{venue}').status_code == 404
+  assert client.get(f'/venues/{kept}').status_code == 200
+  # the artist survives losing one of its shows
+  assert client.get(f'/api/v1/artists/{artist}').status_code == 200
+
+  assert client.delete(f'/venues/{venue}').status_code == 404
+
+
+def test_bulk_delete_reports_what_was_not_found(app):
+  client = app.test_client()
+  (first, second, kept), _ = add_catalog()
+
+  response = client.post('/venues/delete', json={'ids': [first, second, 999]})
+  assert response.status_code == 200
+  assert response.get_json()['data'] == {
+      'deleted': [first, second], 'not_found': [999], 'soft': False}
+  assert [row.id for row in db.session.query(Venue.id)] == [kept]
+
+  # form-encoded, comma-separated
+  response = client.post('/venues/delete', data={'ids': f'{kept},{first}'})
+  assert response.get_json()['data']['deleted'] == [kept]
+
+  assert client.post('/venues/delete', json={'ids': ['x']}).status_code == 400
+  assert client.post('/venues/delete', json={'id': 1}).status_code == 400
+
+
+def test_soft_delete_hides_rows_but_keeps_them(app):
+  app.config['SOFT_DELETE'] = True
+  client = app.test_client()
+  (venue, kept, _), artist = add_catalog()
+
+  response = client.delete(f'/venues/{venue}')
+  assert response.get_json()['data'] == {'deleted': [venue], 'not_found': [], 'soft': True}
+  # the row and its show stay, stamped
+  assert count(Venue.__table__, Venue.__table__.c.id == venue,
+               Venue.__table__.c.deleted_at.isnot(None)) == 1
+  assert count(Show.__table__, Show.__table__.c.venue_id == venue) == 1
+
+  # and are hidden from every read
+  assert client.get(f'/venues/{venue}').status_code == 404
+  assert client.get(f'/api/v1/venues/{venue}').status_code == 404
+  assert b'Venue 0' not in client.get('/venues').data
+  assert b'Venue 0' not in client.post('/venues/search', data={'search_term': 'Venue'}).data
+  assert f'/venues/{venue}"'.encode() not in client.get(f'/artists/{artist}').data
+  assert client.get(f'/venues/{kept}').status_code == 200
+  assert db.session.get(Venue, venue) is None
+  assert db.session.query(Venue).execution_options(include_deleted=True).filter(
+      Venue.id == venue).one().deleted_at is not None
+
+  # a second soft delete finds nothing left to delete
+  assert client.delete(f'/venues/{venue}').status_code == 404
+
+
+def test_artists_are_deleted_like_venues(app):
+  client = app.test_client()
+  venues, artist = add_catalog()
+
+  response = client.post('/artists/delete', json={'ids': [artist]})
+  assert response.get_json()['data']['deleted'] == [artist]
+  assert count(Show.__table__) == 0
+  assert client.get(f'/artists/{artist}').status_code == 404
+  assert all(client.get(f'/venues/{venue}').status_code == 200 for venue in venues)
@@ -0,0 +1,66 @@
+"""Edits post back the version they were filled from; a stale one is
+answered with 409 and changes nothing."""
+
+from models import Artist, Venue, db
+
+
+def add_venue():
+  venue = Venue(name='The Musical Hop', city='San Francisco', state='CA',
+                address='1015 Folsom Street', phone='555-0100', genres=['Jazz'])
+  db.session.add(venue)
+  db.session.commit()
+  return venue.id
+
+
+def edit(client, kind, entity_id, version, **fields):
+  return client.post(f'/{kind}/{entity_id}/edit', data=dict(fields, version=str(version)))
+
+
+def row(model, entity_id):
+  db.session.expire_all()
+  return db.session.get(model, entity_id)
+
+
+def test_edit_with_the_current_version_bumps_it(app):
+  client = app.test_client()
+  venue = add_venue()
+  version = row(Venue, venue).version
+
+  response = edit(client, 'venues', venue, version, name='The Dueling Pianos Bar')
+  assert response.status_code == 302
+  assert row(Venue, venue).name == 'The Dueling Pianos Bar'
+  assert row(Venue, venue).version == version + 1
+
+  # the form now carries the new version
+  assert f'name="version" value="{version + 1}"'.encode() in client.get(f'/venues/{venue}/edit').data
+
+
+def test_edit_with_a_stale_version_is_refused(app):
+  client = app.test_client()
+  venue = add_venue()
+  version = row(Venue, venue).version
+  assert edit(client, 'venues', venue, version, name='Park Square Live').status_code == 302
+
+  # a second editor still holding the old version
+  response = edit(client, 'venues', venue, version, name='The Dueling Pianos Bar', city='Austin')
+  assert response.status_code == 409
+  assert b'was changed by someone else while you were editing' in response.data
+  # resubmitting means overwriting the current version
+  assert f'name="version" value="{version + 1}"'.encode() in response.data
+  current = row(Venue, venue)
+  assert (current.name, current.city, current.version) == (
+      'Park Square Live', 'San Francisco', version + 1)
+
+
+def test_stale_artist_edits_are_refused_too(app):
+  client = app.test_client()
+  artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', phone='555-0100')
+  db.session.add(artist)
+  db.session.commit()
+  artist_id, version = artist.id, artist.version
+
+  assert edit(client, 'artists', artist_id, version, phone='555-0199').status_code == 302
+  assert edit(client, 'artists', artist_id, version, phone='555-0111').status_code == 409
+  assert row(Artist, artist_id).phone == '555-0199'
+
+  assert edit(client, 'artists', artist_id + 100, version, phone='555-0111').status_code == 404
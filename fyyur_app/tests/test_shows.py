@@ -0,0 +1,82 @@
+"""Double bookings are refused and /venues/<id>/availability lists the
+gaps between a venue's shows."""
+
+from datetime import datetime, timedelta
+
+from models import Artist, Show, Venue, db
+
+DAY = (datetime.now() + timedelta(days=10)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_catalog():
+  venues = [Venue(name=f'Venue {number}', city='Austin', state='TX', address='1 Main St',
+                  phone='555-0100') for number in range(2)]
+  artists = [Artist(name=f'Artist {number}', city='Austin', state='TX', phone='555-0100')
+             for number in range(2)]
+  db.session.add_all(venues + artists)
+  db.session.commit()
+  return [venue.id for venue in venues], [artist.id for artist in artists]
+
+
+def book(client, venue_id, artist_id, start, minutes=120):
+  return client.post('/shows/create', data={
+      'venue_id': str(venue_id), 'artist_id': str(artist_id),
+      'start_time': start.isoformat(' '), 'duration': str(minutes)})
+
+
+def shows():
+  return db.session.query(Show.venue_id, Show.artist_id, Show.starting_time).order_by(Show.id).all()
+
+
+def test_overlapping_bookings_are_refused(app):
+  client = app.test_client()
+  (venue, other_venue), (artist, other_artist) = add_catalog()
+  eight = DAY.replace(hour=20)
+  assert b'successfully listed' in book(client, venue, artist, eight).data
+
+  # the venue, then the artist, is taken from 20:00 to 22:00
+  response = book(client, venue, other_artist, eight + timedelta(hours=1))
+  assert b'the venue is already booked' in response.data
+  response = book(client, other_venue, artist, eight - timedelta(minutes=30))
+  assert b'the artist is already booked' in response.data
+  assert len(shows()) == 1
+
+  # back to back is fine
+  assert b'successfully listed' in book(client, venue, other_artist, eight + timedelta(hours=2)).data
+  assert len(shows()) == 2
+
+
+def test_shows_for_unknown_venue_or_artist_are_refused(app):
+  client = app.test_client()
+  (venue, _), (artist, _) = add_catalog()
+  assert b'could not be listed' in book(client, venue + 100, artist, DAY.replace(hour=20)).data
+  assert b'could not be listed' in book(client, venue, artist + 100, DAY.replace(hour=20)).data
+  assert shows() == []
+
+
+def test_availability_lists_the_gaps_between_shows(app):
+  client = app.test_client()
+  (venue, _), (artist, other_artist) = add_catalog()
+  book(client, venue, artist, DAY.replace(hour=12), minutes=60)
+  book(client, venue, other_artist, DAY.replace(hour=18), minutes=180)
+
+  response = client.get(f'/venues/{venue}/availability', query_string={
+      'from': DAY.replace(hour=10).isoformat(), 'to': DAY.replace(hour=23).isoformat()})
+  assert response.status_code == 200
+  free = [(datetime.fromisoformat(slot['start']).hour, datetime.fromisoformat(slot['end']).hour)
+          for slot in response.get_json()['data']['free']]
+  assert free == [(10, 12), (13, 18), (21, 23)]
+
+  response = client.get(f'/venues/{venue}/availability', query_string={
+      'from': DAY.replace(hour=10).isoformat(), 'to': DAY.replace(hour=23).isoformat(),
+      'min_minutes': 180})
+  assert len(response.get_json()['data']['free']) == 1
+
+
+def test_availability_rejects_bad_ranges(app):
+  client = app.test_client()
+  (venue, _), _ = add_catalog()
+  assert client.get(f'/venues/{venue}/availability?from=yesterday').status_code == 400
+  assert client.get(f'/venues/{venue}/availability', query_string={
+      'from': DAY.isoformat(), 'to': (DAY - timedelta(hours=1)).isoformat()}).status_code == 400
+  assert client.get(f'/venues/{venue + 100}/availability').status_code == 404
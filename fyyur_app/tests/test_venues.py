@@ -0,0 +1,51 @@
+"""/venues issues the same number of SQL statements however many venues
+there are."""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from models import Artist, Show, Venue, db
+
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX')]
+GENRES = ['Jazz', 'Folk', 'Rock']
+
+
+def add_venues(count):
+  artist = Artist(name='Touring Band', city='Austin', state='TX', genres=['Jazz'])
+  db.session.add(artist)
+  start = Venue.query.count()
+  for number in range(start, start + count):
+    city, state = CITIES[number % len(CITIES)]
+    venue = Venue(name=f'Venue {number}', city=city, state=state, address='1 Main St',
+                  phone='555-0100', genres=[GENRES[number % len(GENRES)]])
+    starting_time = datetime.now() + timedelta(days=number + 1)
+    db.session.add(venue)
+    db.session.add(Show(artist=artist, venue=venue, starting_time=starting_time,
+                        ending_time=starting_time + timedelta(hours=2)))
+  db.session.commit()
+
+
+def statements_for(client, url):
+  statements = []
+
+  def count(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+  event.listen(db.engine, 'before_cursor_execute', count)
+  try:
+    response = client.get(url)
+  finally:
+    event.remove(db.engine, 'before_cursor_execute', count)
+  assert response.status_code == 200
+  return statements
+
+
+def test_venues_statement_count_does_not_grow_with_venues(app):
+  client = app.test_client()
+  add_venues(10)
+  few = statements_for(client, '/venues')
+  add_venues(10)
+  many = statements_for(client, '/venues')
+  assert b'Venue 19' in client.get('/venues').data
+  assert len(many) == len(few), many
@@ -0,0 +1,365 @@
+"""In-memory prefix index for venue and artist name completion.
+
+Names are normalized (accents folded, case folded, punctuation collapsed
+to single spaces) and kept in two sorted lists of ``key\\0ref`` strings:
+whole names, and each name from its second word on, so 'blue' finds both
+'Blue Note' and 'The Blue Room'. A lookup is two ``bisect`` calls and a
+scan of at most the matches it returns, with no database round-trip.
+
+Each web process builds its index in a background thread on its first
+request; until it is ready, ``complete`` is False and callers fall back to
+the database. Commits update it in place: ORM writes to the registered
+models are picked up from the session, and set-based statements report
+the rows they touched through ``refresh_on_commit``. Writes made by other
+processes are caught up every ``TYPEAHEAD_SYNC_INTERVAL`` seconds from the
+rows' ``updated_at`` (and a live-row count, for hard deletes).
+
+``TYPEAHEAD_MAX_BYTES`` bounds the index's estimated size. Past it, names
+are indexed without their word keys, then not at all; an index missing
+names reports itself incomplete.
+"""
+
+import logging
+import re
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, event, func, select
+from sqlalchemy.orm import Session, attributes
+
+logger = logging.getLogger(__name__)
+
+_PENDING = 'typeahead.pending'
+_SEPARATOR = '\0'
+_NON_WORD = re.compile(r'[^\w]+')
+# list slot, plus the ref dict entry, per key (estimated)
+_KEY_OVERHEAD = 8
+_ENTITY_OVERHEAD = 120
+
+
+def normalize(text):
+  """Lower-case, accent-free words of ``text`` separated by single spaces."""
+  text = unicodedata.normalize('NFKD', text or '')
+  text = ''.join(c for c in text if not unicodedata.combining(c))
+  return _NON_WORD.sub(' ', text.casefold().replace('_', ' ')).strip()
+
+
+def _indexed(table):
+  # the rows of table the index holds: live ones with a name
+  return and_(table.c.deleted_at.is_(None), table.c.name.isnot(None), table.c.name != '')
+
+
+class PrefixIndex(object):
+  """Sorted-array prefix index of ``ref -> name``, refs being ``kind:id``,
+  with separate arrays per kind. Thread-safe."""
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    # names indexed without their word keys, and names left out
+    self.truncated = 0
+    self.dropped = 0
+    self._names = {}
+    self._words = {}
+    self._entities = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entities)
+
+  def refs(self, kind):
+    prefix = kind + ':'
+    with self._lock:
+      return {ref for ref in self._entities if ref.startswith(prefix)}
+
+  @staticmethod
+  def keys(ref, name):
+    words = normalize(name).split(' ')
+    if not words[0]:
+      return [], []
+    return ([' '.join(words) + _SEPARATOR + ref],
+            [' '.join(words[i:]) + _SEPARATOR + ref for i in range(1, len(words))])
+
+  def add(self, ref, name):
+    kind = ref.partition(':')[0]
+    with self._lock:
+      self._remove(ref)
+      names, words = self.keys(ref, name)
+      size = _ENTITY_OVERHEAD + sys.getsizeof(name) + sum(
+          sys.getsizeof(key) + _KEY_OVERHEAD for key in names)
+      if self.bytes + size > self.max_bytes:
+        self.dropped += 1
+        return False
+      word_size = sum(sys.getsizeof(key) + _KEY_OVERHEAD for key in words)
+      if self.bytes + size + word_size > self.max_bytes:
+        # over budget: the name is still found by its start
+        words = []
+        self.truncated += 1
+      else:
+        size += word_size
+      for key in names:
+        insort(self._names.setdefault(kind, []), key)
+      for key in words:
+        insort(self._words.setdefault(kind, []), key)
+      self._entities[ref] = (name, size, bool(words))
+      self.bytes += size
+      return True
+
+  def load(self, entries):
+    """Index ``(ref, name)`` pairs in bulk: every whole name first, then
+    word keys while the budget lasts; each array is sorted once."""
+    with self._lock:
+      pending = []
+      for ref, name in entries:
+        names, words = self.keys(ref, name)
+        if not names or ref in self._entities:
+          continue
+        size = _ENTITY_OVERHEAD + sys.getsizeof(name) + sum(
+            sys.getsizeof(key) + _KEY_OVERHEAD for key in names)
+        if self.bytes + size > self.max_bytes:
+          self.dropped += 1
+          continue
+        kind = ref.partition(':')[0]
+        self._names.setdefault(kind, []).extend(names)
+        self._entities[ref] = (name, size, False)
+        self.bytes += size
+        pending.append((ref, kind, words))
+      for ref, kind, words in pending:
+        if not words:
+          continue
+        word_size = sum(sys.getsizeof(key) + _KEY_OVERHEAD for key in words)
+        if self.bytes + word_size > self.max_bytes:
+          self.truncated += 1
+          continue
+        self._words.setdefault(kind, []).extend(words)
+        name, size, _ = self._entities[ref]
+        self._entities[ref] = (name, size + word_size, True)
+        self.bytes += word_size
+      for keys in list(self._names.values()) + list(self._words.values()):
+        keys.sort()
+
+  def remove(self, ref):
+    with self._lock:
+      self._remove(ref)
+
+  def _remove(self, ref):
+    entry = self._entities.pop(ref, None)
+    if entry is None:
+      return
+    name, size, with_words = entry
+    kind = ref.partition(':')[0]
+    names, words = self.keys(ref, name)
+    for keys, key in [(self._names[kind], key) for key in names] + (
+        [(self._words[kind], key) for key in words] if with_words else []):
+      i = bisect_left(keys, key)
+      if i < len(keys) and keys[i] == key:
+        del keys[i]
+    self.bytes -= size
+
+  def search(self, prefix, limit, kind=None):
+    """Up to ``limit`` (ref, name) pairs whose name, or a word of it from
+    where it starts, begins with ``prefix``; whole-name matches first."""
+    prefix = normalize(prefix)
+    if not prefix:
+      return []
+    found = {}
+    with self._lock:
+      for arrays in (self._names, self._words):
+        for keys in ([arrays.get(kind, [])] if kind else arrays.values()):
+          i = bisect_left(keys, prefix)
+          while i < len(keys) and len(found) < limit and keys[i].startswith(prefix):
+            ref = keys[i].rpartition(_SEPARATOR)[2]
+            if ref not in found:
+              found[ref] = self._entities[ref][0]
+            i += 1
+    return list(found.items())
+
+
+class Typeahead(object):
+
+  def __init__(self, db, app=None):
+    self.db = db
+    self.models = {}
+    self._states = {}
+    self._lock = threading.Lock()
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault('TYPEAHEAD_ENABLED', True)
+    app.config.setdefault('TYPEAHEAD_MAX_BYTES', 64 * 1024 * 1024)
+    app.config.setdefault('TYPEAHEAD_SYNC_INTERVAL', 30)
+    app.extensions['typeahead'] = self
+    if app.config['TYPEAHEAD_ENABLED']:
+      # built on the first request, so a pre-fork server builds one per child
+      app.before_request(lambda: self._ensure_built(app))
+    if not event.contains(Session, 'after_flush', self._collect):
+      event.listen(Session, 'after_flush', self._collect)
+      event.listen(Session, 'after_commit', self._apply_pending)
+      event.listen(Session, 'after_soft_rollback', self._discard_pending)
+
+  def register(self, kind, model):
+    """Index the names of ``model`` rows (with ``name``, ``updated_at`` and
+    ``deleted_at`` columns) as ``kind``."""
+    self.models[kind] = model
+
+  def refresh_on_commit(self, session, model, ids):
+    """Re-read rows ``ids`` of ``model`` into the index once ``session``
+    commits; for writes that bypass the ORM."""
+    session.info.setdefault(_PENDING, {}).setdefault(model, set()).update(ids)
+
+  def state(self, app):
+    """The per-app index state, its build started on first use."""
+    with self._lock:
+      state = self._states.get(app)
+      if state is None:
+        state = self._states[app] = _State(PrefixIndex(app.config['TYPEAHEAD_MAX_BYTES']))
+        threading.Thread(target=self._build, args=(app, state), name='typeahead-build',
+                         daemon=True).start()
+    return state
+
+  def _ensure_built(self, app):
+    self.state(app)
+
+  def search(self, prefix, limit=10, kind=None):
+    """``(complete, [(kind, id, name)...])`` from the current app's index;
+    when ``complete`` is False the index is not ready or over budget and
+    the caller should ask the database instead."""
+    app = current_app._get_current_object()
+    if not app.config['TYPEAHEAD_ENABLED']:
+      return False, []
+    state = self.state(app)
+    if not state.ready:
+      return False, []
+    if time.monotonic() - state.synced_at > app.config['TYPEAHEAD_SYNC_INTERVAL']:
+      self._sync(state)
+    results = [(ref.partition(':')[0], int(ref.partition(':')[2]), name)
+               for ref, name in state.index.search(prefix, limit, kind)]
+    return not state.index.dropped, results
+
+  def _build(self, app, state):
+    try:
+      with app.app_context():
+        with self.db.engine.connect() as connection:
+          for kind, model in self.models.items():
+            table = model.__table__
+            rows = connection.execute(
+                select(table.c.id, table.c.name, table.c.updated_at)
+                .where(table.c.deleted_at.is_(None)))
+            entries = []
+            for row in rows:
+              if row.name:
+                entries.append((f'{kind}:{row.id}', row.name))
+              state.watermark(kind, row.updated_at)
+            state.index.load(entries)
+    except Exception:
+      logger.exception('building the typeahead index failed')
+      with self._lock:
+        self._states.pop(app, None)
+      return
+    state.synced_at = time.monotonic()
+    state.ready = True
+    logger.info('typeahead index built: %d names, ~%d KiB',
+                len(state.index), state.index.bytes // 1024)
+
+  def _sync(self, state):
+    # catch up on writes committed by other processes
+    if not state.syncing.acquire(blocking=False):
+      return
+    try:
+      with self.db.engine.connect() as connection:
+        for kind, model in self.models.items():
+          table = model.__table__
+          since = state.watermarks.get(kind)
+          query = select(table.c.id, table.c.name, table.c.updated_at, table.c.deleted_at)
+          if since is not None:
+            query = query.where(table.c.updated_at >= since)
+          for row in connection.execute(query):
+            self._put(state, kind, row)
+          # counted like _put indexes: a nameless row would never match
+          live = connection.execute(
+              select(func.count(table.c.id)).where(_indexed(table))).scalar()
+          refs = state.index.refs(kind)
+          if not state.index.dropped and live != len(refs):
+            # rows deleted outright elsewhere: reload this kind
+            present = set()
+            for row in connection.execute(
+                select(table.c.id, table.c.name, table.c.updated_at, table.c.deleted_at)
+                .where(_indexed(table))):
+              present.add(f'{kind}:{row.id}')
+              self._put(state, kind, row)
+            for ref in refs - present:
+              state.index.remove(ref)
+    except Exception:
+      logger.exception('syncing the typeahead index failed')
+    finally:
+      state.synced_at = time.monotonic()
+      state.syncing.release()
+
+  def _put(self, state, kind, row):
+    ref = f'{kind}:{row.id}'
+    if row.deleted_at is None and row.name:
+      state.index.add(ref, row.name)
+    else:
+      state.index.remove(ref)
+    state.watermark(kind, row.updated_at)
+
+  def _collect(self, session, flush_context):
+    kinds = set(self.models.values())
+    pending = None
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+      model = type(obj)
+      if model not in kinds:
+        continue
+      if obj in session.dirty and not any(
+          attributes.get_history(obj, name).has_changes() for name in ('name', 'deleted_at')):
+        continue
+      if pending is None:
+        pending = session.info.setdefault(_PENDING, {})
+      pending.setdefault(model, set()).add(obj.id)
+
+  def _apply_pending(self, session):
+    pending = session.info.pop(_PENDING, None)
+    if not pending or not has_app_context():
+      return
+    state = self._states.get(current_app._get_current_object())
+    if state is None:
+      return
+    kinds = {model: kind for kind, model in self.models.items()}
+    try:
+      with self.db.engine.connect() as connection:
+        for model, ids in pending.items():
+          table = model.__table__
+          rows = {row.id: row for row in connection.execute(
+              select(table.c.id, table.c.name, table.c.updated_at, table.c.deleted_at)
+              .where(table.c.id.in_(sorted(ids))))}
+          for entity_id in ids:
+            row = rows.get(entity_id)
+            if row is None:
+              state.index.remove(f'{kinds[model]}:{entity_id}')
+            else:
+              self._put(state, kinds[model], row)
+    except Exception:
+      # caught up by the next sync
+      logger.exception('updating the typeahead index failed')
+
+  def _discard_pending(self, session, previous_transaction):
+    session.info.pop(_PENDING, None)
+
+
+class _State(object):
+
+  def __init__(self, index):
+    self.index = index
+    self.ready = False
+    self.synced_at = 0.0
+    self.watermarks = {}
+    self.syncing = threading.Lock()
+
+  def watermark(self, kind, updated_at):
+    if updated_at is not None and (kind not in self.watermarks or updated_at > self.watermarks[kind]):
+      self.watermarks[kind] = updated_at
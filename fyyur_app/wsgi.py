@@ -0,0 +1,5 @@
+# WSGI entry point, e.g. `gunicorn --workers 4 wsgi:app`. Workers fork after
+# this import; create_app makes each child drop the connections it inherits.
+from app import create_app
+
+app = create_app()